@@ -6,4 +6,8 @@ from api.upload import register_upload_routes
 from api.preprocess import register_preprocess_routes
 from api.generation import register_generation_routes
 from api.filters import register_filter_routes
-from api.metrics import register_metrics_routes
\ No newline at end of file
+from api.metrics import register_metrics_routes
+from api.server_metrics import register_server_metrics_routes
+from api.tilesets import register_tileset_routes
+from api.palette import register_palette_routes
+from api.profiling import register_profiling_routes
\ No newline at end of file
@@ -7,7 +7,10 @@ from PIL import Image
 import os
 from utils.validation import validate_job_id, validate_filter
 from utils.file_utils import get_file_path, get_file_url
+from utils.output_writer import wait_for_write
 from utils.image_utils import load_and_preprocess_image, save_image
+from utils.encoders import negotiate_format, get_output_filename, open_variant
+from config import THUMBNAIL_SIZE
 from core.filters import apply_filter, apply_multiple_filters
 
 def register_filter_routes(app, job_states):
@@ -51,6 +54,7 @@ def register_filter_routes(app, job_states):
             mosaic_path = get_file_path(mosaic_filename, 'output')
             
             # Load mosaic image
+            wait_for_write(mosaic_path)
             mosaic_pil = Image.open(mosaic_path)
             
             # Apply filter
@@ -59,7 +63,7 @@ def register_filter_routes(app, job_states):
             # Save filtered image
             filtered_filename = f"{job_id}_mosaic_{filter_name}.png"
             filtered_path = get_file_path(filtered_filename, 'output')
-            filtered_mosaic.save(filtered_path)
+            save_image(filtered_mosaic, filtered_path)
             
             # Update job state
             if 'filtered_outputs' not in job_states[job_id]:
@@ -97,6 +101,11 @@ def register_filter_routes(app, job_states):
         if job_states[job_id].get('status') != 'completed' or 'final_outputs' not in job_states[job_id]:
             return jsonify({'error': 'Mosaic generation not completed for this job'}), 400
         
+        # Preview format (optional)
+        is_valid, image_format = negotiate_format(request.args.get('format'))
+        if not is_valid:
+            return jsonify({'error': image_format}), 400
+        
         try:
             # Get path to mosaic image
             mosaic_url = job_states[job_id]['final_outputs'].get('mosaic')
@@ -106,20 +115,10 @@ def register_filter_routes(app, job_states):
             mosaic_filename = os.path.basename(mosaic_url.split('/')[-1])
             mosaic_path = get_file_path(mosaic_filename, 'output')
             
-            # Load mosaic image
-            mosaic_pil = Image.open(mosaic_path)
-            
-            # Create a smaller preview for faster processing
-            preview_size = (300, 300)
-            aspect_ratio = mosaic_pil.width / mosaic_pil.height
-            if aspect_ratio > 1:
-                preview_width = preview_size[0]
-                preview_height = int(preview_width / aspect_ratio)
-            else:
-                preview_height = preview_size[1]
-                preview_width = int(preview_height * aspect_ratio)
-            
-            preview_mosaic = mosaic_pil.resize((preview_width, preview_height), Image.LANCZOS)
+            # Filter a thumbnail of the mosaic for faster processing; it is the same
+            # cached variant the image route serves for ?w=&h=
+            wait_for_write(mosaic_path)
+            preview_mosaic = open_variant(mosaic_path, 'output', (THUMBNAIL_SIZE, THUMBNAIL_SIZE, 'contain'))
             
             # Get filters to preview
             from config import AVAILABLE_FILTERS
@@ -131,9 +130,9 @@ def register_filter_routes(app, job_states):
                 filtered_preview = apply_filter(preview_mosaic, filter_name)
                 
                 # Save filtered preview
-                preview_filename = f"{job_id}_preview_{filter_name}.png"
+                preview_filename = get_output_filename(f"{job_id}_preview_{filter_name}", 'preview', image_format)
                 preview_path = get_file_path(preview_filename, 'temp')
-                filtered_preview.save(preview_path)
+                save_image(filtered_preview, preview_path, 'preview')
                 
                 # Add to outputs
                 preview_outputs[filter_name] = get_file_url(preview_filename, 'temp')
@@ -177,6 +176,11 @@ def register_filter_routes(app, job_states):
         if not valid_filters:
             return jsonify({'error': 'No valid filters provided'}), 400
         
+        # Preview format (optional)
+        is_valid, image_format = negotiate_format(request.args.get('format'))
+        if not is_valid:
+            return jsonify({'error': image_format}), 400
+        
         try:
             # Get path to mosaic image
             mosaic_url = job_states[job_id]['final_outputs'].get('mosaic')
@@ -186,8 +190,9 @@ def register_filter_routes(app, job_states):
             mosaic_filename = os.path.basename(mosaic_url.split('/')[-1])
             mosaic_path = get_file_path(mosaic_filename, 'output')
             
-            # Load mosaic image
-            mosaic_pil = Image.open(mosaic_path)
+            # Load the cached thumbnail of the mosaic
+            wait_for_write(mosaic_path)
+            original_thumb = open_variant(mosaic_path, 'output', (THUMBNAIL_SIZE, THUMBNAIL_SIZE, 'contain'))
             
             # Calculate the size of the comparison image
             max_filters = 4  # Max number of filters to show side by side
@@ -195,8 +200,7 @@ def register_filter_routes(app, job_states):
             n_cols = min(len(valid_filters) + 1, max_filters)  # +1 for original
             
             # Create comparison image
-            thumb_width = 300
-            thumb_height = int(thumb_width * mosaic_pil.height / mosaic_pil.width)
+            thumb_width, thumb_height = original_thumb.size
             
             comparison_width = thumb_width * n_cols
             comparison_height = thumb_height * n_rows
@@ -204,16 +208,12 @@ def register_filter_routes(app, job_states):
             comparison_img = Image.new('RGB', (comparison_width, comparison_height), (255, 255, 255))
             
             # Add original image
-            original_thumb = mosaic_pil.resize((thumb_width, thumb_height), Image.LANCZOS)
             comparison_img.paste(original_thumb, (0, 0))
             
             # Add filtered images
             for i, filter_name in enumerate(valid_filters):
-                # Apply filter
-                filtered_mosaic = apply_filter(mosaic_pil, filter_name)
-                
-                # Resize to thumbnail
-                filtered_thumb = filtered_mosaic.resize((thumb_width, thumb_height), Image.LANCZOS)
+                # Apply filter to the thumbnail, as the filter previews do
+                filtered_thumb = apply_filter(original_thumb, filter_name)
                 
                 # Calculate position
                 pos_i = (i + 1) // n_cols
@@ -223,9 +223,9 @@ def register_filter_routes(app, job_states):
                 comparison_img.paste(filtered_thumb, (pos_j * thumb_width, pos_i * thumb_height))
             
             # Save comparison image
-            comparison_filename = f"{job_id}_filter_comparison.png"
+            comparison_filename = get_output_filename(f"{job_id}_filter_comparison", 'preview', image_format)
             comparison_path = get_file_path(comparison_filename, 'output')
-            comparison_img.save(comparison_path)
+            save_image(comparison_img, comparison_path, 'preview')
             
             # Update job state
             job_states[job_id]['filter_comparison'] = get_file_url(comparison_filename, 'output')
@@ -8,10 +8,201 @@ import os
 from utils.validation import validate_job_id, validate_block_size
 from utils.file_utils import get_file_path, get_file_url
 from utils.image_utils import load_and_preprocess_image, save_image
-from core.mosaic import create_mosaic, create_multiresolution_mosaic
+from utils.output_writer import write_behind, is_pending
+from utils.resampling import resize
+from utils.memory import track_memory, check_memory_budget
+from core.mosaic import create_mosaic, create_multiresolution_mosaic, create_image_matrix, get_element_library, get_target_features, match_target_features
+from core.color_analysis import assemble_mosaic
 from core.metrics import evaluate_mosaic_quality
+from core.adaptive_mosaic import build_quadtree, match_adaptive_leaves, render_adaptive_mosaic, get_quadtree_stats
+from core.pipeline import get_stage_graph, trim_stage_graphs, file_fingerprint
+from core.palette import hash_image
+from core.result_cache import (
+    get_result_key, get_simple_result_key, get_result_filename, lookup_result, store_result,
+    discard_result, retain_outputs, release_outputs
+)
+from core.animation import load_frames, create_animated_mosaic, save_animation
+from core.tileset import load_tileset
 from core.legacy_mosaic import create_mosaic as legacy_create_mosaic
-from core.legacy_mosaic import normalize_image as legacy_normalize_image
+from core.legacy_mosaic import normalize_image_to_uint8 as legacy_normalize_image_to_uint8
+from config import DEFAULT_ALPHA
+
+def apply_memory_budget(job_state, element_img, big_pil, engine='legacy', block_size=None, n_frames=1):
+    """
+    Check a job against the per-job memory budget before any mosaic is allocated.
+    
+    Args:
+        job_state: job state dictionary
+        element_img: element image (numpy array)
+        big_pil: target image (PIL Image)
+        engine: 'legacy', 'block' or 'quadtree'
+        block_size: block size for the block engine
+        n_frames: number of target frames of this size (animations)
+        
+    Returns:
+        tuple: (big_pil, error_message) - the target, downgraded if needed, or an error
+    """
+    from config import MEMORY_BUDGET_POLICY, MAX_JOB_MEMORY_BYTES
+    
+    # Every frame costs as much as a still, so count frames as extra channels
+    target_shape = (big_pil.height, big_pil.width, len(big_pil.getbands()) * n_frames)
+    within_budget, estimate, adjusted_dims = check_memory_budget(element_img.shape, target_shape, engine, block_size)
+    job_state['memory_estimate'] = estimate
+    
+    if within_budget:
+        return big_pil, None
+    
+    if MEMORY_BUDGET_POLICY == 'reject':
+        return big_pil, (f'Estimated peak memory of {estimate} bytes exceeds the per-job budget '
+                         f'of {MAX_JOB_MEMORY_BYTES} bytes')
+    
+    # Downgrade by shrinking the target until the estimate fits
+    adjusted_h, adjusted_w = adjusted_dims
+    big_pil = resize(big_pil, (adjusted_w, adjusted_h), 'final')
+    job_state['memory_budget'] = {
+        'action': 'downgraded',
+        'original_target_shape': [target_shape[0], target_shape[1]],
+        'adjusted_target_shape': [adjusted_h, adjusted_w]
+    }
+    return big_pil, None
+
+def watch_output_write(future, job_state, result_key=None):
+    """
+    Mark a job as failed if a background write of one of its outputs fails.
+
+    Call this after the job is marked completed: a write that already failed
+    runs the callback at once, so the error is never overwritten.
+
+    Args:
+        future: future returned by write_behind
+        job_state: state of the job the output belongs to
+        result_key: memoised result to drop on failure, if any
+    """
+    def done(future):
+        if future.cancelled() or future.exception() is None:
+            return
+        job_state['status'] = 'error'
+        job_state['error'] = f'Failed to write output: {future.exception()}'
+        if result_key:
+            discard_result(result_key)
+
+    future.add_done_callback(done)
+
+def run_engine_stages(graph, job_id, job_states, engine, element_img, big_img, block_size, color_mode, color_method, alpha, tileset_id=None, tileset_library=None):
+    """
+    Run the engine-specific generation stages of a job through its stage graph.
+    
+    Args:
+        graph: the job's StageGraph, with the 'element' and 'target' stages already run
+        job_id: job ID, for progress and quadtree statistics
+        job_states: dictionary of job states
+        engine: 'block', 'quadtree' or 'legacy'
+        element_img: element image (numpy array)
+        big_img: budgeted target image (numpy array)
+        block_size: (largest) block size
+        color_mode: 'rgb' or 'grayscale'
+        color_method: colour matching method
+        alpha: colour adjustment alpha
+        tileset_id: tile set used instead of the element, if any
+        tileset_library: ElementLibrary of the tile set at block_size
+        
+    Returns:
+        tuple: (mosaic, simple_mosaic) as uint8 arrays or TiledImage
+    """
+    job_state = job_states[job_id]
+    
+    if engine == 'block':
+        # Features, library and matches survive alpha changes; only the colour adjustment reruns
+        with track_memory(job_state, 'create_mosaic'):
+            library = graph.run(
+                'library',
+                (block_size, color_method, tileset_id),
+                lambda: tileset_library if tileset_library is not None else get_element_library(element_img, block_size, color_method),
+                depends=('element',)
+            )
+            features = graph.run(
+                'features',
+                (block_size, color_method),
+                lambda: get_target_features(big_img, block_size, color_method),
+                depends=('target',)
+            )
+            match_indices = graph.run(
+                'matches',
+                (engine,),
+                lambda: match_target_features(features, library, color_method),
+                depends=('features', 'library')
+            )
+            mosaic_norm = graph.run(
+                'mosaic',
+                (alpha,),
+                lambda: assemble_mosaic(library.blocks, library.means, match_indices, features['means'], alpha=alpha),
+                depends=('matches',)
+            )
+            n_blocks_h, n_blocks_w = match_indices.shape
+            simple_mosaic_norm = graph.run(
+                'simple_mosaic',
+                (n_blocks_h, n_blocks_w, block_size),
+                lambda: create_image_matrix(element_img, (n_blocks_h, n_blocks_w), block_size),
+                depends=('element',)
+            )
+    elif engine == 'quadtree':
+        # Adaptive block sizes from block_size down to MIN_BLOCK_SIZE
+        from config import MIN_BLOCK_SIZE, QUADTREE_VARIANCE_THRESHOLD
+        
+        if tileset_id:
+            def library_loader(size):
+                return load_tileset(tileset_id, block_size=size, color_mode=color_mode, method=color_method)
+        else:
+            def library_loader(size):
+                return get_element_library(element_img, size, color_method)
+        
+        # Crop to whole root blocks
+        n_roots_h = big_img.shape[0] // block_size
+        n_roots_w = big_img.shape[1] // block_size
+        cropped_img = big_img[:n_roots_h * block_size, :n_roots_w * block_size]
+        
+        with track_memory(job_state, 'create_mosaic'):
+            leaves = graph.run(
+                'quadtree',
+                (block_size, MIN_BLOCK_SIZE, QUADTREE_VARIANCE_THRESHOLD),
+                lambda: build_quadtree(cropped_img, block_size, MIN_BLOCK_SIZE, QUADTREE_VARIANCE_THRESHOLD),
+                depends=('target',)
+            )
+            matched = graph.run(
+                'matches',
+                (engine, color_method, tileset_id),
+                lambda: match_adaptive_leaves(cropped_img, leaves, color_method, library_loader, job_id, job_states),
+                depends=('quadtree', 'element')
+            )
+            mosaic_norm = graph.run(
+                'mosaic',
+                (alpha,),
+                lambda: render_adaptive_mosaic(cropped_img.shape, matched, alpha),
+                depends=('matches',)
+            )
+            simple_mosaic_norm = graph.run(
+                'simple_mosaic',
+                (n_roots_h, n_roots_w, block_size),
+                lambda: create_image_matrix(element_img, (n_roots_h, n_roots_w), block_size),
+                depends=('element',)
+            )
+        job_state['quadtree'] = get_quadtree_stats(leaves, cropped_img.shape, MIN_BLOCK_SIZE)
+    else:
+        # Use legacy implementation for high quality results
+        def create_legacy_mosaics():
+            with track_memory(job_state, 'create_mosaic'):
+                mosaic, simple_mosaic = legacy_create_mosaic(element_img, big_img)
+            
+            # Normalize in place to uint8 for saving
+            with track_memory(job_state, 'normalize'):
+                return (legacy_normalize_image_to_uint8(mosaic, inplace=True),
+                        legacy_normalize_image_to_uint8(simple_mosaic, inplace=True))
+        
+        # The legacy engine has no alpha, so both images form one stage
+        mosaic_norm, simple_mosaic_norm = graph.run('mosaic', (engine,), create_legacy_mosaics, depends=('element', 'target'))
+        graph.run('simple_mosaic', (engine,), lambda: simple_mosaic_norm, depends=('mosaic',))
+    
+    return mosaic_norm, simple_mosaic_norm
 
 def register_generation_routes(app, job_states):
     """
@@ -30,6 +221,16 @@ def register_generation_routes(app, job_states):
         if not is_valid:
             return jsonify({'error': error}), 404
         
+        # Stages whose inputs are unchanged since the last run are reused; one
+        # pass at a time per job, so concurrent requests do not interleave
+        graph = get_stage_graph(job_id)
+        with graph.pass_lock:
+            response = generate_mosaic_pass(job_id, graph)
+        trim_stage_graphs()
+        return response
+    
+    def generate_mosaic_pass(job_id, graph):
+        """Run one generation pass of a job over its stage graph"""
         try:
             # Get paths
             element_path = job_states[job_id]['resized_element_path']
@@ -39,48 +240,123 @@ def register_generation_routes(app, job_states):
             block_size = job_states[job_id]['block_size']
             color_mode = job_states[job_id].get('color_mode', 'rgb')
             color_method = job_states[job_id].get('color_method', 'average_rgb')
+            alpha = job_states[job_id].get('alpha', DEFAULT_ALPHA)
+            tileset_id = job_states[job_id].get('tileset_id')
             
-            # Load images
-            element_pil = load_and_preprocess_image(element_path, color_mode=color_mode)
-            big_pil = load_and_preprocess_image(big_path, color_mode=color_mode)
-            
-            # Convert to numpy arrays
-            element_img = np.array(element_pil)
-            big_img = np.array(big_pil)
-            
-            # Update job state
-            job_states[job_id]['status'] = 'generating_mosaic'
-            job_states[job_id]['progress'] = 30
+            # Tile set jobs match blocks against the tile library instead of the element
+            engine = job_states[job_id].get('engine', 'legacy')
+            if tileset_id and engine == 'legacy':
+                engine = 'block'
             
-            # Use legacy implementation for high quality results
-            mosaic, simple_mosaic = legacy_create_mosaic(element_img, big_img)
+            job_state = job_states[job_id]
             
-            # Normalize and convert to uint8 for saving
-            mosaic_norm = (legacy_normalize_image(mosaic) * 255).astype(np.uint8)
-            simple_mosaic_norm = (legacy_normalize_image(simple_mosaic) * 255).astype(np.uint8)
-            
-            # Save output images
-            mosaic_filename = f"{job_id}_mosaic.png"
-            simple_mosaic_filename = f"{job_id}_simple_mosaic.png"
+            graph.reset_log()
             
-            mosaic_path = get_file_path(mosaic_filename, 'output')
-            simple_mosaic_path = get_file_path(simple_mosaic_filename, 'output')
-            
-            # Save images
-            save_image(mosaic_norm, mosaic_path)
-            save_image(simple_mosaic_norm, simple_mosaic_path)
+            # Load images
+            with track_memory(job_state, 'load'):
+                element_img = graph.run(
+                    'element',
+                    (file_fingerprint(element_path), color_mode),
+                    lambda: np.array(load_and_preprocess_image(element_path, color_mode=color_mode))
+                )
+                target_pil = graph.run(
+                    'decode_target',
+                    (file_fingerprint(big_path), color_mode),
+                    lambda: load_and_preprocess_image(big_path, color_mode=color_mode).copy()
+                )
+                
+                tileset_library = None
+                if tileset_id:
+                    tileset_library = load_tileset(tileset_id, block_size=block_size, color_mode=color_mode, method=color_method)
+                    if tileset_library is None:
+                        return jsonify({'error': 'Tile set not found'}), 404
+            
+            # Check the memory budget before allocating the mosaic
+            big_pil, budget_error = apply_memory_budget(job_state, element_img, target_pil, engine=engine, block_size=block_size)
+            if budget_error:
+                job_state['status'] = 'error'
+                job_state['error'] = budget_error
+                return jsonify({'error': budget_error}), 413
+            
+            # Convert to numpy array
+            big_img = graph.run('target', big_pil.size, lambda: np.array(big_pil), depends=('decode_target',))
+            
+            # Identical inputs and parameters are served from the result cache
+            element_hash = graph.run('element_hash', (), lambda: hash_image(element_img), depends=('element',))
+            target_hash = graph.run('target_hash', (), lambda: hash_image(big_img), depends=('target',))
+            result_key = get_result_key(
+                element_hash, target_hash, block_size, color_mode, color_method, engine,
+                # The legacy engine does not adjust colours
+                None if engine == 'legacy' else alpha,
+                tileset_id
+            )
+            result = lookup_result(result_key, job_id)
+            cached = result is not None
+            writes = []
+            
+            if cached:
+                job_state.update(result['details'])
+            else:
+                # Update job state
+                job_states[job_id]['status'] = 'generating_mosaic'
+                job_states[job_id]['progress'] = 30
+                
+                mosaic_norm, simple_mosaic_norm = run_engine_stages(
+                    graph, job_id, job_states, engine, element_img, big_img, block_size,
+                    color_mode, color_method, alpha, tileset_id, tileset_library
+                )
+                
+                # Save output images; the simple mosaic does not depend on the colour
+                # method or alpha, so its name does not either
+                simple_key = get_simple_result_key(
+                    element_hash, big_img.shape, None if engine == 'legacy' else block_size, color_mode, engine
+                )
+                mosaic_filename = get_result_filename(result_key, 'mosaic')
+                simple_mosaic_filename = get_result_filename(simple_key, 'simple_mosaic')
+                retain_outputs(job_id, (mosaic_filename, simple_mosaic_filename))
+                
+                mosaic_path = get_file_path(mosaic_filename, 'output')
+                simple_mosaic_path = get_file_path(simple_mosaic_filename, 'output')
+                
+                # Encode both images on the writer pool, unless the same pixels were already
+                # encoded; the writes overlap with the metrics and the response, and the
+                # image routes wait for them
+                for stage, path in (('encode_mosaic', mosaic_path), ('encode_simple_mosaic', simple_mosaic_path)):
+                    if not is_pending(path) and not os.path.exists(path):
+                        graph.invalidate(stage)
+                writes = [
+                    graph.run('encode_mosaic', (mosaic_path,), lambda: write_behind(mosaic_path, save_image, mosaic_norm, mosaic_path), depends=('mosaic',)),
+                    graph.run('encode_simple_mosaic', (simple_mosaic_path,), lambda: write_behind(simple_mosaic_path, save_image, simple_mosaic_norm, simple_mosaic_path), depends=('simple_mosaic',))
+                ]
+                
+                # Calculate quality metrics
+                with track_memory(job_state, 'metrics'):
+                    metrics = graph.run('metrics', (), lambda: evaluate_mosaic_quality(big_img, mosaic_norm), depends=('target', 'mosaic'))
+                
+                # Memoise the result under its key-derived filenames
+                details = {'quadtree': job_state['quadtree']} if engine == 'quadtree' else None
+                result = store_result(result_key, {'mosaic': mosaic_filename, 'simple_mosaic': simple_mosaic_filename}, metrics, details)
             
-            # Calculate quality metrics
-            metrics = evaluate_mosaic_quality(big_img, mosaic_norm)
+            job_state['stages'] = {'ran': graph.ran, 'reused': graph.reused, 'cached_bytes': graph.nbytes}
+            metrics = result['metrics']
             
             # Update job state
             job_states[job_id]['status'] = 'completed'
             job_states[job_id]['progress'] = 100
             job_states[job_id]['final_outputs'] = {
-                'mosaic': get_file_url(mosaic_filename, 'output'),
-                'simple_mosaic': get_file_url(simple_mosaic_filename, 'output')
+                name: get_file_url(filename, 'output') for name, filename in result['outputs'].items()
             }
             job_states[job_id]['metrics'] = metrics
+            # Outputs of the job's previous result may now be deleted
+            release_outputs(job_id, keep=result['outputs'].values())
+            for future in writes:
+                watch_output_write(future, job_state, result_key)
+            
+            # Outputs still being encoded; their URLs wait for the write or answer 202
+            pending_outputs = [
+                name for name, filename in result['outputs'].items()
+                if is_pending(get_file_path(filename, 'output'))
+            ]
             
             return jsonify({
                 'job_id': job_id,
@@ -89,9 +365,15 @@ def register_generation_routes(app, job_states):
                 'block_size': block_size,
                 'color_mode': color_mode,
                 'color_method': color_method,
+                'alpha': alpha,
+                'engine': engine,
+                'tileset_id': tileset_id,
                 'intermediate_outputs': job_states[job_id]['intermediate_outputs'],
                 'final_outputs': job_states[job_id]['final_outputs'],
                 'metrics': metrics,
+                'cached': cached,
+                'stages': job_state['stages'],
+                'pending_outputs': pending_outputs,
                 'next_step': f"/api/apply_filter/{job_id}"
             }), 200
         
@@ -116,6 +398,7 @@ def register_generation_routes(app, job_states):
             # Get parameters
             color_mode = job_states[job_id].get('color_mode', 'rgb')
             color_method = job_states[job_id].get('color_method', 'average_rgb')
+            tileset_id = job_states[job_id].get('tileset_id')
             
             # Get block sizes (can be specified in query params)
             block_sizes = request.args.get('block_sizes')
@@ -139,12 +422,22 @@ def register_generation_routes(app, job_states):
             if not validated_sizes:
                 return jsonify({'error': 'No valid block sizes provided'}), 400
             
-            # Load images
-            element_pil = load_and_preprocess_image(element_path, color_mode=color_mode)
-            big_pil = load_and_preprocess_image(big_path, color_mode=color_mode)
+            job_state = job_states[job_id]
             
-            # Convert to numpy arrays
-            element_img = np.array(element_pil)
+            # Load images
+            with track_memory(job_state, 'load'):
+                element_pil = load_and_preprocess_image(element_path, color_mode=color_mode)
+                big_pil = load_and_preprocess_image(big_path, color_mode=color_mode)
+                element_img = np.array(element_pil)
+            
+            # Check the memory budget before allocating any mosaic
+            big_pil, budget_error = apply_memory_budget(job_state, element_img, big_pil, engine='block', block_size=max(validated_sizes))
+            if budget_error:
+                job_state['status'] = 'error'
+                job_state['error'] = budget_error
+                return jsonify({'error': budget_error}), 413
+            
+            # Convert to numpy array
             big_img = np.array(big_pil)
             
             # Update job state
@@ -154,19 +447,30 @@ def register_generation_routes(app, job_states):
             # Generate mosaics at different resolutions
             results = {}
             multi_outputs = {}
+            writes = []
             
             for block_size in validated_sizes:
                 # Update job state
                 job_states[job_id]['status'] = f'generating_mosaic_size_{block_size}'
                 
+                # Use the job's tile set if it has one
+                library = None
+                if tileset_id:
+                    library = load_tileset(tileset_id, block_size=block_size, color_mode=color_mode, method=color_method)
+                    if library is None:
+                        return jsonify({'error': 'Tile set not found'}), 404
+                
                 # Generate mosaic
-                mosaic, simple_mosaic = create_mosaic(
-                    element_img,
-                    big_img,
-                    block_size,
-                    color_method=color_method,
-                    adjust_colors=True
-                )
+                with track_memory(job_state, f'create_mosaic_{block_size}'):
+                    mosaic, simple_mosaic = create_mosaic(
+                        element_img,
+                        big_img,
+                        block_size,
+                        color_method=color_method,
+                        adjust_colors=True,
+                        alpha=job_state.get('alpha', DEFAULT_ALPHA),
+                        library=library
+                    )
                 
                 # Save output images
                 mosaic_filename = f"{job_id}_mosaic_{block_size}.png"
@@ -175,9 +479,9 @@ def register_generation_routes(app, job_states):
                 mosaic_path = get_file_path(mosaic_filename, 'output')
                 simple_mosaic_path = get_file_path(simple_mosaic_filename, 'output')
                 
-                # Save images
-                save_image(mosaic, mosaic_path)
-                save_image(simple_mosaic, simple_mosaic_path)
+                # Encode images on the writer pool while the metrics are calculated
+                writes.append(write_behind(mosaic_path, save_image, mosaic, mosaic_path))
+                writes.append(write_behind(simple_mosaic_path, save_image, simple_mosaic, simple_mosaic_path))
                 
                 # Calculate quality metrics
                 metrics = evaluate_mosaic_quality(big_img, mosaic)
@@ -200,6 +504,8 @@ def register_generation_routes(app, job_states):
             job_states[job_id]['status'] = 'completed'
             job_states[job_id]['progress'] = 100
             job_states[job_id]['multi_outputs'] = multi_outputs
+            for future in writes:
+                watch_output_write(future, job_state)
             
             return jsonify({
                 'job_id': job_id,
@@ -216,6 +522,124 @@ def register_generation_routes(app, job_states):
             job_states[job_id]['status'] = 'error'
             job_states[job_id]['error'] = str(e)
             return jsonify({'error': str(e)}), 500
+
+
+    @app.route('/api/generate_animation/<job_id>', methods=['GET'])
+    def generate_animation(job_id):
+        """Generate an animated mosaic from an animated target or an uploaded frame sequence"""
+        # Validate job ID
+        is_valid, error = validate_job_id(job_id, job_states)
+        if not is_valid:
+            return jsonify({'error': error}), 404
+        
+        # Get change tolerance (optional)
+        from config import ANIMATION_CHANGE_TOLERANCE
+        try:
+            tolerance = float(request.args.get('tolerance', ANIMATION_CHANGE_TOLERANCE))
+        except ValueError:
+            return jsonify({'error': 'Invalid tolerance. Must be a number.'}), 400
+        if tolerance < 0:
+            return jsonify({'error': 'Tolerance must not be negative'}), 400
+        
+        try:
+            # Get paths
+            element_path = job_states[job_id]['resized_element_path']
+            still_path = job_states[job_id].get('adjusted_big_path') or job_states[job_id]['resized_big_path']
+            frames_path = job_states[job_id].get('frames_path') or job_states[job_id]['big_path']
+            
+            # Get parameters
+            block_size = job_states[job_id]['block_size']
+            color_mode = job_states[job_id].get('color_mode', 'rgb')
+            color_method = job_states[job_id].get('color_method', 'average_rgb')
+            tileset_id = job_states[job_id].get('tileset_id')
+            
+            job_state = job_states[job_id]
+            
+            # Frames are sized like the preprocessed still target
+            with Image.open(still_path) as still:
+                frame_size = still.size
+            
+            # Load images
+            with track_memory(job_state, 'load'):
+                element_pil = load_and_preprocess_image(element_path, color_mode=color_mode)
+                element_img = np.array(element_pil)
+                frames, durations = load_frames(frames_path, color_mode=color_mode, size=frame_size)
+                
+                library = None
+                if tileset_id:
+                    library = load_tileset(tileset_id, block_size=block_size, color_mode=color_mode, method=color_method)
+                    if library is None:
+                        return jsonify({'error': 'Tile set not found'}), 404
+            
+            # Check the memory budget for all frames before allocating the mosaics
+            first_frame, budget_error = apply_memory_budget(
+                job_state, element_img, Image.fromarray(frames[0]),
+                engine='block', block_size=block_size, n_frames=len(frames)
+            )
+            if budget_error:
+                job_state['status'] = 'error'
+                job_state['error'] = budget_error
+                return jsonify({'error': budget_error}), 413
+            if first_frame.size != frame_size:
+                frames = [resize(frame, first_frame.size, 'final') for frame in frames]
+            
+            # Update job state
+            job_states[job_id]['status'] = 'generating_animation'
+            job_states[job_id]['progress'] = 30
+            
+            # Only blocks that changed since their last render are re-matched
+            with track_memory(job_state, 'create_animation'):
+                mosaic_frames, rendered_counts = create_animated_mosaic(
+                    element_img,
+                    frames,
+                    block_size,
+                    color_method=color_method,
+                    adjust_colors=True,
+                    alpha=job_state.get('alpha', DEFAULT_ALPHA),
+                    tolerance=tolerance,
+                    job_id=job_id,
+                    job_states=job_states,
+                    library=library
+                )
+            
+            # Save the animation
+            animation_filename = f"{job_id}_mosaic.gif"
+            animation_path = get_file_path(animation_filename, 'output')
+            with track_memory(job_state, 'save'):
+                save_animation(mosaic_frames, animation_path, durations)
+            
+            blocks_per_frame = (mosaic_frames[0].shape[0] // block_size) * (mosaic_frames[0].shape[1] // block_size)
+            animation = {
+                'frames': len(mosaic_frames),
+                'blocks_per_frame': blocks_per_frame,
+                'rendered_blocks': rendered_counts,
+                'reused_fraction': 1 - sum(rendered_counts) / (blocks_per_frame * len(mosaic_frames)),
+                'tolerance': tolerance
+            }
+            
+            # Update job state
+            job_states[job_id]['status'] = 'completed'
+            job_states[job_id]['progress'] = 100
+            job_states[job_id]['final_outputs']['animation'] = get_file_url(animation_filename, 'output')
+            job_states[job_id]['animation'] = animation
+            
+            return jsonify({
+                'job_id': job_id,
+                'status': 'completed',
+                'progress': 100,
+                'block_size': block_size,
+                'color_mode': color_mode,
+                'color_method': color_method,
+                'tileset_id': tileset_id,
+                'final_outputs': job_states[job_id]['final_outputs'],
+                'animation': animation,
+                'next_step': f"/api/job/{job_id}"
+            }), 200
+        
+        except Exception as e:
+            job_states[job_id]['status'] = 'error'
+            job_states[job_id]['error'] = str(e)
+            return jsonify({'error': str(e)}), 500
             
     @app.route('/api/generate_mosaic', methods=['POST'])
     def generate_mosaic_api():
@@ -245,10 +669,18 @@ def register_generation_routes(app, job_states):
             color_mode = request.form.get('color_mode', 'rgb')
             color_method = request.form.get('color_method', 'average_rgb')
             
-            # Save files
-            from utils.file_utils import save_uploaded_file
-            job_id, element_filename, element_path = save_uploaded_file(element_file)
-            _, big_filename, big_path = save_uploaded_file(big_file, f"{job_id}_big{os.path.splitext(big_file.filename)[1]}")
+            # Save files, rejecting non-images and oversized images before decoding;
+            # only the headers are read, so the images can be decoded at a reduced size below
+            from utils.file_utils import save_uploaded_image, remove_uploaded_image
+            try:
+                job_id, element_filename, element_path, _ = save_uploaded_image(element_file, decode=False)
+            except ValueError as e:
+                return jsonify({'error': f'Invalid element image: {e}'}), 400
+            try:
+                _, big_filename, big_path, _ = save_uploaded_image(big_file, f"{job_id}_big{os.path.splitext(big_file.filename)[1]}", decode=False)
+            except ValueError as e:
+                remove_uploaded_image(element_path)
+                return jsonify({'error': f'Invalid target image: {e}'}), 400
             
             # Initialize job state
             job_states[job_id] = {
@@ -264,16 +696,20 @@ def register_generation_routes(app, job_states):
                 'metrics': {}
             }
             
+            job_state = job_states[job_id]
+            
             # Load and preprocess images
             from utils.image_utils import load_and_preprocess_image
-            element_pil = load_and_preprocess_image(element_path, color_mode=color_mode)
-            big_pil = load_and_preprocess_image(big_path, color_mode=color_mode)
-            
-            # Resize images if needed
             from config import MAX_ELEMENT_SIZE, MAX_TARGET_SIZE
-            from utils.image_utils import resize_image_if_needed
-            element_pil = resize_image_if_needed(element_pil, MAX_ELEMENT_SIZE)
-            big_pil = resize_image_if_needed(big_pil, MAX_TARGET_SIZE)
+            with track_memory(job_state, 'load'):
+                # Decode straight to near the final size
+                try:
+                    element_pil = load_and_preprocess_image(element_path, color_mode=color_mode, max_size=MAX_ELEMENT_SIZE)
+                    big_pil = load_and_preprocess_image(big_path, color_mode=color_mode, max_size=MAX_TARGET_SIZE)
+                except OSError as e:
+                    job_state['status'] = 'error'
+                    job_state['error'] = f'Invalid image: {e}'
+                    return jsonify({'error': job_state['error']}), 400
             
             # Convert to numpy arrays
             element_img = np.array(element_pil)
@@ -296,16 +732,26 @@ def register_generation_routes(app, job_states):
             if adjusted_dims != (target_h, target_w):
                 from PIL import Image
                 adjusted_h, adjusted_w = adjusted_dims
-                big_pil = big_pil.resize((adjusted_w, adjusted_h), Image.LANCZOS)
+                big_pil = resize(big_pil, (adjusted_w, adjusted_h), 'final')
                 big_img = np.array(big_pil)
+            
+            # Check the memory budget before allocating the mosaic
+            big_pil, budget_error = apply_memory_budget(job_state, element_img, big_pil)
+            if budget_error:
+                job_state['status'] = 'error'
+                job_state['error'] = budget_error
+                return jsonify({'error': budget_error}), 413
+            big_img = np.array(big_pil)
 
             # Generate mosaic using the legacy implementation
             job_states[job_id]['progress'] = 30
-            mosaic, simple_mosaic = legacy_create_mosaic(element_img, big_img)
+            with track_memory(job_state, 'create_mosaic'):
+                mosaic, simple_mosaic = legacy_create_mosaic(element_img, big_img)
             
-            # Normalize and convert to uint8 for saving
-            mosaic_norm = (legacy_normalize_image(mosaic) * 255).astype(np.uint8)
-            simple_mosaic_norm = (legacy_normalize_image(simple_mosaic) * 255).astype(np.uint8)
+            # Normalize in place to uint8 for saving
+            with track_memory(job_state, 'normalize'):
+                mosaic_norm = legacy_normalize_image_to_uint8(mosaic, inplace=True)
+                simple_mosaic_norm = legacy_normalize_image_to_uint8(simple_mosaic, inplace=True)
             
             # Save output images
             from utils.file_utils import get_file_path, get_file_url
@@ -318,12 +764,14 @@ def register_generation_routes(app, job_states):
             simple_mosaic_path = get_file_path(simple_mosaic_filename, 'output')
             
             # Save images
-            save_image(mosaic_norm, mosaic_path)
-            save_image(simple_mosaic_norm, simple_mosaic_path)
+            with track_memory(job_state, 'save'):
+                save_image(mosaic_norm, mosaic_path)
+                save_image(simple_mosaic_norm, simple_mosaic_path)
             
             # Calculate quality metrics if needed
             from core.metrics import evaluate_mosaic_quality
-            metrics = evaluate_mosaic_quality(big_img, mosaic_norm)
+            with track_memory(job_state, 'metrics'):
+                metrics = evaluate_mosaic_quality(big_img, mosaic_norm)
             
             # Update job state
             job_states[job_id]['status'] = 'completed'
@@ -11,6 +11,7 @@ from io import BytesIO
 import base64
 from utils.validation import validate_job_id
 from utils.file_utils import get_file_path, get_file_url
+from utils.output_writer import wait_for_write
 from utils.image_utils import load_and_preprocess_image
 from core.metrics import evaluate_mosaic_quality, calculate_ssim, calculate_mse, calculate_psnr
 
@@ -53,6 +54,7 @@ def register_metrics_routes(app, job_states):
                 # Load images
                 color_mode = job_states[job_id].get('color_mode', 'rgb')
                 big_pil = load_and_preprocess_image(big_path, color_mode=color_mode)
+                wait_for_write(mosaic_path)
                 mosaic_pil = Image.open(mosaic_path)
                 
                 # Convert to numpy arrays
@@ -123,6 +125,7 @@ def register_metrics_routes(app, job_states):
                 filtered_outputs = job_states[job_id]['filtered_outputs']
                 
                 # Add metrics for original mosaic
+                wait_for_write(mosaic_path)
                 original_mosaic = Image.open(mosaic_path)
                 original_img = np.array(original_mosaic)
                 original_metrics = evaluate_mosaic_quality(big_img, original_img)
@@ -194,6 +197,7 @@ def register_metrics_routes(app, job_states):
                     # Load images
                     color_mode = job_states[job_id].get('color_mode', 'rgb')
                     big_pil = load_and_preprocess_image(big_path, color_mode=color_mode)
+                    wait_for_write(mosaic_path)
                     mosaic_pil = Image.open(mosaic_path)
                     
                     # Convert to numpy arrays
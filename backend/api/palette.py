@@ -0,0 +1,102 @@
+"""
+Dominant colour palette endpoints.
+"""
+import os
+from flask import request, jsonify
+from config import PALETTE_DEFAULT_COLORS, PALETTE_MAX_COLORS
+from utils.validation import validate_job_id
+from core.palette import get_image_palette
+
+def parse_n_colors(value):
+    """
+    Parse and validate the n_colors parameter.
+
+    Args:
+        value: raw parameter value (or None for the default)
+
+    Returns:
+        tuple: (is_valid, error_message or n_colors)
+    """
+    if value is None:
+        return True, PALETTE_DEFAULT_COLORS
+    try:
+        n_colors = int(value)
+    except (ValueError, TypeError):
+        return False, 'Invalid n_colors. Must be an integer.'
+    if n_colors < 1 or n_colors > PALETTE_MAX_COLORS:
+        return False, f'n_colors must be between 1 and {PALETTE_MAX_COLORS}'
+    return True, n_colors
+
+def format_palette(palette):
+    """Add hex codes to palette entries for the UI"""
+    return [{
+        'color': list(entry['color']),
+        'hex': '#{:02x}{:02x}{:02x}'.format(*entry['color']),
+        'weight': entry['weight']
+    } for entry in palette]
+
+def register_palette_routes(app, job_states):
+    """
+    Register palette-related routes.
+
+    Args:
+        app: Flask application
+        job_states: Dictionary to store job states
+    """
+
+    @app.route('/api/palette/<job_id>', methods=['GET'])
+    def get_job_palette(job_id):
+        """Get the dominant colours of a job's target or element image"""
+        # Validate job ID
+        is_valid, error = validate_job_id(job_id, job_states)
+        if not is_valid:
+            return jsonify({'error': error}), 404
+
+        is_valid, n_colors = parse_n_colors(request.args.get('n_colors'))
+        if not is_valid:
+            return jsonify({'error': n_colors}), 400
+
+        image = request.args.get('image', 'target')
+        path_keys = {'target': 'big_path', 'element': 'element_path'}
+        if image not in path_keys:
+            return jsonify({'error': 'Invalid image. Must be "target" or "element"'}), 400
+
+        # Jobs created with /api/upload_element have no target until /api/upload_target
+        image_path = job_states[job_id].get(path_keys[image])
+        if image_path is None:
+            return jsonify({'error': f'No {image} image uploaded for this job'}), 400
+        if not os.path.exists(image_path):
+            return jsonify({'error': f'{image.capitalize()} image file not found'}), 404
+
+        try:
+            with open(image_path, 'rb') as f:
+                palette = get_image_palette(f.read(), n_colors)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        return jsonify({
+            'job_id': job_id,
+            'image': image,
+            'n_colors': n_colors,
+            'palette': format_palette(palette)
+        }), 200
+
+    @app.route('/api/palette', methods=['POST'])
+    def upload_palette():
+        """Get the dominant colours of an uploaded image"""
+        if 'image' not in request.files or request.files['image'].filename == '':
+            return jsonify({'error': 'Missing image file'}), 400
+
+        is_valid, n_colors = parse_n_colors(request.form.get('n_colors'))
+        if not is_valid:
+            return jsonify({'error': n_colors}), 400
+
+        try:
+            palette = get_image_palette(request.files['image'].read(), n_colors)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        return jsonify({
+            'n_colors': n_colors,
+            'palette': format_palette(palette)
+        }), 200
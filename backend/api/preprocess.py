@@ -3,11 +3,12 @@ Image preprocessing endpoints.
 """
 from flask import request, jsonify
 import numpy as np
-from PIL import Image
 import os
-from utils.validation import validate_job_id, validate_block_size
+from utils.validation import validate_job_id, validate_block_size, validate_engine, validate_alpha
 from utils.file_utils import get_file_path, get_file_url
 from utils.image_utils import resize_image_if_needed, check_mosaic_size, load_and_preprocess_image, save_image
+from utils.encoders import negotiate_format, get_output_filename, open_variant
+from config import THUMBNAIL_SIZE
 
 def register_preprocess_routes(app, job_states):
     """
@@ -61,8 +62,8 @@ def register_preprocess_routes(app, job_states):
             color_element_path = get_file_path(color_element_filename, 'temp')
             color_big_path = get_file_path(color_big_filename, 'temp')
             
-            element_pil.save(color_element_path)
-            big_pil.save(color_big_path)
+            save_image(element_pil, color_element_path, 'intermediate')
+            save_image(big_pil, color_big_path, 'intermediate')
             
             # Update job state with color images
             job_states[job_id]['intermediate_outputs'][f'{color_mode}_element'] = get_file_url(color_element_filename, 'temp')
@@ -75,7 +76,7 @@ def register_preprocess_routes(app, job_states):
             # Save resized element
             resized_element_filename = f"{job_id}_element_resized.png"
             resized_element_path = get_file_path(resized_element_filename, 'temp')
-            element_pil.save(resized_element_path)
+            save_image(element_pil, resized_element_path, 'intermediate')
             
             # Update job state with resized element
             job_states[job_id]['intermediate_outputs']['resized_element'] = get_file_url(resized_element_filename, 'temp')
@@ -98,7 +99,7 @@ def register_preprocess_routes(app, job_states):
                 # Save adjusted target
                 adjusted_big_filename = f"{job_id}_big_adjusted.png"
                 adjusted_big_path = get_file_path(adjusted_big_filename, 'temp')
-                big_pil.save(adjusted_big_path)
+                save_image(big_pil, adjusted_big_path, 'intermediate')
                 
                 # Update job state with adjusted target
                 job_states[job_id]['intermediate_outputs']['adjusted_big'] = get_file_url(adjusted_big_filename, 'temp')
@@ -111,7 +112,7 @@ def register_preprocess_routes(app, job_states):
             # Save resized target
             resized_big_filename = f"{job_id}_big_resized.png"
             resized_big_path = get_file_path(resized_big_filename, 'temp')
-            big_pil.save(resized_big_path)
+            save_image(big_pil, resized_big_path, 'intermediate')
             
             # Update job state with resized target
             job_states[job_id]['intermediate_outputs']['resized_big'] = get_file_url(resized_big_filename, 'temp')
@@ -168,6 +169,60 @@ def register_preprocess_routes(app, job_states):
             'message': f'Block size updated to {result}'
         }), 200
     
+    @app.route('/api/set_engine/<job_id>', methods=['POST'])
+    def set_engine(job_id):
+        """Set or update the mosaic engine for an existing job"""
+        # Validate job ID
+        is_valid, error = validate_job_id(job_id, job_states)
+        if not is_valid:
+            return jsonify({'error': error}), 404
+        
+        # Get engine from request
+        engine = (request.get_json(silent=True) or {}).get('engine')
+        if engine is None:
+            return jsonify({'error': 'Missing engine parameter'}), 400
+        
+        # Validate engine
+        is_valid, result = validate_engine(engine)
+        if not is_valid:
+            return jsonify({'error': result}), 400
+        
+        # Update job state
+        job_states[job_id]['engine'] = result
+        
+        return jsonify({
+            'job_id': job_id,
+            'engine': result,
+            'message': f'Engine updated to {result}'
+        }), 200
+    
+    @app.route('/api/set_alpha/<job_id>', methods=['POST'])
+    def set_alpha(job_id):
+        """Set or update the colour adjustment alpha for an existing job"""
+        # Validate job ID
+        is_valid, error = validate_job_id(job_id, job_states)
+        if not is_valid:
+            return jsonify({'error': error}), 404
+        
+        # Get alpha from request
+        alpha = (request.get_json(silent=True) or {}).get('alpha')
+        if alpha is None:
+            return jsonify({'error': 'Missing alpha parameter'}), 400
+        
+        # Validate alpha
+        is_valid, result = validate_alpha(alpha)
+        if not is_valid:
+            return jsonify({'error': result}), 400
+        
+        # Update job state; the next generation only reruns colour adjustment and encoding
+        job_states[job_id]['alpha'] = result
+        
+        return jsonify({
+            'job_id': job_id,
+            'alpha': result,
+            'message': f'Alpha updated to {result}'
+        }), 200
+    
     @app.route('/api/multiresolution_preview/<job_id>', methods=['GET'])
     def multiresolution_preview(job_id):
         """Generate previews at different block sizes"""
@@ -176,6 +231,11 @@ def register_preprocess_routes(app, job_states):
         if not is_valid:
             return jsonify({'error': error}), 404
         
+        # Preview format (optional)
+        is_valid, image_format = negotiate_format(request.args.get('format'))
+        if not is_valid:
+            return jsonify({'error': image_format}), 400
+        
         try:
             # Get paths
             element_path = job_states[job_id]['resized_element_path']
@@ -184,9 +244,8 @@ def register_preprocess_routes(app, job_states):
             # Get color mode
             color_mode = job_states[job_id].get('color_mode', 'rgb')
             
-            # Load images
+            # Load element image
             element_pil = load_and_preprocess_image(element_path, color_mode=color_mode)
-            big_pil = load_and_preprocess_image(big_path, color_mode=color_mode)
             
             # Get block sizes to preview (small, medium, large)
             from config import MIN_BLOCK_SIZE, MAX_BLOCK_SIZE
@@ -196,22 +255,24 @@ def register_preprocess_routes(app, job_states):
                 MAX_BLOCK_SIZE
             ]
             
+            # Very small preview target (just for quick preview), shared with the
+            # image route's ?w=&h=&fit=fill variant of the target
+            preview_size = (THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+            thumbnail = open_variant(big_path, 'temp', preview_size + ('fill',))
+            thumbnail = thumbnail.convert('RGB' if color_mode == 'rgb' else 'L')
+            
             # Create small preview for each block size
             preview_outputs = {}
             for block_size in block_sizes:
-                # Create a very small preview target (just for quick preview)
-                preview_size = (200, 200)
-                preview_target = big_pil.resize(preview_size, Image.LANCZOS)
-                
                 # Adjust to be multiple of block_size
                 adjusted_w = (preview_size[0] // block_size) * block_size
                 adjusted_h = (preview_size[1] // block_size) * block_size
-                preview_target = preview_target.crop((0, 0, adjusted_w, adjusted_h))
+                preview_target = thumbnail.crop((0, 0, adjusted_w, adjusted_h))
                 
                 # Save preview target
-                preview_target_filename = f"{job_id}_preview_target_{block_size}.png"
+                preview_target_filename = get_output_filename(f"{job_id}_preview_target_{block_size}", 'preview', image_format)
                 preview_target_path = get_file_path(preview_target_filename, 'temp')
-                preview_target.save(preview_target_path)
+                save_image(preview_target, preview_target_path, 'preview')
                 
                 # Convert to numpy array
                 preview_target_np = np.array(preview_target)
@@ -223,9 +284,9 @@ def register_preprocess_routes(app, job_states):
                 preview_mosaic = create_image_matrix(element_np, grid_size, block_size)
                 
                 # Save preview mosaic
-                preview_mosaic_filename = f"{job_id}_preview_mosaic_{block_size}.png"
+                preview_mosaic_filename = get_output_filename(f"{job_id}_preview_mosaic_{block_size}", 'preview', image_format)
                 preview_mosaic_path = get_file_path(preview_mosaic_filename, 'temp')
-                save_image(preview_mosaic, preview_mosaic_path)
+                save_image(preview_mosaic, preview_mosaic_path, 'preview')
                 
                 # Add to outputs
                 preview_outputs[str(block_size)] = {
@@ -0,0 +1,109 @@
+"""
+Request profiling endpoints.
+"""
+from flask import request, jsonify, g, send_file
+import cProfile
+import os
+import time
+from utils.profiling import (
+    is_profiling_requested, is_admin_request, save_profile,
+    get_profile_path, list_profiles, summarize_profile, PROFILE_SORT_KEYS
+)
+
+def register_profiling_routes(app, job_states):
+    """
+    Register profiling routes and the hooks that profile flagged requests.
+
+    Args:
+        app: Flask application
+        job_states: Dictionary to store job states
+    """
+
+    @app.before_request
+    def start_profiler():
+        """Start cProfile for requests flagged with ?profile=1 or X-Profile: 1"""
+        if not is_profiling_requested(request):
+            return None
+
+        if not is_admin_request(request):
+            return jsonify({'error': 'Profiling requires a valid admin token'}), 403
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this thread
+            return None
+
+        g.profiler = profiler
+        g.profiler_start = time.perf_counter()
+        return None
+
+    @app.after_request
+    def stop_profiler(response):
+        """Stop the profiler and save its pstats dump"""
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+
+        profiler.disable()
+        elapsed = time.perf_counter() - g.profiler_start
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        profile_id = save_profile(profiler, request.method, request.full_path, route, elapsed)
+        response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    @app.teardown_request
+    def discard_profiler(exc):
+        """Make sure a profiler is never left running after a failed request"""
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+    @app.route('/api/profiles', methods=['GET'])
+    def get_profiles():
+        """List saved request profiles"""
+        if not is_admin_request(request):
+            return jsonify({'error': 'Admin token required'}), 403
+
+        return jsonify({'profiles': list_profiles()}), 200
+
+    @app.route('/api/profiles/<profile_id>', methods=['GET'])
+    def get_profile_summary(profile_id):
+        """Summarize the top-N functions of a saved profile"""
+        if not is_admin_request(request):
+            return jsonify({'error': 'Admin token required'}), 403
+
+        profile_path = get_profile_path(profile_id)
+        if profile_path is None:
+            return jsonify({'error': 'Profile not found'}), 404
+
+        from config import PROFILE_TOP_N
+        try:
+            top_n = int(request.args.get('top', PROFILE_TOP_N))
+        except ValueError:
+            return jsonify({'error': 'Invalid top parameter'}), 400
+
+        sort_by = request.args.get('sort', 'cumulative')
+        if sort_by not in PROFILE_SORT_KEYS:
+            return jsonify({'error': f'Invalid sort. Available: {", ".join(sorted(PROFILE_SORT_KEYS))}'}), 400
+
+        summary = summarize_profile(profile_path, top_n=max(1, top_n), sort_by=sort_by)
+
+        return jsonify({
+            'profile_id': profile_id,
+            'summary': summary,
+            'download_url': f"/api/profiles/{profile_id}/download"
+        }), 200
+
+    @app.route('/api/profiles/<profile_id>/download', methods=['GET'])
+    def download_profile(profile_id):
+        """Download the raw pstats dump of a saved profile"""
+        if not is_admin_request(request):
+            return jsonify({'error': 'Admin token required'}), 403
+
+        profile_path = get_profile_path(profile_id)
+        if profile_path is None:
+            return jsonify({'error': 'Profile not found'}), 404
+
+        return send_file(os.path.abspath(profile_path), as_attachment=True, download_name=f"{profile_id}.prof")
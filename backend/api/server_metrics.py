@@ -0,0 +1,44 @@
+"""
+Server performance metrics endpoints.
+"""
+from flask import request, g, Response
+import time
+from utils.server_metrics import start_request, finish_request, render_prometheus
+
+def register_server_metrics_routes(app, job_states):
+    """
+    Register server metrics routes and the request timing hooks that feed them.
+
+    Args:
+        app: Flask application
+        job_states: Dictionary to store job states
+    """
+
+    @app.before_request
+    def start_request_timer():
+        """Record the start of a request and count it as in flight"""
+        # Label by URL rule (not path) to keep the number of series bounded
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g.metrics_route = route
+        g.metrics_start = time.perf_counter()
+        g.metrics_status = 500
+        start_request(route)
+
+    @app.after_request
+    def capture_response_status(response):
+        """Remember the response status for the teardown hook"""
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def stop_request_timer(exc):
+        """Record request latency, including requests that raised"""
+        if 'metrics_start' not in g:
+            return
+        elapsed = time.perf_counter() - g.metrics_start
+        finish_request(g.metrics_route, request.method, g.metrics_status, elapsed)
+
+    @app.route('/api/metrics/server', methods=['GET'])
+    def get_server_metrics():
+        """Expose server-wide performance metrics in Prometheus text format"""
+        return Response(render_prometheus(job_states), mimetype='text/plain; version=0.0.4')
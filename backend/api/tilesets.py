@@ -0,0 +1,90 @@
+"""
+Tile set upload and selection endpoints.
+"""
+from flask import request, jsonify
+import zipfile
+from config import DEFAULT_BLOCK_SIZE
+from utils.validation import validate_job_id, validate_block_size
+from core.tileset import extract_tiles_from_zip, build_tileset, get_tileset_index, list_tilesets
+
+def register_tileset_routes(app, job_states):
+    """
+    Register tile set-related routes.
+
+    Args:
+        app: Flask application
+        job_states: Dictionary to store job states
+    """
+
+    @app.route('/api/tilesets', methods=['POST'])
+    def upload_tileset():
+        """Upload a ZIP of tile images and build a reusable tile library"""
+        if 'tiles' not in request.files:
+            return jsonify({'error': 'Missing tiles ZIP file'}), 400
+
+        tiles_file = request.files['tiles']
+        if tiles_file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+
+        # Validate tile size
+        is_valid, tile_size = validate_block_size(request.form.get('tile_size', DEFAULT_BLOCK_SIZE))
+        if not is_valid:
+            return jsonify({'error': tile_size}), 400
+
+        try:
+            tiles = extract_tiles_from_zip(tiles_file.stream)
+            if not tiles:
+                return jsonify({'error': 'ZIP file contains no tile images'}), 400
+            index = build_tileset(tiles, tile_size)
+        except zipfile.BadZipFile:
+            return jsonify({'error': 'Invalid ZIP file'}), 400
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        return jsonify({
+            'tileset_id': index['tileset_id'],
+            'tile_size': index['tile_size'],
+            'count': index['count'],
+            'skipped': index['skipped'],
+            'message': f"Tile set created with {index['count']} tiles"
+        }), 201
+
+    @app.route('/api/tilesets', methods=['GET'])
+    def get_tilesets():
+        """List stored tile sets"""
+        return jsonify({'tilesets': list_tilesets()}), 200
+
+    @app.route('/api/tilesets/<tileset_id>', methods=['GET'])
+    def get_tileset(tileset_id):
+        """Get the index of a tile set"""
+        index = get_tileset_index(tileset_id)
+        if index is None:
+            return jsonify({'error': 'Tile set not found'}), 404
+        return jsonify(index), 200
+
+    @app.route('/api/set_tileset/<job_id>', methods=['POST'])
+    def set_tileset(job_id):
+        """Use a tile set (or the element image when null) as the job's tile library"""
+        # Validate job ID
+        is_valid, error = validate_job_id(job_id, job_states)
+        if not is_valid:
+            return jsonify({'error': error}), 404
+
+        data = request.get_json(silent=True) or {}
+        if 'tileset_id' not in data:
+            return jsonify({'error': 'Missing tileset_id parameter'}), 400
+
+        tileset_id = data['tileset_id']
+        if tileset_id is not None and get_tileset_index(tileset_id) is None:
+            return jsonify({'error': 'Tile set not found'}), 404
+
+        # Update job state
+        job_states[job_id]['tileset_id'] = tileset_id
+
+        return jsonify({
+            'job_id': job_id,
+            'tileset_id': tileset_id,
+            'message': f'Tile set updated to {tileset_id}' if tileset_id else 'Tile set cleared'
+        }), 200
@@ -2,9 +2,12 @@
 File upload endpoints.
 """
 from flask import request, jsonify
-from utils.validation import validate_file_upload
-from utils.file_utils import save_uploaded_file, get_file_url
+from utils.validation import validate_file_upload, validate_color_method, validate_engine, validate_alpha
+from utils.file_utils import save_uploaded_image, save_uploaded_frames, remove_uploaded_image, get_file_path, get_file_url
+from utils.image_utils import save_image
+from core.animation import load_first_frame
 import os
+import zipfile
 
 def register_upload_routes(app, job_states):
     """
@@ -23,14 +26,37 @@ def register_upload_routes(app, job_states):
         if not is_valid:
             return jsonify({'error': error}), 400
         
+        # Get color matching method parameter (optional)
+        is_valid, color_method = validate_color_method(request.form.get('color_method', 'average_rgb'))
+        if not is_valid:
+            return jsonify({'error': color_method}), 400
+        
+        # Get mosaic engine parameter (optional)
+        is_valid, engine = validate_engine(request.form.get('engine', 'legacy'))
+        if not is_valid:
+            return jsonify({'error': engine}), 400
+        
+        # Get colour adjustment alpha (optional)
+        from config import DEFAULT_ALPHA
+        is_valid, alpha = validate_alpha(request.form.get('alpha', DEFAULT_ALPHA))
+        if not is_valid:
+            return jsonify({'error': alpha}), 400
+        
         try:
             # Get files
             element_file = request.files['element_img']
             big_file = request.files['big_img']
             
-            # Save files
-            job_id, element_filename, element_path = save_uploaded_file(element_file)
-            _, big_filename, big_path = save_uploaded_file(big_file, f"{job_id}_big{os.path.splitext(big_file.filename)[1]}")
+            # Save files, rejecting non-images and oversized images before decoding
+            try:
+                job_id, element_filename, element_path, element_sha1 = save_uploaded_image(element_file)
+            except ValueError as e:
+                return jsonify({'error': f'Invalid element image: {e}'}), 400
+            try:
+                _, big_filename, big_path, big_sha1 = save_uploaded_image(big_file, f"{job_id}_big{os.path.splitext(big_file.filename)[1]}")
+            except ValueError as e:
+                remove_uploaded_image(element_path)
+                return jsonify({'error': f'Invalid target image: {e}'}), 400
             
             # Get block size parameter (optional)
             from config import DEFAULT_BLOCK_SIZE
@@ -43,18 +69,19 @@ def register_upload_routes(app, job_states):
             # Get color mode parameter (optional)
             color_mode = request.form.get('color_mode', 'rgb')
             
-            # Get color matching method parameter (optional)
-            color_method = request.form.get('color_method', 'average_rgb')
-            
             # Initialize job state
             job_states[job_id] = {
                 'status': 'uploaded',
                 'progress': 5,
                 'element_path': element_path,
                 'big_path': big_path,
+                'element_sha1': element_sha1,
+                'big_sha1': big_sha1,
                 'block_size': block_size,
                 'color_mode': color_mode,
                 'color_method': color_method,
+                'engine': engine,
+                'alpha': alpha,
                 'intermediate_outputs': {},
                 'final_outputs': {},
                 'metrics': {}
@@ -73,6 +100,8 @@ def register_upload_routes(app, job_states):
                 'block_size': block_size,
                 'color_mode': color_mode,
                 'color_method': color_method,
+                'engine': engine,
+                'alpha': alpha,
                 'next_step': f"/api/preprocess/{job_id}"
             }), 200
         
@@ -98,14 +127,18 @@ def register_upload_routes(app, job_states):
             return jsonify({'error': 'Invalid file type'}), 400
         
         try:
-            # Save file
-            job_id, element_filename, element_path = save_uploaded_file(element_file)
+            # Save file, rejecting non-images and oversized images before decoding
+            try:
+                job_id, element_filename, element_path, element_sha1 = save_uploaded_image(element_file)
+            except ValueError as e:
+                return jsonify({'error': f'Invalid element image: {e}'}), 400
             
             # Initialize job state
             job_states[job_id] = {
                 'status': 'element_uploaded',
                 'progress': 2,
                 'element_path': element_path,
+                'element_sha1': element_sha1,
                 'intermediate_outputs': {},
                 'final_outputs': {}
             }
@@ -149,11 +182,17 @@ def register_upload_routes(app, job_states):
             return jsonify({'error': 'Invalid file type'}), 400
         
         try:
-            # Save file
-            _, big_filename, big_path = save_uploaded_file(big_file, f"{job_id}_big{os.path.splitext(big_file.filename)[1]}")
+            # Save file, rejecting non-images and oversized images before decoding
+            try:
+                _, big_filename, big_path, big_sha1 = save_uploaded_image(big_file, f"{job_id}_big{os.path.splitext(big_file.filename)[1]}")
+            except ValueError as e:
+                return jsonify({'error': f'Invalid target image: {e}'}), 400
             
             # Update job state
             job_states[job_id]['big_path'] = big_path
+            job_states[job_id]['big_sha1'] = big_sha1
+            job_states[job_id].pop('frames_path', None)
+            job_states[job_id].pop('frames_sha1', None)
             job_states[job_id]['status'] = 'uploaded'
             job_states[job_id]['progress'] = 5
             
@@ -173,4 +212,57 @@ def register_upload_routes(app, job_states):
             }), 200
         
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
\ No newline at end of file
+            return jsonify({'error': str(e)}), 500
+    
+    @app.route('/api/upload_frames/<job_id>', methods=['POST'])
+    def upload_frames(job_id):
+        """Upload a ZIP of target frames, ordered by file name, for an animated mosaic"""
+        # Check if job exists
+        from utils.validation import validate_job_id
+        is_valid, error = validate_job_id(job_id, job_states)
+        if not is_valid:
+            return jsonify({'error': error}), 404
+        
+        # Check if file is in the request
+        if 'frames' not in request.files or request.files['frames'].filename == '':
+            return jsonify({'error': 'Missing frames archive'}), 400
+        
+        try:
+            # Stream the archive (or GIF) to disk, checking its format and declared size
+            try:
+                frames_path, frames_sha1 = save_uploaded_frames(request.files['frames'], f"{job_id}_frames")
+            except ValueError as e:
+                return jsonify({'error': f'Invalid frames archive: {e}'}), 400
+            
+            # The first frame doubles as the still target for preprocessing; the
+            # others are only checked from their headers here
+            try:
+                first_frame, n_frames = load_first_frame(frames_path)
+            except (ValueError, OSError, zipfile.BadZipFile) as e:
+                os.remove(frames_path)
+                return jsonify({'error': f'Invalid frames archive: {e}'}), 400
+            
+            big_filename = f"{job_id}_big.png"
+            big_path = get_file_path(big_filename, 'upload')
+            save_image(first_frame, big_path, 'intermediate')
+            
+            # Update job state
+            job_states[job_id]['big_path'] = big_path
+            job_states[job_id]['frames_path'] = frames_path
+            job_states[job_id]['frames_sha1'] = frames_sha1
+            job_states[job_id].pop('big_sha1', None)
+            job_states[job_id]['big_url'] = get_file_url(big_filename, 'upload')
+            job_states[job_id]['status'] = 'uploaded'
+            job_states[job_id]['progress'] = 5
+            
+            return jsonify({
+                'job_id': job_id,
+                'status': 'uploaded',
+                'progress': 5,
+                'frames': n_frames,
+                'big_url': job_states[job_id]['big_url'],
+                'next_step': f"/api/preprocess/{job_id}"
+            }), 200
+        
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
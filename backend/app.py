@@ -19,7 +19,10 @@ from flask import Flask, request, jsonify, send_file
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # Import configuration
-from config import UPLOAD_FOLDER, TEMP_FOLDER, OUTPUT_FOLDER, MAX_CONTENT_LENGTH
+from config import UPLOAD_FOLDER, TEMP_FOLDER, OUTPUT_FOLDER, MAX_CONTENT_LENGTH, OUTPUT_WAIT_TIMEOUT, IMMUTABLE_MAX_AGE
+from utils.encoders import get_path_format, negotiate_format, get_variant_size, get_variant_path
+from utils.output_writer import wait_for_write
+from core.result_cache import is_result_filename
 
 # Create Flask app
 app = Flask(__name__)
@@ -40,38 +43,97 @@ from api.preprocess import register_preprocess_routes
 from api.generation import register_generation_routes
 from api.filters import register_filter_routes
 from api.metrics import register_metrics_routes
+from api.server_metrics import register_server_metrics_routes
+from api.tilesets import register_tileset_routes
+from api.palette import register_palette_routes
+from api.profiling import register_profiling_routes
 
 # Register routes
+register_server_metrics_routes(app, job_states)
 register_upload_routes(app, job_states)
 register_preprocess_routes(app, job_states)
 register_generation_routes(app, job_states)
 register_filter_routes(app, job_states)
 register_metrics_routes(app, job_states)
+register_tileset_routes(app, job_states)
+register_palette_routes(app, job_states)
+register_profiling_routes(app, job_states)
 
 # Image serving endpoints
-@app.route('/api/images/uploads/<filename>', methods=['GET'])
-def get_upload_image(filename):
-    """Serve an image from the uploads folder"""
+def send_image(folder, folder_type, filename):
+    """
+    Serve a stored image, re-encoded when format= asks for another format or the Accept header rules out the stored one
+    and resized when w=, h= and fit= ask for another size.
+    
+    Images still being written in the background are waited for up to
+    OUTPUT_WAIT_TIMEOUT seconds (or ?wait= seconds); after that the request
+    is answered with 202 and a Retry-After header.
+    
+    Responses carry a strong ETag built from the file's metadata and honour
+    If-None-Match (304) and Range requests. Memoised outputs, whose names
+    derive from their content, are marked immutable; everything else must
+    be revalidated.
+    
+    Args:
+        folder: folder of the image
+        folder_type: 'upload', 'temp' or 'output'
+        filename: name of the image file
+    """
+    source_format = get_path_format(filename)
+    is_valid, image_format = negotiate_format(request.args.get('format'), request.accept_mimetypes, default=source_format)
+    if not is_valid:
+        return jsonify({'error': image_format}), 400
+    
+    is_valid, size = get_variant_size(request.args.get('w'), request.args.get('h'), request.args.get('fit'))
+    if not is_valid:
+        return jsonify({'error': size}), 400
+    if size and source_format is None:
+        return jsonify({'error': 'Only still images can be resized'}), 400
+    
+    try:
+        timeout = min(max(float(request.args.get('wait', OUTPUT_WAIT_TIMEOUT)), 0), OUTPUT_WAIT_TIMEOUT)
+    except ValueError:
+        return jsonify({'error': 'Invalid wait. Must be a number of seconds'}), 400
+    
+    path = os.path.join(folder, filename)
+    if not wait_for_write(path, timeout):
+        response = jsonify({'status': 'pending', 'message': 'Image is still being written'})
+        response.status_code = 202
+        response.headers['Retry-After'] = '1'
+        response.cache_control.no_store = True
+        return response
+    
     try:
-        return send_file(os.path.join(UPLOAD_FOLDER, filename))
+        # Only still images are re-encoded; animations and archives are served as stored
+        if source_format is not None and (image_format != source_format or size):
+            path = get_variant_path(path, folder_type, image_format, size)
+        immutable = folder_type == 'output' and is_result_filename(filename)
+        # Without a max_age, responses are sent with no-cache and revalidated through the ETag
+        response = send_file(path, conditional=True, etag=True, max_age=IMMUTABLE_MAX_AGE if immutable else None)
     except FileNotFoundError:
         return jsonify({'error': 'Image not found'}), 404
+    
+    if immutable:
+        response.cache_control.immutable = True
+    
+    if source_format is not None:
+        response.vary.add('Accept')
+    return response
+
+@app.route('/api/images/uploads/<filename>', methods=['GET'])
+def get_upload_image(filename):
+    """Serve an image from the uploads folder"""
+    return send_image(UPLOAD_FOLDER, 'upload', filename)
 
 @app.route('/api/temp/<filename>', methods=['GET'])
 def get_temp_image(filename):
     """Serve an image from the temp folder"""
-    try:
-        return send_file(os.path.join(TEMP_FOLDER, filename))
-    except FileNotFoundError:
-        return jsonify({'error': 'Image not found'}), 404
+    return send_image(TEMP_FOLDER, 'temp', filename)
 
 @app.route('/api/images/outputs/<filename>', methods=['GET'])
 def get_output_image(filename):
     """Serve an image from the output folder"""
-    try:
-        return send_file(os.path.join(OUTPUT_FOLDER, filename))
-    except FileNotFoundError:
-        return jsonify({'error': 'Image not found'}), 404
+    return send_image(OUTPUT_FOLDER, 'output', filename)
 
 # Job status endpoint
 @app.route('/api/job/<job_id>', methods=['GET'])
@@ -106,16 +168,20 @@ def get_api_docs():
             "upload": {
                 "/api/upload": "Upload element and target images (POST)",
                 "/api/upload_element": "Upload only element image (POST)",
-                "/api/upload_target/{job_id}": "Upload target image for existing job (POST)"
+                "/api/upload_target/{job_id}": "Upload target image for existing job (POST)",
+                "/api/upload_frames/{job_id}": "Upload a ZIP of target frames for an animated mosaic (POST)"
             },
             "preprocess": {
                 "/api/preprocess/{job_id}": "Preprocess images (GET)",
                 "/api/set_block_size/{job_id}": "Set/update block size (POST)",
+                "/api/set_engine/{job_id}": "Set mosaic engine: legacy, block or quadtree (POST)",
+                "/api/set_alpha/{job_id}": "Set colour adjustment alpha between 0 and 1 (POST)",
                 "/api/multiresolution_preview/{job_id}": "Generate previews at different block sizes (GET)"
             },
             "generation": {
                 "/api/generate_mosaic/{job_id}": "Generate mosaic (GET)",
                 "/api/multiresolution/{job_id}": "Generate mosaics at multiple resolutions (GET)",
+                "/api/generate_animation/{job_id}": "Generate an animated GIF mosaic from an animated target or frame sequence, ?tolerance= (GET)",
                 "/api/generate_mosaic": "Legacy one-step generation (POST)"
             },
             "filters": {
@@ -127,7 +193,32 @@ def get_api_docs():
             "metrics": {
                 "/api/metrics/{job_id}": "Get quality metrics for a mosaic (GET)",
                 "/api/metrics/compare/{job_id}": "Compare metrics for different block sizes or filters (GET)",
-                "/api/metrics/batch": "Calculate metrics for multiple jobs (POST)"
+                "/api/metrics/batch": "Calculate metrics for multiple jobs (POST)",
+                "/api/metrics/server": "Server performance metrics in Prometheus text format (GET)"
+            },
+            "tilesets": {
+                "/api/tilesets": "Upload a ZIP of tile images (POST) or list tile sets (GET)",
+                "/api/tilesets/{tileset_id}": "Get a tile set index (GET)",
+                "/api/set_tileset/{job_id}": "Use a tile set as the job's tile library (POST)"
+            },
+            "images": {
+                "/api/images/uploads/{filename}": "Serve an uploaded image (GET)",
+                "/api/temp/{filename}": "Serve an intermediate or preview image (GET)",
+                "/api/images/outputs/{filename}": "Serve an output image (GET)",
+                "format": "Image routes re-encode to ?format=png|jpeg|webp, or to an accepted format when the Accept header rules out the stored one; preview endpoints take ?format= too",
+                "size": "Image routes resize still images to ?w=&h=&fit=contain|cover|fill; sizes are rounded up to fixed buckets and cached",
+                "wait": "Outputs are encoded in the background; image routes wait up to ?wait= seconds for them, then answer 202 with Retry-After",
+                "caching": "Image responses carry strong ETags and support If-None-Match (304) and Range; memoised outputs are served with Cache-Control: immutable"
+            },
+            "palette": {
+                "/api/palette/{job_id}": "Dominant colours of a job's target or element image, ?image=&n_colors= (GET)",
+                "/api/palette": "Dominant colours of an uploaded image (POST)"
+            },
+            "profiling": {
+                "/api/profiles": "List saved request profiles, admin only (GET)",
+                "/api/profiles/{profile_id}": "Top-N function summary of a profile, admin only (GET)",
+                "/api/profiles/{profile_id}/download": "Download a raw pstats dump, admin only (GET)",
+                "?profile=1": "Profile any request with an X-Admin-Token header"
             },
             "utility": {
                 "/api/job/{job_id}": "Get job status and outputs (GET)",
@@ -7,18 +7,49 @@ import os
 UPLOAD_FOLDER = 'static/uploads'
 TEMP_FOLDER = 'static/temp'
 OUTPUT_FOLDER = 'static/outputs'
+PROFILES_FOLDER = 'static/profiles'
+TILESET_FOLDER = 'static/tilesets'
+VARIANT_FOLDER = 'static/variants'
 
 # Ensure directories exist
-for folder in [UPLOAD_FOLDER, TEMP_FOLDER, OUTPUT_FOLDER]:
+for folder in [UPLOAD_FOLDER, TEMP_FOLDER, OUTPUT_FOLDER, PROFILES_FOLDER, TILESET_FOLDER, VARIANT_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
 # File settings
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+MAX_UPLOAD_PIXELS = 40000000    # Uploads whose header declares more pixels are rejected before decoding
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes read per chunk while streaming an upload to disk
+DECODED_CACHE_BYTES = 256 * 1024 * 1024  # Decoded uploads kept in memory for the preprocessing step
+
+# Output encoding per output class: final outputs, throwaway previews and
+# intermediate files that later steps read back (those must stay lossless PNG)
+OUTPUT_ENCODERS = {
+    'final': {'format': 'png', 'png_compress_level': 6, 'png_optimize': False, 'jpeg_quality': 92, 'jpeg_progressive': True, 'webp_quality': 90},
+    'preview': {'format': 'png', 'png_compress_level': 1, 'jpeg_quality': 75, 'webp_quality': 75},
+    'intermediate': {'format': 'png', 'png_compress_level': 1, 'jpeg_quality': 95, 'webp_quality': 95}
+}
+WEBP_METHOD = 4                 # WebP encoder effort (0 = fastest, 6 = smallest)
+NEGOTIATED_FORMATS = ('webp', 'png', 'jpeg')  # Preference order when an Accept header names several formats
+
+# Resized image variants (?w=&h=&fit= on the image routes)
+VARIANT_SIZE_BUCKETS = (64, 128, 256, 512, 1024)  # Requested sizes are rounded up to one of these, bounding the variants per image
+VARIANT_FITS = ('contain', 'cover', 'fill')  # contain: fit inside, cover: fill and crop, fill: stretch to the exact size
+THUMBNAIL_SIZE = 256            # Thumbnail size used by the preview and comparison endpoints
 
 # Size limitations to prevent memory issues
 MAX_ELEMENT_SIZE = 32  # Maximum size of element image (width/height)
 MAX_TARGET_SIZE = 128  # Maximum size of target image (width/height)
+DECODE_REDUCING_GAP = 2  # Draft decoding and Image.reduce stop at this multiple of the final size before the LANCZOS resize
+
+# Resampling per use-case tier (see utils/resampling.py): kernel is 'lanczos', 'linear', 'area' or
+# 'nearest'; downscales to at most area_below of the size use cv2 INTER_AREA, and integer upscales
+# use nearest neighbour when integer_nearest is set
+RESIZE_TIERS = {
+    'final': {'kernel': 'lanczos', 'area_below': None, 'integer_nearest': True},
+    'preview': {'kernel': 'linear', 'area_below': 0.5, 'integer_nearest': True},
+    'metric': {'kernel': 'linear', 'area_below': 1.0, 'integer_nearest': True}
+}
 MAX_MOSAIC_PIXELS = 16777216  # ~16 million pixels (4096x4096)
 
 # Mosaic default settings
@@ -26,6 +57,79 @@ DEFAULT_BLOCK_SIZE = 32  # Default block size for mosaic
 MIN_BLOCK_SIZE = 8      # Minimum allowed block size
 MAX_BLOCK_SIZE = 64     # Maximum allowed block size
 
+# Colour adjustment
+DEFAULT_ALPHA = 0.7     # Blend of each tile towards its target block colour (0 = none, 1 = full)
+
+# Incremental regeneration
+STAGE_CACHE_JOBS = 4    # Jobs whose decoded images, features, matches and mosaics are kept in memory
+STAGE_CACHE_BYTES = 512 * 1024 * 1024  # Memory all cached stage outputs may use; least recently used jobs are dropped first
+
+# Result memoisation and output retention
+RESULT_CACHE_SIZE = 256  # Memoised generation results; evicted results have their output files deleted unless a job still serves them
+OUTPUT_RETENTION_SECONDS = 24 * 60 * 60  # Memoised outputs unused for this long are evicted and deleted
+
+# Write-behind output encoding
+OUTPUT_WRITER_WORKERS = 4  # Threads encoding final outputs after the response has been sent
+OUTPUT_WAIT_TIMEOUT = 10.0  # Seconds an image request waits for a pending write before answering 202
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # Cache-Control max-age of memoised outputs, whose names derive from their content
+
+# Element library extraction settings (block engine)
+LIBRARY_STRIDE = 8              # Pixel step between sliding-window tiles
+LIBRARY_SCALES = (1.0, 1.5, 2.0)  # Element scales to extract tiles from
+LIBRARY_FLIPS = True            # Also extract tiles from mirrored elements
+
+# Mosaic engines
+AVAILABLE_ENGINES = {
+    'legacy': 'Element repeated per target pixel',
+    'block': 'Uniform block matching',
+    'quadtree': 'Adaptive block sizes'
+}
+
+# Adaptive (quadtree) engine settings
+QUADTREE_VARIANCE_THRESHOLD = 300.0  # Mean per-channel variance above which a block is split
+
+# Animation settings
+MAX_ANIMATION_FRAMES = 120      # Maximum number of frames in an animated target or frame sequence
+MAX_ANIMATION_PIXELS = 400000000  # Animated uploads whose header declares more width * height * frames are rejected before decoding
+MAX_ANIMATION_BYTES = 256 * 1024 * 1024  # Maximum uncompressed size of all files in a frames archive
+ANIMATION_FRAME_DURATION = 100  # Frame duration in milliseconds when the source does not give one
+ANIMATION_CHANGE_TOLERANCE = 4.0  # Per-channel block mean change below which the previous render is reused
+
+# Tile set settings
+MAX_TILESET_TILES = 10000       # Maximum number of tiles in one tile set
+MAX_TILE_FILE_SIZE = 8 * 1024 * 1024  # Maximum uncompressed size of a single tile file
+MAX_TILESET_UNCOMPRESSED_BYTES = 512 * 1024 * 1024  # Maximum uncompressed size of all files in a tile set archive
+MAX_TILE_PIXELS = 16 * 1024 * 1024  # Maximum width * height of a tile image before it is decoded
+TILESET_DECODE_WORKERS = 4      # Threads used to decode and resize tiles
+TILESET_CACHE_SIZE = 32         # Loaded (tile set, block size, colour mode) libraries kept in memory
+TILESET_CACHE_BYTES = 512 * 1024 * 1024  # Memory loaded tile set libraries may hold; least recently used ones are dropped first
+
+# Colour matching methods
+AVAILABLE_COLOR_METHODS = {
+    'average_rgb': 'Average RGB distance',
+    'histogram': 'Colour histogram correlation',
+    'cascade': 'Average RGB prefilter, histogram rerank',
+    'lab': 'Perceptual CIELAB distance'
+}
+CASCADE_TOP_K = 16              # Candidates kept by the average-colour prefilter
+LAB_DISTANCE = 'ciede2000'      # Lab colour difference: 'cie76' or 'ciede2000'
+LAB_PREFILTER_K = 64            # CIE76-nearest candidates rescored with CIEDE2000 (0 = score the whole library)
+
+# Average-colour matching settings
+AVERAGE_RGB_MATCHER = 'lut'     # 'exact' or 'lut' (quantised colour lookup table)
+COLOR_LUT_BITS = 5              # Bits per channel of the lookup table (5 = 32x32x32 cells)
+COLOR_LUT_CANDIDATES = 32       # Library entries kept per cell for refinement
+COLOR_LUT_REFINE = True         # Rescore cell candidates exactly; False uses the cell's first entry only
+
+# Histogram matching settings
+HISTOGRAM_MATCHER = 'ann'       # 'exact' or 'ann' (inverted-file index for large libraries)
+ANN_MIN_LIBRARY_SIZE = 4096     # Libraries smaller than this are always searched exactly
+ANN_NLIST = None                # Number of inverted lists (None = about sqrt(library size))
+ANN_NPROBE = 8                  # Lists scanned per target block
+ANN_TOP_K = 8                   # Candidates kept per target block before reranking
+ANN_RERANK = True               # Rescore the candidates with exact correlation
+ANN_FEATURE_DTYPE = 'float16'   # Compact feature storage: 'float16' or 'int8'
+
 # Available filter effects
 AVAILABLE_FILTERS = {
     'none': 'No Filter',
@@ -38,4 +142,30 @@ AVAILABLE_FILTERS = {
     'blur': 'Blur',
     'sharpen': 'Sharpen',
     'edge_enhance': 'Edge Enhancement'
-}
\ No newline at end of file
+}
+
+# Palette extraction settings
+PALETTE_DEFAULT_COLORS = 8      # Colours returned when n_colors is not given
+PALETTE_MAX_COLORS = 32         # Maximum n_colors accepted by the API
+PALETTE_SAMPLE_SIZE = 256       # Uploaded images are decoded down to at most this size for palettes
+PALETTE_HISTOGRAM_BITS = 5      # Bits per channel of the weighted colour histogram
+PALETTE_BATCH_SIZE = 1024       # Colours sampled per mini-batch k-means update
+PALETTE_ITERATIONS = 100        # Mini-batch k-means updates
+PALETTE_SEED = 0                # Random seed, so palettes are reproducible
+PALETTE_CACHE_SIZE = 256        # Palettes kept in memory (by image hash and n_colors)
+
+# Server metrics settings
+REQUEST_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # seconds
+STORAGE_METRICS_TTL = 10  # Seconds between scans of the static folders
+
+# Request profiling settings
+PROFILING_ADMIN_TOKEN = os.environ.get('MOSAIC_ADMIN_TOKEN')  # Profiling is disabled when unset
+PROFILE_TOP_N = 25  # Default number of functions in a profile summary
+
+# Memory budget settings
+MAX_JOB_MEMORY_BYTES = 1024 * 1024 * 1024  # Estimated peak memory allowed per job (1GB)
+MEMORY_BUDGET_POLICY = 'downgrade'  # 'downgrade' shrinks the target to fit, 'reject' refuses the job
+MEMORY_COST_PER_VALUE = {'legacy': 3, 'block': 3, 'quadtree': 3}  # Peak bytes per output value (pixel x channel)
+MEMORY_COST_OVERHEAD = 64 * 1024 * 1024  # Fixed per-job overhead (decoded inputs, libraries, metrics)
+MEMORY_TRACKING = 'rss'  # Process-wide stage peaks: 'rss' (sampled, cheap), 'tracemalloc' (exact, slow) or 'off'
+MEMORY_SAMPLE_INTERVAL = 0.01  # Seconds between RSS samples
@@ -2,17 +2,45 @@
 """
 Core functionality package.
 """
+from core.element_library import ElementLibrary
+from core.ann_index import HistogramIndex
+from core.color_lut import ColorLookupTable
 from core.color_analysis import (
     build_element_library,
+    build_sliding_window_library,
     find_best_matching_block,
+    match_average_colors,
+    match_lab_colors,
+    match_histograms,
+    match_cascade,
     adjust_block_colors,
+    assemble_mosaic,
     create_color_palette
 )
 from core.mosaic import (
     create_image_matrix,
+    get_element_library,
+    get_target_features,
+    match_target_features,
     create_mosaic,
     create_multiresolution_mosaic
 )
+from core.adaptive_mosaic import (
+    build_quadtree,
+    match_adaptive_leaves,
+    render_adaptive_mosaic,
+    create_adaptive_mosaic
+)
+from core.animation import (
+    load_frames,
+    load_first_frame,
+    create_animated_mosaic,
+    save_animation
+)
+from core.pipeline import (
+    StageGraph,
+    get_stage_graph
+)
 from core.filters import (
     apply_filter,
     apply_multiple_filters
@@ -0,0 +1,295 @@
+"""
+Adaptive block-size mosaic engine based on a variance-driven quadtree.
+"""
+import numpy as np
+import cv2
+from numpy.lib.stride_tricks import sliding_window_view
+from utils.image_utils import get_color_histograms, rgb_to_lab
+from core.color_analysis import match_average_colors, match_lab_colors, match_histograms, match_cascade
+from core.mosaic import create_image_matrix, get_element_library
+
+def get_integral_images(img):
+    """
+    Compute per-channel integral images of pixel values and squared values.
+
+    Args:
+        img: (H, W[, C]) image
+
+    Returns:
+        tuple: ((H + 1, W + 1, C) float64 sums, (H + 1, W + 1, C) float64 squared sums)
+    """
+    sums, squared_sums = cv2.integral2(np.ascontiguousarray(img), sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    if sums.ndim == 2:
+        sums, squared_sums = sums[:, :, None], squared_sums[:, :, None]
+    return sums, squared_sums
+
+def get_region_stats(sums, squared_sums, ys, xs, size):
+    """
+    Mean and variance of many square regions in O(1) each.
+
+    Args:
+        sums: integral image of pixel values
+        squared_sums: integral image of squared pixel values
+        ys: (n,) top rows of the regions
+        xs: (n,) left columns of the regions
+        size: side of the regions in pixels
+
+    Returns:
+        tuple: ((n, C) per-channel means, (n, C) per-channel variances)
+    """
+    def region_sum(table):
+        return table[ys + size, xs + size] - table[ys, xs + size] - table[ys + size, xs] + table[ys, xs]
+
+    area = size * size
+    means = region_sum(sums) / area
+    variances = np.maximum(region_sum(squared_sums) / area - means ** 2, 0)
+    return means, variances
+
+def get_block_sizes(max_block_size, min_block_size):
+    """
+    Block sizes of the quadtree levels, coarsest first.
+
+    Args:
+        max_block_size: size of the root blocks
+        min_block_size: smallest allowed block size
+
+    Returns:
+        list: block sizes obtained by halving max_block_size
+    """
+    sizes = [max_block_size]
+    while sizes[-1] % 2 == 0 and sizes[-1] // 2 >= min_block_size:
+        sizes.append(sizes[-1] // 2)
+    return sizes
+
+def build_quadtree(target_img, max_block_size, min_block_size, threshold):
+    """
+    Split the target into square leaves, subdividing regions whose colour variance is high.
+
+    Whole levels are processed at once: every region of a level is measured
+    from the integral images and the ones above the threshold are split
+    into four children for the next level.
+
+    Args:
+        target_img: (H, W[, C]) target image
+        max_block_size: size of the root blocks
+        min_block_size: smallest allowed block size
+        threshold: mean per-channel variance above which a region is split
+
+    Returns:
+        dict: block size -> (ys, xs, means) arrays of the leaves of that size
+    """
+    sizes = get_block_sizes(max_block_size, min_block_size)
+    sums, squared_sums = get_integral_images(target_img)
+
+    n_roots_h = target_img.shape[0] // max_block_size
+    n_roots_w = target_img.shape[1] // max_block_size
+    ys, xs = np.mgrid[0:n_roots_h, 0:n_roots_w]
+    ys = ys.ravel() * max_block_size
+    xs = xs.ravel() * max_block_size
+
+    leaves = {}
+    for level, size in enumerate(sizes):
+        means, variances = get_region_stats(sums, squared_sums, ys, xs, size)
+        if level == len(sizes) - 1:
+            split = np.zeros(len(ys), dtype=bool)
+        else:
+            split = variances.mean(axis=1) > threshold
+
+        keep = ~split
+        if keep.any():
+            leaves[size] = (ys[keep], xs[keep], means[keep])
+
+        # Four children per split region
+        half = size // 2
+        offsets_y = np.array([0, 0, half, half])
+        offsets_x = np.array([0, half, 0, half])
+        ys = (ys[split, None] + offsets_y).ravel()
+        xs = (xs[split, None] + offsets_x).ravel()
+        if not len(ys):
+            break
+
+    return leaves
+
+def get_region_blocks(img, ys, xs, size):
+    """
+    Gather square regions of an image into a block stack.
+
+    Args:
+        img: (H, W[, C]) image
+        ys: (n,) top rows
+        xs: (n,) left columns
+        size: side of the regions
+
+    Returns:
+        numpy array: (n, size, size[, C]) blocks
+    """
+    windows = sliding_window_view(img, (size, size), axis=(0, 1))[ys, xs]
+    if img.ndim == 3:
+        windows = np.moveaxis(windows, 1, -1)
+    return windows
+
+def match_leaves(target_img, ys, xs, means, size, library, color_method):
+    """
+    Match the leaves of one block size against a library in one batch.
+
+    Args:
+        target_img: target image
+        ys, xs: leaf positions
+        means: (n, C) leaf mean colours from the integral images
+        size: leaf block size
+        library: ElementLibrary for this block size
+        color_method: colour matching method
+
+    Returns:
+        numpy array: (n,) library indices
+    """
+    rgb_means = means[:, :3] if means.shape[1] >= 3 else np.repeat(means, 3, axis=1)
+
+    if color_method == 'lab':
+        return match_lab_colors(rgb_to_lab(rgb_means), library)
+    if color_method in ('histogram', 'cascade'):
+        histograms = get_color_histograms(np.ascontiguousarray(get_region_blocks(target_img, ys, xs, size)))
+        if color_method == 'histogram':
+            return match_histograms(histograms, library)
+        return match_cascade(rgb_means, histograms, library)
+    return match_average_colors(rgb_means, library)
+
+def render_leaves(mosaic, ys, xs, size, library, indices, means, alpha):
+    """
+    Write the matched, colour-adjusted library blocks of one block size into the mosaic.
+
+    Args:
+        mosaic: (H, W[, C]) uint8 output image
+        ys, xs: leaf positions (multiples of size)
+        size: leaf block size
+        library: ElementLibrary for this block size
+        indices: (n,) library index of each leaf
+        means: (n, C) leaf mean colours
+        alpha: blending factor (0 = no change, 1 = full target color)
+    """
+    channel_shape = mosaic.shape[2:]
+    n_channels = channel_shape[0] if channel_shape else 1
+    blocks = library.blocks[indices]
+
+    if alpha != 0:
+        offset = alpha * (means[:, :n_channels].astype(np.float32) - library.means[indices, :n_channels])
+        if channel_shape:
+            band = blocks.astype(np.float32) + offset[:, None, None, :]
+        else:
+            band = blocks.astype(np.float32) + offset[:, 0, None, None]
+        np.clip(band, 0, 255, out=band)
+        blocks = band
+
+    # (H / size, size, W / size, size[, C]) view: one fancy-indexed write per size
+    height, width = mosaic.shape[:2]
+    mosaic_blocks = mosaic.reshape((height // size, size, width // size, size) + channel_shape)
+    mosaic_blocks[ys // size, :, xs // size, :] = blocks
+
+def match_adaptive_leaves(target_img, leaves, color_method, library_loader, job_id=None, job_states=None):
+    """
+    Match the quadtree leaves of every block size against its library.
+
+    Args:
+        target_img: target image cropped to whole root blocks
+        leaves: quadtree leaves from build_quadtree
+        color_method: method for color matching
+        library_loader: function from block size to ElementLibrary
+        job_id: unique identifier for the job, for tracking progress
+        job_states: dictionary to store job states, for tracking progress
+
+    Returns:
+        list: (size, ys, xs, means, library, indices) per block size
+    """
+    matched = []
+    for step, (size, (ys, xs, means)) in enumerate(leaves.items()):
+        if job_id is not None and job_states is not None:
+            job_states[job_id]['progress'] = 30 + (step / len(leaves)) * 60
+
+        library = library_loader(size)
+        indices = match_leaves(target_img, ys, xs, means, size, library, color_method)
+        matched.append((size, ys, xs, means, library, indices))
+    return matched
+
+def render_adaptive_mosaic(shape, matched, alpha):
+    """
+    Render matched quadtree leaves into a new mosaic.
+
+    Args:
+        shape: shape of the cropped target image
+        matched: matched leaves from match_adaptive_leaves
+        alpha: blending factor (0 = no change, 1 = full target color)
+
+    Returns:
+        numpy array: uint8 mosaic
+    """
+    mosaic = np.empty(shape, dtype=np.uint8)
+    for size, ys, xs, means, library, indices in matched:
+        render_leaves(mosaic, ys, xs, size, library, indices, means, alpha)
+    return mosaic
+
+def get_quadtree_stats(leaves, shape, min_block_size):
+    """
+    Summarise a quadtree for the job record.
+
+    Args:
+        leaves: quadtree leaves from build_quadtree
+        shape: shape of the cropped target image
+        min_block_size: smallest block size
+
+    Returns:
+        dict: leaf counts in total and by size, and the block count of a uniform grid at min_block_size
+    """
+    return {
+        'leaves': int(sum(len(ys) for ys, _, _ in leaves.values())),
+        'leaves_by_size': {str(size): int(len(ys)) for size, (ys, _, _) in leaves.items()},
+        'uniform_blocks': int((shape[0] // min_block_size) * (shape[1] // min_block_size))
+    }
+
+def create_adaptive_mosaic(element_img, target_img, max_block_size, min_block_size=None, threshold=None, color_method='average_rgb', adjust_colors=True, alpha=0.7, job_id=None, job_states=None, library_loader=None):
+    """
+    Generate a mosaic whose block size adapts to local detail.
+
+    Flat regions keep large tiles while detailed ones are split down to
+    min_block_size, so far fewer tiles are matched and rendered than with a
+    uniform grid at the finest block size.
+
+    Args:
+        element_img: RGB or grayscale image (numpy array) - the building block
+        target_img: RGB or grayscale image (numpy array) - the target image
+        max_block_size: size of the largest (root) blocks in pixels
+        min_block_size: smallest block size (defaults to MIN_BLOCK_SIZE)
+        threshold: variance split threshold (defaults to QUADTREE_VARIANCE_THRESHOLD)
+        color_method: method for color matching
+        adjust_colors: whether to adjust block colors to better match target
+        alpha: blending factor for color adjustment
+        job_id: unique identifier for the job, for tracking progress
+        job_states: dictionary to store job states, for tracking progress
+        library_loader: function from block size to ElementLibrary (e.g. a tile set);
+                        libraries are built from element_img if None
+
+    Returns:
+        tuple: (mosaic, simple_mosaic)
+    """
+    from config import MIN_BLOCK_SIZE, QUADTREE_VARIANCE_THRESHOLD
+
+    min_block_size = min_block_size or MIN_BLOCK_SIZE
+    threshold = QUADTREE_VARIANCE_THRESHOLD if threshold is None else threshold
+
+    if library_loader is None:
+        def library_loader(size):
+            return get_element_library(element_img, size, color_method)
+
+    # Crop to whole root blocks
+    n_roots_h = target_img.shape[0] // max_block_size
+    n_roots_w = target_img.shape[1] // max_block_size
+    target_img = target_img[:n_roots_h * max_block_size, :n_roots_w * max_block_size]
+
+    leaves = build_quadtree(target_img, max_block_size, min_block_size, threshold)
+    matched = match_adaptive_leaves(target_img, leaves, color_method, library_loader, job_id, job_states)
+    mosaic = render_adaptive_mosaic(target_img.shape, matched, alpha if adjust_colors else 0)
+
+    if job_id is not None and job_states is not None:
+        job_states[job_id]['quadtree'] = get_quadtree_stats(leaves, target_img.shape, min_block_size)
+
+    simple_mosaic = create_image_matrix(element_img, (n_roots_h, n_roots_w), max_block_size)
+    return mosaic, simple_mosaic
@@ -0,0 +1,227 @@
+"""
+Animated mosaics with incremental per-frame updates.
+"""
+import io
+import zipfile
+import numpy as np
+from PIL import Image, ImageSequence
+from config import (
+    MAX_ANIMATION_FRAMES, MAX_ANIMATION_BYTES, ANIMATION_FRAME_DURATION,
+    ANIMATION_CHANGE_TOLERANCE, MAX_UPLOAD_PIXELS, MAX_ANIMATION_PIXELS
+)
+from utils.image_utils import get_block_average_colors
+from utils.resampling import resize
+from core.mosaic import get_element_library
+from core.adaptive_mosaic import match_leaves, render_leaves
+
+def check_frame_budget(n_frames, frame_pixels, total_pixels, max_frames):
+    """
+    Check frame counts and sizes, read from headers, before any frame is decoded.
+
+    Args:
+        n_frames: number of frames so far
+        frame_pixels: width * height of the latest frame
+        total_pixels: width * height summed over the frames so far
+        max_frames: maximum number of frames
+
+    Raises:
+        ValueError: if any limit is exceeded
+    """
+    if n_frames > max_frames:
+        raise ValueError(f"Too many frames. Maximum allowed: {max_frames}")
+    if frame_pixels > MAX_UPLOAD_PIXELS:
+        raise ValueError(f"Frame too large. Maximum allowed: {MAX_UPLOAD_PIXELS} pixels")
+    if total_pixels > MAX_ANIMATION_PIXELS:
+        raise ValueError(f"Frames too large. Maximum allowed: {MAX_ANIMATION_PIXELS} pixels in total")
+
+def iter_frames(path, max_frames=None):
+    """
+    Open the frames of an animated image or of a ZIP of still frames one at a time.
+
+    ZIP entries are ordered by name, so numbered frame files play in order.
+    Entries are read one at a time, so an archive with too many frames, too
+    many uncompressed bytes or too many pixels in total is rejected without
+    reading the rest of it. Frames are checked by their header size before
+    they are yielded, and are not decoded yet.
+
+    Args:
+        path: path of an animated GIF (or other multi-frame image) or a ZIP archive
+        max_frames: maximum number of frames (defaults to MAX_ANIMATION_FRAMES)
+
+    Yields:
+        tuple: (PIL frame, frame duration in milliseconds)
+
+    Raises:
+        ValueError: if the frames exceed a limit (see check_frame_budget)
+    """
+    max_frames = max_frames or MAX_ANIMATION_FRAMES
+
+    def opened():
+        if zipfile.is_zipfile(path):
+            from core.tileset import iter_zip_images
+            for _, data in iter_zip_images(path, max_bytes=MAX_ANIMATION_BYTES):
+                yield Image.open(io.BytesIO(data)), ANIMATION_FRAME_DURATION
+        else:
+            with Image.open(path) as img:
+                for frame in ImageSequence.Iterator(img):
+                    yield frame, frame.info.get('duration') or ANIMATION_FRAME_DURATION
+
+    n_frames, total_pixels = 0, 0
+    for frame, duration in opened():
+        n_frames += 1
+        total_pixels += frame.width * frame.height
+        check_frame_budget(n_frames, frame.width * frame.height, total_pixels, max_frames)
+        yield frame, duration
+
+def load_frames(path, color_mode='rgb', size=None, max_frames=None):
+    """
+    Decode the frames of an animated image or of a ZIP of still frames.
+
+    Frames come from iter_frames, so every limit is checked before the frame
+    it concerns is decoded.
+
+    Args:
+        path: path of an animated GIF (or other multi-frame image) or a ZIP archive
+        color_mode: 'rgb' or 'grayscale'
+        size: (width, height) every frame is resized to, or None to keep the first frame's size
+        max_frames: maximum number of frames (defaults to MAX_ANIMATION_FRAMES)
+
+    Returns:
+        tuple: (list of uint8 numpy frames, list of frame durations in milliseconds)
+    """
+    pil_mode = 'RGB' if color_mode == 'rgb' else 'L'
+
+    frames, durations = [], []
+    for frame, duration in iter_frames(path, max_frames):
+        frame = frame.convert(pil_mode)
+        size = size or frame.size
+        if frame.size != size:
+            frame = resize(frame, size, 'final')
+        frames.append(np.asarray(frame, dtype=np.uint8))
+        durations.append(int(duration))
+
+    if not frames:
+        raise ValueError('No frames found')
+    return frames, durations
+
+def load_first_frame(path, color_mode='rgb', max_frames=None):
+    """
+    Decode only the first frame of an animated image or ZIP of frames, checking the rest from their headers.
+
+    For a ZIP every entry's header is checked as by load_frames; for an
+    animated image the frame count and size come from its header, so no
+    later frame is decoded either.
+
+    Args:
+        path: path of an animated GIF (or other multi-frame image) or a ZIP archive
+        color_mode: 'rgb' or 'grayscale'
+        max_frames: maximum number of frames (defaults to MAX_ANIMATION_FRAMES)
+
+    Returns:
+        tuple: (uint8 numpy first frame, number of frames)
+    """
+    max_frames = max_frames or MAX_ANIMATION_FRAMES
+    pil_mode = 'RGB' if color_mode == 'rgb' else 'L'
+
+    if not zipfile.is_zipfile(path):
+        with Image.open(path) as img:
+            n_frames = getattr(img, 'n_frames', 1)
+            check_frame_budget(n_frames, img.width * img.height, n_frames * img.width * img.height, max_frames)
+            return np.asarray(img.convert(pil_mode), dtype=np.uint8), n_frames
+
+    first, n_frames = None, 0
+    for frame, _ in iter_frames(path, max_frames):
+        if first is None:
+            first = np.asarray(frame.convert(pil_mode), dtype=np.uint8)
+        n_frames += 1
+
+    if first is None:
+        raise ValueError('No frames found')
+    return first, n_frames
+
+def create_animated_mosaic(element_img, frames, block_size, color_method='average_rgb', adjust_colors=True, alpha=0.7, tolerance=None, job_id=None, job_states=None, library=None):
+    """
+    Generate a mosaic for every frame, re-matching only the blocks that changed.
+
+    The first frame is matched in full. For later frames, block means are
+    compared against the means each block was last rendered with, and only
+    blocks that moved by more than the tolerance on some channel are
+    re-matched and re-rendered into a copy of the previous output frame.
+    Comparing against the last rendered means, rather than the previous
+    frame, keeps slow fades from drifting away unnoticed.
+
+    Args:
+        element_img: RGB or grayscale image (numpy array) - the building block
+        frames: list of equally sized target frames (numpy arrays)
+        block_size: size of each block in pixels
+        color_method: method for color matching
+        adjust_colors: whether to adjust block colors to better match target
+        alpha: blending factor for color adjustment
+        tolerance: maximum per-channel change of a block mean that still reuses the
+                   previous render (defaults to ANIMATION_CHANGE_TOLERANCE)
+        job_id: unique identifier for the job, for tracking progress
+        job_states: dictionary to store job states, for tracking progress
+        library: prebuilt ElementLibrary (e.g. a tile set); built from element_img if None
+
+    Returns:
+        tuple: (list of uint8 mosaic frames, list of blocks re-rendered per frame)
+    """
+    tolerance = ANIMATION_CHANGE_TOLERANCE if tolerance is None else tolerance
+
+    if library is None:
+        library = get_element_library(element_img, block_size, color_method)
+
+    n_blocks_h = frames[0].shape[0] // block_size
+    n_blocks_w = frames[0].shape[1] // block_size
+    ys, xs = np.mgrid[0:n_blocks_h, 0:n_blocks_w]
+    ys = ys.ravel() * block_size
+    xs = xs.ravel() * block_size
+    n_channels = frames[0].shape[2] if frames[0].ndim == 3 else 1
+
+    mosaic_frames = []
+    rendered_counts = []
+    rendered_means = None
+    mosaic = None
+
+    for step, frame in enumerate(frames):
+        if job_id is not None and job_states is not None:
+            job_states[job_id]['progress'] = 30 + (step / len(frames)) * 60
+
+        frame = frame[:n_blocks_h * block_size, :n_blocks_w * block_size]
+        means = get_block_average_colors(frame, block_size).reshape(-1, 3)
+        means = means[:, :n_channels]
+
+        if rendered_means is None:
+            changed = np.arange(len(means))
+            rendered_means = means.copy()
+            mosaic = np.empty(frame.shape, dtype=np.uint8)
+        else:
+            changed = np.nonzero(np.abs(means - rendered_means).max(axis=1) > tolerance)[0]
+            mosaic = mosaic.copy()
+
+        if len(changed):
+            rendered_means[changed] = means[changed]
+            indices = match_leaves(frame, ys[changed], xs[changed], means[changed], block_size, library, color_method)
+            render_leaves(mosaic, ys[changed], xs[changed], block_size, library, indices, means[changed], alpha if adjust_colors else 0)
+
+        mosaic_frames.append(mosaic)
+        rendered_counts.append(int(len(changed)))
+
+    return mosaic_frames, rendered_counts
+
+def save_animation(frames, path, durations, loop=0):
+    """
+    Encode frames as an animated GIF.
+
+    Args:
+        frames: list of uint8 numpy frames
+        path: output path
+        durations: frame durations in milliseconds
+        loop: number of loops (0 = forever)
+
+    Returns:
+        str: path where the animation was saved
+    """
+    images = [Image.fromarray(frame) for frame in frames]
+    images[0].save(path, save_all=True, append_images=images[1:], duration=durations, loop=loop, optimize=False)
+    return path
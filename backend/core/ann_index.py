@@ -0,0 +1,264 @@
+"""
+Approximate nearest-neighbour search over colour histograms.
+
+cv2.HISTCMP_CORREL is the cosine similarity of mean-centred histograms, so
+after centring and L2-normalising the features once, correlation against a
+whole library is a matrix product. HistogramIndex adds an inverted file on
+top: features are clustered into lists, stored compactly (float16 or int8)
+and a query only scores the lists whose centroids it is closest to.
+"""
+import time
+import numpy as np
+import cv2
+
+# Query rows scored per matrix product, to bound the (queries x library) buffer
+QUERY_CHUNK_SIZE = 256
+
+def centered_features(histograms):
+    """
+    Mean-centre and L2-normalise histograms so that correlation is a dot product.
+
+    Args:
+        histograms: (N, d) histograms
+
+    Returns:
+        numpy array: (N, d) float32 unit vectors (zero for flat histograms)
+    """
+    features = np.asarray(histograms, dtype=np.float32)
+    features = features - features.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    np.divide(features, norms, out=features, where=norms > 0)
+    return features
+
+def exact_correlation_search(query_histograms, library_histograms, k=1):
+    """
+    Exact top-k histogram correlation search, batched over queries.
+
+    Args:
+        query_histograms: (Q, d) query histograms
+        library_histograms: (N, d) library histograms
+        k: number of results per query
+
+    Returns:
+        tuple: ((Q, k) library indices, (Q, k) correlations), best first
+    """
+    queries = centered_features(query_histograms)
+    features = centered_features(library_histograms)
+    k = min(k, len(features))
+
+    indices = np.empty((len(queries), k), dtype=np.intp)
+    scores = np.empty((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), QUERY_CHUNK_SIZE):
+        chunk = queries[start:start + QUERY_CHUNK_SIZE] @ features.T
+        indices[start:start + len(chunk)], scores[start:start + len(chunk)] = _top_k(chunk, np.arange(len(features)), k)
+    return indices, scores
+
+def _top_k(scores, ids, k):
+    """Top-k columns of each row of scores, sorted best first"""
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    top_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    top_ids = np.take_along_axis(ids[part] if ids.ndim == 1 else np.take_along_axis(ids, part, axis=1), order, axis=1)
+    return top_ids, top_scores
+
+class HistogramIndex:
+    """
+    Inverted-file index of histogram features.
+
+    Attributes:
+        centroids: (nlist, d) float32 unit-length list centroids
+        offsets: (nlist + 1,) start of each list in the sorted arrays
+        ids: (N,) library index of each stored feature, grouped by list
+        codes: (N, d) float16 or int8 features, grouped by list
+        scale: multiplier that maps codes back to unit-vector units
+        histograms: original library histograms, used for exact reranking
+    """
+
+    def __init__(self, histograms, nlist=None, feature_dtype='float16', seed=0):
+        """
+        Build the index with spherical k-means on the centred features.
+
+        Args:
+            histograms: (N, d) library histograms
+            nlist: number of inverted lists (defaults to about sqrt(N))
+            feature_dtype: 'float16' or 'int8' storage for the list features
+            seed: random seed, so the same library always yields the same index
+        """
+        if feature_dtype not in ('float16', 'int8'):
+            raise ValueError(f"Unknown feature dtype: {feature_dtype}")
+
+        self.histograms = histograms
+        features = centered_features(histograms)
+        n_features = len(features)
+        nlist = max(1, min(nlist or int(round(np.sqrt(n_features))), n_features))
+
+        # Train on a bounded sample; assignment below covers every feature
+        rng = np.random.default_rng(seed)
+        sample_size = min(n_features, nlist * 64)
+        sample = features[rng.choice(n_features, sample_size, replace=False)] if sample_size < n_features else features
+
+        if nlist > 1:
+            cv2.setRNGSeed(seed)
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1e-4)
+            _, _, centroids = cv2.kmeans(sample, nlist, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+        else:
+            centroids = sample.mean(axis=0, keepdims=True)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        np.divide(centroids, norms, out=centroids, where=norms > 0)
+        self.centroids = centroids.astype(np.float32)
+
+        # Assign every feature to its most similar centroid and group by list
+        assignments = np.concatenate([
+            np.argmax(features[start:start + QUERY_CHUNK_SIZE] @ self.centroids.T, axis=1)
+            for start in range(0, n_features, QUERY_CHUNK_SIZE)
+        ])
+        self.ids = np.argsort(assignments, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))])
+
+        sorted_features = features[self.ids]
+        if feature_dtype == 'int8':
+            max_abs = float(np.abs(sorted_features).max()) or 1.0
+            self.scale = max_abs / 127
+            self.codes = np.round(sorted_features / self.scale).astype(np.int8)
+        else:
+            self.scale = 1.0
+            self.codes = sorted_features.astype(np.float16)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def nbytes(self):
+        """Memory used by the compact list features"""
+        return self.codes.nbytes + self.ids.nbytes + self.centroids.nbytes
+
+    def search(self, query_histograms, k=1, nprobe=8, rerank=True):
+        """
+        Find the top-k most correlated library histograms for each query.
+
+        Args:
+            query_histograms: (Q, d) query histograms
+            k: number of results per query
+            nprobe: number of inverted lists scanned per query
+            rerank: rescore the candidates with exact float32 correlation
+
+        Returns:
+            tuple: ((Q, k) library indices, (Q, k) correlations), best first;
+                   indices are -1 where fewer than k candidates were scanned
+        """
+        queries = centered_features(query_histograms)
+        n_queries = len(queries)
+        nprobe = min(nprobe, self.nlist)
+
+        # Lists to scan for each query
+        centroid_scores = queries @ self.centroids.T
+        if nprobe < self.nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.nlist), (n_queries, self.nlist))
+
+        best_ids = np.full((n_queries, k), -1, dtype=np.intp)
+        best_scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+
+        # Score each list once against every query that probes it
+        for list_id in range(self.nlist):
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start == end:
+                continue
+            query_ids = np.nonzero((probes == list_id).any(axis=1))[0]
+            if not len(query_ids):
+                continue
+
+            codes = self.codes[start:end].astype(np.float32)
+            scores = (queries[query_ids] @ codes.T) * self.scale
+            ids = np.broadcast_to(self.ids[start:end], scores.shape)
+
+            merged_scores = np.concatenate([best_scores[query_ids], scores], axis=1)
+            merged_ids = np.concatenate([best_ids[query_ids], ids], axis=1)
+            best_ids[query_ids], best_scores[query_ids] = _top_k(merged_scores, merged_ids, k)
+
+        if rerank:
+            best_ids, best_scores = self._rerank(queries, best_ids, best_scores)
+
+        return best_ids, best_scores
+
+    def _rerank(self, queries, ids, scores):
+        """Rescore candidate ids with exact correlation and re-sort them"""
+        valid = ids >= 0
+        candidates = centered_features(np.asarray(self.histograms)[np.where(valid, ids, 0).ravel()])
+        candidates = candidates.reshape(ids.shape + (-1,))
+        exact = np.einsum('qd,qkd->qk', queries, candidates)
+        exact = np.where(valid, exact, -np.inf).astype(np.float32)
+        return _top_k(exact, ids, ids.shape[1])
+
+def benchmark_histogram_index(library_histograms, query_histograms, k=1, nlist=None, nprobe_values=(1, 4, 8, 16), feature_dtype='float16', rerank=True):
+    """
+    Measure recall and speed of HistogramIndex against exact search.
+
+    Args:
+        library_histograms: (N, d) library histograms
+        query_histograms: (Q, d) query histograms
+        k: number of candidates per query (recall@k counts the exact best match among them)
+        nlist: number of inverted lists
+        nprobe_values: probe counts to evaluate
+        feature_dtype: 'float16' or 'int8'
+        rerank: rerank candidates exactly
+
+    Returns:
+        dict: build time, exact search time and per-nprobe recall and search time
+    """
+    start = time.perf_counter()
+    exact_ids, _ = exact_correlation_search(query_histograms, library_histograms, k=1)
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = HistogramIndex(library_histograms, nlist=nlist, feature_dtype=feature_dtype)
+    build_time = time.perf_counter() - start
+
+    results = []
+    for nprobe in nprobe_values:
+        start = time.perf_counter()
+        ids, _ = index.search(query_histograms, k=k, nprobe=nprobe, rerank=rerank)
+        elapsed = time.perf_counter() - start
+        results.append({
+            'nprobe': nprobe,
+            'recall_at_1': float((ids[:, 0] == exact_ids[:, 0]).mean()),
+            'recall_at_k': float((ids == exact_ids).any(axis=1).mean()),
+            'search_time': elapsed,
+            'speedup': exact_time / elapsed if elapsed > 0 else None
+        })
+
+    return {
+        'library_size': len(library_histograms),
+        'queries': len(query_histograms),
+        'nlist': index.nlist,
+        'feature_dtype': feature_dtype,
+        'index_bytes': index.nbytes,
+        'exact_bytes': int(np.asarray(library_histograms, dtype=np.float32).nbytes),
+        'build_time': build_time,
+        'exact_time': exact_time,
+        'results': results
+    }
+
+if __name__ == '__main__':
+    import json
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.image_utils import get_color_histograms
+
+    # Synthetic benchmark: smooth random tiles as the library, noisy copies as queries
+    rng = np.random.default_rng(0)
+    n_tiles = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    base = rng.integers(0, 256, (n_tiles, 4, 4, 3), dtype=np.uint8)
+    tiles = np.stack([cv2.resize(tile, (16, 16), interpolation=cv2.INTER_CUBIC) for tile in base])
+    noise = rng.integers(-12, 13, (2000, 16, 16, 3))
+    queries = np.clip(tiles[rng.choice(n_tiles, 2000)].astype(np.int64) + noise, 0, 255).astype(np.uint8)
+
+    report = benchmark_histogram_index(get_color_histograms(tiles), get_color_histograms(queries), k=8)
+    print(json.dumps(report, indent=2))
@@ -4,7 +4,16 @@ Functions for color analysis and matching.
 import numpy as np
 import cv2
 from PIL import Image
-from utils.image_utils import get_average_color, get_color_histogram, color_distance, histogram_comparison
+from numpy.lib.stride_tricks import sliding_window_view
+from utils.image_utils import get_average_color, get_color_histograms, color_distance, histogram_comparison, rgb_to_lab, lab_distance
+from core.element_library import ElementLibrary
+from core.ann_index import HistogramIndex, exact_correlation_search, centered_features, QUERY_CHUNK_SIZE
+from core.color_lut import ColorLookupTable
+from core.palette import extract_palette, get_cached_palette, hash_image
+from config import AVAILABLE_COLOR_METHODS
+
+# Target-library pairs scored at once by the CIEDE2000 matcher
+LAB_CHUNK_PAIRS = 1 << 20
 
 def build_element_library(element_img, block_size, method='average_rgb'):
     """
@@ -13,47 +22,117 @@ def build_element_library(element_img, block_size, method='average_rgb'):
     Args:
         element_img: numpy array of the element image
         block_size: size of each block
-        method: 'average_rgb' or 'histogram'
+        method: 'average_rgb', 'histogram', 'cascade' or 'lab'
         
     Returns:
-        dict: Library of element blocks with color information
+        ElementLibrary: Library of element blocks with color information
     """
+    if method not in AVAILABLE_COLOR_METHODS:
+        raise ValueError(f"Unknown color analysis method: {method}")
+    
     # Get dimensions
     height, width = element_img.shape[:2]
     
     # Calculate how many blocks we can get
     n_blocks_h = height // block_size
     n_blocks_w = width // block_size
+    channel_shape = element_img.shape[2:]
     
-    # Initialize library
-    library = []
-    
-    # Extract blocks and calculate color features
-    for i in range(n_blocks_h):
-        for j in range(n_blocks_w):
-            # Extract block
-            h_start = i * block_size
-            h_end = (i + 1) * block_size
-            w_start = j * block_size
-            w_end = (j + 1) * block_size
-            
-            block = element_img[h_start:h_end, w_start:w_end]
-            
-            # Calculate color feature
-            if method == 'average_rgb':
-                color_feature = get_average_color(block)
-            elif method == 'histogram':
-                color_feature = get_color_histogram(block)
-            else:
-                raise ValueError(f"Unknown color analysis method: {method}")
-            
-            # Add to library
-            library.append({
-                'block': block,
-                'color_feature': color_feature,
-                'position': (i, j)
-            })
+    # Cut the non-overlapping blocks out in one reshape: (N, bs, bs[, C])
+    cropped = element_img[:n_blocks_h * block_size, :n_blocks_w * block_size]
+    blocks = cropped.reshape((n_blocks_h, block_size, n_blocks_w, block_size) + channel_shape)
+    blocks = blocks.swapaxes(1, 2).reshape((n_blocks_h * n_blocks_w, block_size, block_size) + channel_shape)
+    
+    # Average colours of all blocks at once
+    if channel_shape:
+        means = blocks.mean(axis=(1, 2), dtype=np.float64)[:, :3]
+    else:
+        means = np.repeat(blocks.mean(axis=(1, 2), dtype=np.float64)[:, None], 3, axis=1)
+    
+    # Histograms are only needed for histogram and cascade matching
+    histograms = get_color_histograms(blocks) if method in ('histogram', 'cascade') else None
+    
+    rows, cols = np.mgrid[0:n_blocks_h, 0:n_blocks_w]
+    positions = np.stack([rows.ravel(), cols.ravel()], axis=1)
+    
+    library = ElementLibrary(blocks, means, histograms, positions, method=method)
+    if method == 'lab':
+        # Convert the library colours to Lab once, at build time
+        get_lab_means(library)
+    return library
+
+def build_sliding_window_library(element_img, block_size, method='average_rgb', stride=None, scales=(1.0,), flips=False):
+    """
+    Build a rich element library from overlapping tiles at several scales.
+    
+    Tiles are cut with a strided sliding_window_view of each scaled (and
+    optionally mirrored) element, and all features are computed in batch.
+    If the element is too small for any tile, it is resized to one block.
+    
+    Args:
+        element_img: numpy array of the element image
+        block_size: size of each block
+        method: 'average_rgb', 'histogram', 'cascade' or 'lab'
+        stride: pixel step between tiles (defaults to block_size, i.e. no overlap)
+        scales: element scale factors to extract tiles from
+        flips: also extract tiles from horizontally and vertically mirrored elements
+        
+    Returns:
+        ElementLibrary: Library of element blocks with color information
+    """
+    if method not in AVAILABLE_COLOR_METHODS:
+        raise ValueError(f"Unknown color analysis method: {method}")
+    
+    stride = stride or block_size
+    height, width = element_img.shape[:2]
+    
+    # Source images: each scale, plus mirrored copies if requested
+    sources = []
+    for scale in scales:
+        scaled_w, scaled_h = int(round(width * scale)), int(round(height * scale))
+        if scaled_w < block_size or scaled_h < block_size:
+            continue
+        if (scaled_w, scaled_h) == (width, height):
+            scaled = element_img
+        else:
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+            scaled = cv2.resize(element_img, (scaled_w, scaled_h), interpolation=interpolation)
+        sources.append(scaled)
+        if flips:
+            sources.append(scaled[:, ::-1])
+            sources.append(scaled[::-1, :])
+    
+    if not sources:
+        # Element smaller than a block at every scale: fall back to one resized tile
+        sources.append(cv2.resize(element_img, (block_size, block_size), interpolation=cv2.INTER_LINEAR))
+    
+    all_blocks = []
+    all_positions = []
+    for source in sources:
+        # (n_h, n_w[, C], bs, bs) windows, stepped by the stride
+        windows = sliding_window_view(source, (block_size, block_size), axis=(0, 1))[::stride, ::stride]
+        n_h, n_w = windows.shape[:2]
+        if source.ndim == 3:
+            windows = np.moveaxis(windows, 2, -1)
+        all_blocks.append(windows.reshape((n_h * n_w, block_size, block_size) + source.shape[2:]))
+        
+        rows, cols = np.mgrid[0:n_h, 0:n_w]
+        all_positions.append(np.stack([rows.ravel(), cols.ravel()], axis=1))
+    
+    blocks = np.concatenate(all_blocks)
+    positions = np.concatenate(all_positions)
+    
+    # Batch features
+    if blocks.ndim == 4:
+        means = blocks.mean(axis=(1, 2), dtype=np.float64)[:, :3]
+    else:
+        means = np.repeat(blocks.mean(axis=(1, 2), dtype=np.float64)[:, None], 3, axis=1)
+    histograms = get_color_histograms(blocks) if method in ('histogram', 'cascade') else None
     
+    library = ElementLibrary(blocks, means, histograms, positions, method=method)
+    if method == 'lab':
+        # Convert the library colours to Lab once, at build time
+        get_lab_means(library)
     return library
 
 def find_best_matching_block(target_color, element_library, method='average_rgb'):
@@ -62,12 +141,22 @@ def find_best_matching_block(target_color, element_library, method='average_rgb'
     
     Args:
         target_color: target color feature
-        element_library: library of element blocks
+        element_library: ElementLibrary or legacy list of entry dictionaries
         method: 'average_rgb' or 'histogram'
         
     Returns:
         dict: Best matching block entry from the library
     """
+    if isinstance(element_library, ElementLibrary):
+        # Scan the contiguous feature arrays instead of per-entry dictionaries
+        if len(element_library) == 0:
+            return None
+        if method == 'average_rgb':
+            distances = np.sqrt(((element_library.means - np.asarray(target_color, dtype=np.float32)) ** 2).sum(axis=1))
+            return element_library[int(np.argmin(distances))]
+        scores = [histogram_comparison(target_color, hist) for hist in element_library.histograms]
+        return element_library[int(np.argmax(scores))]
+    
     best_match = None
     best_score = float('-inf') if method == 'histogram' else float('inf')
     
@@ -87,6 +176,210 @@ def find_best_matching_block(target_color, element_library, method='average_rgb'
     
     return best_match
 
+def get_color_lut(element_library, build=True):
+    """
+    Get the library's colour lookup table, building and caching it if needed.
+    
+    Args:
+        element_library: ElementLibrary
+        build: build the table when it is not cached yet
+        
+    Returns:
+        ColorLookupTable: cached table, or None if not cached and build is False
+    """
+    from config import COLOR_LUT_BITS, COLOR_LUT_CANDIDATES
+    
+    lut = element_library.cache.get('color_lut')
+    if lut is None and build:
+        lut = ColorLookupTable(element_library.means, bits=COLOR_LUT_BITS, n_candidates=COLOR_LUT_CANDIDATES)
+        element_library.cache['color_lut'] = lut
+    return lut
+
+def match_average_colors(target_means, element_library):
+    """
+    Find the library entry nearest in average colour for many targets at once.
+    
+    With AVERAGE_RGB_MATCHER = 'lut' the colour lookup table is used when the
+    library already has one, or when there are at least as many targets as
+    table cells so that building it pays off. With COLOR_LUT_REFINE the
+    result is the same as the exact search.
+    
+    Args:
+        target_means: (Q, 3) target average colours
+        element_library: ElementLibrary
+        
+    Returns:
+        numpy array: (Q,) library index for each target colour
+    """
+    from config import AVERAGE_RGB_MATCHER, COLOR_LUT_BITS, COLOR_LUT_REFINE
+    
+    target_means = np.asarray(target_means, dtype=np.float32)
+    
+    if AVERAGE_RGB_MATCHER == 'lut':
+        lut = get_color_lut(element_library, build=len(target_means) >= 1 << (3 * COLOR_LUT_BITS))
+        if lut is not None:
+            best, uncovered = lut.lookup(target_means, refine=COLOR_LUT_REFINE)
+            if COLOR_LUT_REFINE and uncovered.any():
+                best[uncovered] = _nearest_means(target_means[uncovered], element_library.means)
+            return best
+    
+    return _nearest_means(target_means, element_library.means)
+
+def _nearest_means(target_means, library_means):
+    """Exhaustive nearest library colour, the batched form of find_best_matching_block"""
+    best = np.empty(len(target_means), dtype=np.intp)
+    channels = np.ascontiguousarray(np.asarray(library_means, dtype=np.float32).T)
+    for start in range(0, len(target_means), QUERY_CHUNK_SIZE):
+        chunk = target_means[start:start + QUERY_CHUNK_SIZE]
+        # Accumulate channel by channel: same float32 sums as find_best_matching_block
+        distances = np.square(channels[0][None, :] - chunk[:, 0, None])
+        for c in (1, 2):
+            distances += np.square(channels[c][None, :] - chunk[:, c, None])
+        best[start:start + len(chunk)] = np.argmin(distances, axis=1)
+    return best
+
+def get_lab_means(element_library):
+    """
+    Get the library's average colours in CIELAB, converting and caching them once.
+    
+    Args:
+        element_library: ElementLibrary
+        
+    Returns:
+        numpy array: (N, 3) float32 Lab colours
+    """
+    lab_means = element_library.cache.get('lab_means')
+    if lab_means is None:
+        lab_means = rgb_to_lab(element_library.means)
+        element_library.cache['lab_means'] = lab_means
+    return lab_means
+
+def match_lab_colors(target_lab, element_library, formula=None):
+    """
+    Find the library entry with the smallest perceptual colour difference for many targets.
+    
+    Args:
+        target_lab: (Q, 3) target average colours in CIELAB
+        element_library: ElementLibrary
+        formula: 'cie76' or 'ciede2000' (defaults to LAB_DISTANCE)
+        
+    Returns:
+        numpy array: (Q,) library index for each target colour
+    """
+    from config import LAB_DISTANCE, LAB_PREFILTER_K
+    
+    formula = formula or LAB_DISTANCE
+    library_lab = get_lab_means(element_library)
+    target_lab = np.asarray(target_lab, dtype=np.float32)
+    
+    if formula == 'cie76':
+        # Euclidean distance in Lab
+        return _nearest_means(target_lab, library_lab)
+    
+    # CIEDE2000 is only evaluated on the prefilter_k nearest entries in CIE76
+    k = min(LAB_PREFILTER_K, len(library_lab)) if LAB_PREFILTER_K else len(library_lab)
+    library_norms = (library_lab ** 2).sum(axis=1)
+    
+    # Bound the (targets x candidates) temporaries of the CIEDE2000 terms
+    chunk_size = max(1, LAB_CHUNK_PAIRS // k)
+    best = np.empty(len(target_lab), dtype=np.intp)
+    for start in range(0, len(target_lab), chunk_size):
+        chunk = target_lab[start:start + chunk_size]
+        if k < len(library_lab):
+            distances = library_norms - 2 * (chunk @ library_lab.T)
+            candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(k), (len(chunk), k))
+        distances = lab_distance(chunk[:, None, :], library_lab[candidates], formula=formula)
+        best[start:start + len(chunk)] = candidates[np.arange(len(chunk)), np.argmin(distances, axis=1)]
+    return best
+
+def match_histograms(target_histograms, element_library):
+    """
+    Find the best matching library entry for many target histograms at once.
+    
+    Uses histogram correlation like find_best_matching_block. Libraries with
+    at least ANN_MIN_LIBRARY_SIZE entries are searched through a cached
+    HistogramIndex when HISTOGRAM_MATCHER is 'ann'; smaller ones exactly.
+    
+    Args:
+        target_histograms: (Q, n_bins) target histograms
+        element_library: ElementLibrary with histograms
+        
+    Returns:
+        numpy array: (Q,) library index for each target histogram
+    """
+    from config import (
+        HISTOGRAM_MATCHER, ANN_MIN_LIBRARY_SIZE, ANN_NLIST, ANN_NPROBE,
+        ANN_TOP_K, ANN_RERANK, ANN_FEATURE_DTYPE
+    )
+    
+    if HISTOGRAM_MATCHER == 'ann' and len(element_library) >= ANN_MIN_LIBRARY_SIZE:
+        index = element_library.cache.get('histogram_index')
+        if index is None:
+            index = HistogramIndex(element_library.histograms, nlist=ANN_NLIST, feature_dtype=ANN_FEATURE_DTYPE)
+            element_library.cache['histogram_index'] = index
+        
+        indices, _ = index.search(target_histograms, k=ANN_TOP_K, nprobe=ANN_NPROBE, rerank=ANN_RERANK)
+        best = indices[:, 0]
+        
+        # Queries whose probed lists were all empty fall back to exact search
+        missing = best < 0
+        if missing.any():
+            best[missing] = exact_correlation_search(target_histograms[missing], element_library.histograms)[0][:, 0]
+        return best
+    
+    return exact_correlation_search(target_histograms, element_library.histograms)[0][:, 0]
+
+def match_cascade(target_means, target_histograms, element_library, k=None):
+    """
+    Two-stage matching: average-colour prefilter, then histogram correlation.
+    
+    The K library entries nearest in average colour are kept for each target
+    block and only those are rescored with histogram correlation, so the
+    expensive comparison runs on K candidates instead of the whole library.
+    
+    Args:
+        target_means: (Q, 3) target average colours
+        target_histograms: (Q, n_bins) target histograms
+        element_library: ElementLibrary with histograms
+        k: number of prefilter candidates (defaults to CASCADE_TOP_K)
+        
+    Returns:
+        numpy array: (Q,) library index for each target block
+    """
+    from config import CASCADE_TOP_K
+    
+    k = min(k or CASCADE_TOP_K, len(element_library))
+    library_means = element_library.means
+    library_norms = (library_means ** 2).sum(axis=1)
+    
+    # Centred library histograms are reused by every job on this library
+    library_features = element_library.cache.get('centered_histograms')
+    if library_features is None:
+        library_features = centered_features(element_library.histograms)
+        element_library.cache['centered_histograms'] = library_features
+    
+    target_means = np.asarray(target_means, dtype=np.float32)
+    target_features = centered_features(target_histograms)
+    best = np.empty(len(target_means), dtype=np.intp)
+    
+    for start in range(0, len(target_means), QUERY_CHUNK_SIZE):
+        means = target_means[start:start + QUERY_CHUNK_SIZE]
+        
+        # Squared RGB distances to every library entry; keep the K nearest
+        distances = library_norms - 2 * (means @ library_means.T)
+        if k < len(element_library):
+            candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(k), distances.shape)
+        
+        # Histogram correlation of the candidates only
+        scores = np.einsum('qd,qkd->qk', target_features[start:start + QUERY_CHUNK_SIZE], library_features[candidates])
+        best[start:start + len(means)] = candidates[np.arange(len(means)), np.argmax(scores, axis=1)]
+    
+    return best
+
 def adjust_block_colors(block, target_color, alpha=0.7):
     """
     Adjust the colors of a block to better match the target color.
@@ -128,41 +421,69 @@ def adjust_block_colors(block, target_color, alpha=0.7):
     
     return adjusted_block.astype(np.uint8)
 
-def create_color_palette(image, n_colors=8):
+def assemble_mosaic(library_blocks, library_means, match_indices, target_means, alpha=0.7):
     """
-    Extract the dominant colors from an image to create a color palette.
+    Build a mosaic from a grid of matched library indices in one batched pass.
+    
+    Equivalent to copying each matched block and calling adjust_block_colors on
+    it, but the library means are reused instead of re-measured and the
+    gather, colour offset and clip run on a whole row of blocks at a time.
     
     Args:
-        image: numpy array of the image
-        n_colors: number of colors to extract
+        library_blocks: (N, bs, bs[, C]) uint8 array of library blocks
+        library_means: (N, 3) average colours of the library blocks
+        match_indices: (n_h, n_w) library index for each target block
+        target_means: (n_h, n_w, 3) average colours of the target blocks
+        alpha: blending factor (0 = no change, 1 = full target color)
         
     Returns:
-        list: List of (R, G, B) tuples representing the dominant colors
+        numpy array: uint8 mosaic of shape (n_h * bs, n_w * bs[, C])
     """
-    # Reshape the image for k-means
-    pixels = image.reshape(-1, 3) if len(image.shape) == 3 else image.reshape(-1, 1)
-    pixels = pixels.astype(np.float32)
+    n_h, n_w = match_indices.shape
+    block_size = library_blocks.shape[1]
+    channel_shape = library_blocks.shape[3:]
     
-    # Define criteria and apply k-means
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.2)
-    _, labels, centers = cv2.kmeans(pixels, n_colors, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    mosaic = np.empty((n_h * block_size, n_w * block_size) + channel_shape, dtype=np.uint8)
+    # (n_h, bs, n_w, bs[, C]) view so one row of blocks is written at once
+    mosaic_blocks = mosaic.reshape((n_h, block_size, n_w, block_size) + channel_shape)
     
-    # Convert centers to integers
-    centers = centers.astype(np.uint8)
+    # float64 like adjust_block_colors, so the results are bit-identical
+    library_means = np.asarray(library_means, dtype=np.float64)
+    target_means = np.asarray(target_means, dtype=np.float64)
+    n_channels = channel_shape[0] if channel_shape else 1
     
-    # Count occurrences of each label
-    counts = np.bincount(labels.flatten())
+    for i in range(n_h):
+        # Gather the matched blocks for this row: (n_w, bs, bs[, C])
+        blocks = library_blocks[match_indices[i]]
+        
+        if alpha != 0:
+            # Per-block colour offset, broadcast over the block pixels
+            offset = alpha * (target_means[i, :, :n_channels] - library_means[match_indices[i], :n_channels])
+            if channel_shape:
+                band = blocks.astype(np.float64) + offset[:, None, None, :]
+            else:
+                band = blocks.astype(np.float64) + offset[:, 0, None, None]
+            np.clip(band, 0, 255, out=band)
+            blocks = band
+        
+        mosaic_blocks[i] = blocks.swapaxes(0, 1)
     
-    # Sort colors by frequency (most frequent first)
-    sorted_indices = np.argsort(counts)[::-1]
-    sorted_centers = centers[sorted_indices]
+    return mosaic
+
+def create_color_palette(image, n_colors=8):
+    """
+    Extract the dominant colors from an image to create a color palette.
     
-    # Convert to RGB tuples
-    palette = []
-    for center in sorted_centers:
-        if len(center) == 1:  # Grayscale
-            palette.append((center[0], center[0], center[0]))
-        else:  # RGB
-            palette.append(tuple(center))
+    Uses a weighted colour histogram and seeded mini-batch k-means, so the
+    same image always yields the same palette; results are cached by image
+    hash and n_colors.
     
-    return palette
\ No newline at end of file
+    Args:
+        image: numpy array of the image
+        n_colors: number of colors to extract
+        
+    Returns:
+        list: List of (R, G, B) tuples representing the dominant colors
+    """
+    palette = get_cached_palette(hash_image(image), n_colors, lambda: extract_palette(image, n_colors))
+    return [entry['color'] for entry in palette]
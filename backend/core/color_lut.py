@@ -0,0 +1,130 @@
+"""
+Quantised colour to library index lookup table for average-colour matching.
+"""
+import numpy as np
+
+# Cell centres scored against the library per chunk while building the table
+BUILD_CHUNK_SIZE = 1024
+
+class ColorLookupTable:
+    """
+    Dense table mapping a quantised RGB colour to its nearest library entries.
+
+    Each cell stores the library entries nearest to the cell centre, best
+    first. A plain lookup returns the first one. Refinement rescores the
+    cell's candidates against the exact colour; that is provably the exact
+    nearest entry when the last candidate is further from the centre than
+    the first by more than the cell diagonal, which `covered` records.
+
+    Attributes:
+        bits: bits per channel (levels = 2 ** bits)
+        candidates: (levels, levels, levels, C) int32 nearest entries per cell centre
+        covered: (levels, levels, levels) bool cells whose candidates contain every possible nearest entry
+        library_means: (N, 3) float32 library colours, for refinement
+    """
+
+    def __init__(self, library_means, bits=5, n_candidates=32):
+        """
+        Args:
+            library_means: (N, 3) library average colours
+            bits: bits per channel of the quantised colour
+            n_candidates: library entries kept per cell for refinement
+        """
+        self.bits = bits
+        self.library_means = np.asarray(library_means, dtype=np.float32)
+        levels = 1 << bits
+        cell_width = 256 / levels
+        n_candidates = min(n_candidates, len(self.library_means))
+
+        means = self.library_means.astype(np.float64)
+        library_norms = (means ** 2).sum(axis=1)
+
+        # Cell centres in (R, G, B) raster order
+        axis = (np.arange(levels) + 0.5) * cell_width
+        centres = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+
+        candidates = np.empty((len(centres), n_candidates), dtype=np.int32)
+        covered = np.ones(len(centres), dtype=bool)
+        # Any colour in a cell is within half a diagonal of the centre
+        margin = 2 * (cell_width / 2) * np.sqrt(3)
+
+        for start in range(0, len(centres), BUILD_CHUNK_SIZE):
+            chunk = centres[start:start + BUILD_CHUNK_SIZE]
+            distances = library_norms - 2 * (chunk @ means.T) + (chunk ** 2).sum(axis=1, keepdims=True)
+            np.maximum(distances, 0, out=distances)
+
+            if n_candidates < len(means):
+                nearest = np.argpartition(distances, n_candidates - 1, axis=1)[:, :n_candidates]
+            else:
+                nearest = np.broadcast_to(np.arange(len(means)), distances.shape)
+            nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1, kind='stable')
+            candidates[start:start + len(chunk)] = np.take_along_axis(nearest, order, axis=1)
+
+            if n_candidates < len(means):
+                nearest_distances = np.sqrt(np.take_along_axis(nearest_distances, order, axis=1))
+                covered[start:start + len(chunk)] = nearest_distances[:, -1] - nearest_distances[:, 0] > margin
+
+        self.candidates = candidates.reshape(levels, levels, levels, n_candidates)
+        self.covered = covered.reshape(levels, levels, levels)
+
+    @property
+    def indices(self):
+        """(levels, levels, levels) nearest entry to each cell centre"""
+        return self.candidates[..., 0]
+
+    @property
+    def covered_fraction(self):
+        """Fraction of cells where refinement is provably exact"""
+        return float(self.covered.mean())
+
+    @property
+    def nbytes(self):
+        return self.candidates.nbytes + self.covered.nbytes
+
+    def save(self, path):
+        """Save the table as an uncompressed .npz next to its library"""
+        np.savez(path, bits=self.bits, candidates=self.candidates, covered=self.covered, library_means=self.library_means)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a table saved with save().
+
+        Args:
+            path: path of the .npz file
+
+        Returns:
+            ColorLookupTable: loaded table
+        """
+        with np.load(path) as data:
+            table = cls.__new__(cls)
+            table.bits = int(data['bits'])
+            table.candidates = data['candidates']
+            table.covered = data['covered']
+            table.library_means = data['library_means']
+        return table
+
+    def lookup(self, colors, refine=False):
+        """
+        Look up the library entry for many colours with one gather.
+
+        Args:
+            colors: (Q, 3) RGB colours in [0, 255]
+            refine: pick the nearest of each cell's candidates instead of the first
+
+        Returns:
+            tuple: ((Q,) library indices, (Q,) bool mask of colours whose cell is
+                   not covered and may need an exhaustive search)
+        """
+        colors = np.asarray(colors, dtype=np.float32)
+        cells = np.clip(colors * ((1 << self.bits) / 256), 0, (1 << self.bits) - 1).astype(np.intp)
+        r, g, b = cells[:, 0], cells[:, 1], cells[:, 2]
+
+        if not refine:
+            return self.indices[r, g, b].astype(np.intp), ~self.covered[r, g, b]
+
+        candidates = self.candidates[r, g, b]
+        distances = ((self.library_means[candidates] - colors[:, None, :]) ** 2).sum(axis=2)
+        best = candidates[np.arange(len(colors)), np.argmin(distances, axis=1)]
+        return best.astype(np.intp), ~self.covered[r, g, b]
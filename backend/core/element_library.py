@@ -0,0 +1,146 @@
+"""
+Struct-of-arrays element library used by the block matchers.
+"""
+import mmap
+import numpy as np
+from multiprocessing import shared_memory
+
+# Arrays stored by the library, in shared-memory layout order
+LIBRARY_FIELDS = ('blocks', 'means', 'histograms', 'positions')
+SHARED_MEMORY_ALIGNMENT = 64
+
+def _is_memory_mapped(array):
+    """Whether an array (or the array it views) is backed by a memory-mapped file"""
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+class ElementLibrary:
+    """
+    Library of element blocks backed by contiguous arrays.
+
+    Attributes:
+        blocks: (N, bs, bs[, C]) uint8 block pixels
+        means: (N, 3) float32 average colours (grayscale is replicated)
+        histograms: (N, bins) float32 colour histograms, or None when not computed
+        positions: (N, 2) int16 (row, column) of each block in its source grid
+        method: colour feature used for matching ('average_rgb', 'histogram', 'cascade' or 'lab')
+        cache: per-library cache for derived structures (dropped when pickled)
+    """
+    __slots__ = ('blocks', 'means', 'histograms', 'positions', 'method', 'cache', '_shm')
+
+    def __init__(self, blocks, means, histograms=None, positions=None, method='average_rgb'):
+        self.blocks = np.ascontiguousarray(blocks, dtype=np.uint8)
+        self.means = np.ascontiguousarray(means, dtype=np.float32)
+        self.histograms = None if histograms is None else np.ascontiguousarray(histograms, dtype=np.float32)
+        if positions is None:
+            positions = np.zeros((len(self.blocks), 2), dtype=np.int16)
+        self.positions = np.ascontiguousarray(positions, dtype=np.int16)
+        self.method = method
+        self.cache = {}
+        self._shm = None
+
+    @property
+    def block_size(self):
+        return self.blocks.shape[1]
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the library arrays and its cache (LUT, ANN index, derived features).
+
+        Memory-mapped arrays are backed by their files and are not counted.
+        """
+        arrays = [self.blocks, self.means, self.histograms, self.positions]
+        total = sum(array.nbytes for array in arrays if array is not None and not _is_memory_mapped(array))
+        for value in self.cache.values():
+            total += getattr(value, 'nbytes', 0)
+        return int(total)
+
+    @property
+    def features(self):
+        """Feature matrix for this library's matching method"""
+        return self.histograms if self.method in ('histogram', 'cascade') else self.means
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, index):
+        """Legacy dictionary view of a single entry"""
+        if self.method in ('histogram', 'cascade'):
+            color_feature = self.histograms[index]
+        else:
+            color_feature = tuple(self.means[index])
+
+        return {
+            'block': self.blocks[index],
+            'color_feature': color_feature,
+            'mean_color': tuple(self.means[index]),
+            'position': tuple(int(p) for p in self.positions[index]),
+            'index': int(index)
+        }
+
+    def __iter__(self):
+        """Iterate over legacy dictionary entries"""
+        for index in range(len(self)):
+            yield self[index]
+
+    def __reduce__(self):
+        # Pickle only the arrays; caches and shared-memory handles are process-local
+        return (ElementLibrary, (self.blocks, self.means, self.histograms, self.positions, self.method))
+
+    def to_shared_memory(self):
+        """
+        Copy the library arrays into one shared-memory segment.
+
+        Returns:
+            tuple: (SharedMemory, descriptor) - the caller owns the segment and must
+                   close() and unlink() it; the descriptor is a small picklable dict
+                   that from_shared_memory() attaches to in another process
+        """
+        layout = {}
+        offset = 0
+        for field in LIBRARY_FIELDS:
+            array = getattr(self, field)
+            if array is None:
+                continue
+            offset = -(-offset // SHARED_MEMORY_ALIGNMENT) * SHARED_MEMORY_ALIGNMENT
+            layout[field] = (offset, array.shape, array.dtype.str)
+            offset += array.nbytes
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, offset))
+        for field, (field_offset, shape, dtype) in layout.items():
+            target = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=field_offset)
+            target[...] = getattr(self, field)
+
+        return shm, {'name': shm.name, 'method': self.method, 'layout': layout}
+
+    @classmethod
+    def from_shared_memory(cls, descriptor):
+        """
+        Attach to a library published with to_shared_memory() without copying.
+
+        Args:
+            descriptor: descriptor returned by to_shared_memory()
+
+        Returns:
+            ElementLibrary: read-only library viewing the shared segment
+        """
+        shm = shared_memory.SharedMemory(name=descriptor['name'])
+        arrays = {}
+        for field, (offset, shape, dtype) in descriptor['layout'].items():
+            array = np.ndarray(tuple(shape), dtype=dtype, buffer=shm.buf, offset=offset)
+            array.flags.writeable = False
+            arrays[field] = array
+
+        library = cls.__new__(cls)
+        library.blocks = arrays['blocks']
+        library.means = arrays['means']
+        library.histograms = arrays.get('histograms')
+        library.positions = arrays['positions']
+        library.method = descriptor['method']
+        library.cache = {}
+        library._shm = shm  # Keep the mapping alive as long as the library
+        return library
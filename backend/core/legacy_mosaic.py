@@ -1,7 +1,16 @@
 """
 Original mosaic generation logic that produced high-quality results.
+
+Dtype policy: images stay uint8 end to end. Arithmetic that needs fractions
+is done in WORKING_DTYPE (float32) on block-sized or row-band-sized pieces,
+never on a full-size float copy of the mosaic, and normalization to the
+0-255 range is applied in place through a per-channel lookup table.
 """
 import numpy as np
+import cv2
+from utils.tiled_image import TiledImage
+
+WORKING_DTYPE = np.float32
 
 def create_image_matrix(element_img, matrix_size):
     """
@@ -12,37 +21,9 @@ def create_image_matrix(element_img, matrix_size):
         matrix_size: tuple (H, W) specifying height and width of the output in terms of element blocks
     
     Returns:
-        mosaic: numpy array representing the mosaic image
+        TiledImage: read-only view repeating element_img; np.asarray() materialises it
     """
-    # Handle RGB vs grayscale images
-    if len(element_img.shape) == 3:
-        N, M, C = element_img.shape
-        H, W = matrix_size
-        
-        # Create a row of element images
-        row_tmp = np.zeros((N, M*W, C), dtype=element_img.dtype)
-        for j in range(W):
-            row_tmp[:, j*M:(j+1)*M, :] = element_img
-        
-        # Repeat the row to create the full mosaic
-        mosaic = np.zeros((N*H, M*W, C), dtype=element_img.dtype)
-        for i in range(H):
-            mosaic[i*N:(i+1)*N, :, :] = row_tmp
-    else:
-        N, M = element_img.shape
-        H, W = matrix_size
-        
-        # Create a row of element images
-        row_tmp = np.zeros((N, M*W), dtype=element_img.dtype)
-        for j in range(W):
-            row_tmp[:, j*M:(j+1)*M] = element_img
-        
-        # Repeat the row to create the full mosaic
-        mosaic = np.zeros((N*H, M*W), dtype=element_img.dtype)
-        for i in range(H):
-            mosaic[i*N:(i+1)*N, :] = row_tmp
-        
-    return mosaic
+    return TiledImage(element_img, matrix_size)
 
 def adjust_element_mean(element_img, target_mean_value):
     """
@@ -56,16 +37,16 @@ def adjust_element_mean(element_img, target_mean_value):
     Returns:
         adjusted element_img
     """
-    # Convert to float for calculations
-    element = element_img.astype(float)
+    # Convert to float32 for calculations
+    element = element_img.astype(WORKING_DTYPE)
     current = np.mean(element)
     
     # Calculate the difference and adjust all pixels accordingly
-    diff = target_mean_value - current
-    element = element + diff
+    diff = WORKING_DTYPE(target_mean_value) - current
+    element += diff
     
     # Ensure values are within valid range (0-255)
-    element = np.clip(element, 0, 255)
+    np.clip(element, 0, 255, out=element)
     
     return element
 
@@ -80,7 +61,7 @@ def create_mosaic(element_img, big_img):
     Returns:
         tuple: (mosaic, simple_mosaic)
             - mosaic: the final mosaic with adjusted element images
-            - simple_mosaic: mosaic without dynamic adjustment
+            - simple_mosaic: mosaic without dynamic adjustment (TiledImage view)
     """
     # Handle RGB vs grayscale
     if len(element_img.shape) == 3 and len(big_img.shape) == 3:
@@ -88,33 +69,42 @@ def create_mosaic(element_img, big_img):
         N, M, C = element_img.shape
         H, W, _ = big_img.shape
         
-        # Generate a simple mosaic
+        # Generate a simple mosaic (a zero-copy view of the element)
         simple_mosaic = create_image_matrix(element_img, (H, W))
-        mosaic = simple_mosaic.copy()
+        mosaic = np.empty((H*N, W*M, C), dtype=element_img.dtype)
         
-        # Adjust each element block to match the target image's colors
+        # View the mosaic as (H, N, W, M, C) so a whole row of blocks is written at once
+        mosaic_blocks = mosaic.reshape(H, N, W, M, C)
+        element = element_img.astype(WORKING_DTYPE)
+        channel_means = element.reshape(-1, C).mean(axis=0)
+        
+        # Adjust each element block to match the target image's colors, one row band at a time
         for i in range(H):
-            for j in range(W):
-                # For each RGB channel
-                for c in range(C):
-                    # Adjust the mean of the element_img to match the target pixel
-                    element = adjust_element_mean(element_img[:,:,c], big_img[i, j, c])
-                    mosaic[i*N:(i+1)*N, j*M:(j+1)*M, c] = element
+            # Per-block, per-channel difference between the target pixel and the element mean
+            diff = big_img[i].astype(WORKING_DTYPE) - channel_means
+            band = element[:, None, :, :] + diff[None, :, None, :]
+            np.clip(band, 0, 255, out=band)
+            mosaic_blocks[i] = band
     else:
         # Grayscale image
         N, M = element_img.shape
         H, W = big_img.shape
         
-        # Generate a simple mosaic
+        # Generate a simple mosaic (a zero-copy view of the element)
         simple_mosaic = create_image_matrix(element_img, (H, W))
-        mosaic = simple_mosaic.copy()
+        mosaic = np.empty((H*N, W*M), dtype=element_img.dtype)
+        
+        # View the mosaic as (H, N, W, M) so a whole row of blocks is written at once
+        mosaic_blocks = mosaic.reshape(H, N, W, M)
+        element = element_img.astype(WORKING_DTYPE)
+        element_mean = element.mean()
         
-        # Adjust each element block to match the target image's intensity
+        # Adjust each element block to match the target image's intensity, one row band at a time
         for i in range(H):
-            for j in range(W):
-                # Adjust the mean of the element_img to match the target pixel
-                element = adjust_element_mean(element_img, big_img[i, j])
-                mosaic[i*N:(i+1)*N, j*M:(j+1)*M] = element
+            diff = big_img[i].astype(WORKING_DTYPE) - element_mean
+            band = element[:, None, :] + diff[None, :, None]
+            np.clip(band, 0, 255, out=band)
+            mosaic_blocks[i] = band
     
     return mosaic, simple_mosaic
 
@@ -124,7 +114,7 @@ def normalize_image(img):
     """
     # Handle multi-channel images
     if len(img.shape) > 2:
-        normalized = np.zeros_like(img, dtype=float)
+        normalized = np.zeros_like(img, dtype=WORKING_DTYPE)
         for c in range(img.shape[2]):
             channel = img[:,:,c]
             channel = channel - np.min(channel)
@@ -134,7 +124,57 @@ def normalize_image(img):
         return normalized
     else:
         # Single channel
-        img = img - np.min(img)
+        img = img.astype(WORKING_DTYPE) - np.min(img)
         if np.max(img) > 0:
-            img = img / np.max(img)
-        return img
\ No newline at end of file
+            img /= np.max(img)
+        return img
+
+def _normalization_lut(channel_min, channel_max):
+    """
+    Build the 256-entry table mapping a uint8 channel onto the full 0-255 range.
+    
+    Uses exactly the arithmetic of (normalize_image(img) * 255).astype(np.uint8)
+    in float64, so the table output matches the original pipeline bit for bit.
+    """
+    values = np.arange(256, dtype=np.float64) - channel_min
+    span = channel_max - channel_min
+    if span > 0:
+        values = values / span
+    return (np.clip(values, 0, None) * 255).astype(np.uint8)
+
+def normalize_image_to_uint8(img, inplace=False):
+    """
+    Normalize each channel of an image to the full 0-255 range as uint8.
+    
+    Equivalent to (normalize_image(img) * 255).astype(np.uint8). uint8 input is
+    remapped through a per-channel lookup table, in place when requested, so no
+    float copy of the image is ever allocated.
+    
+    Args:
+        img: 2D grayscale image or RGB image (numpy array or TiledImage)
+        inplace: overwrite img with the result (uint8 input only)
+    
+    Returns:
+        numpy array: uint8 normalized image (TiledImage for TiledImage input)
+    """
+    # A tiling has the same per-channel range as its tile, so only the tile is normalized
+    if isinstance(img, TiledImage):
+        return img.map_tile(normalize_image_to_uint8)
+    
+    if img.dtype != np.uint8:
+        normalized = normalize_image(img)
+        normalized *= 255
+        return normalized.astype(np.uint8)
+    
+    dst = img if inplace else None
+    if len(img.shape) > 2:
+        # Reduce each strided channel view separately; axis reductions over the
+        # interleaved layout are an order of magnitude slower
+        lut = np.stack([
+            _normalization_lut(img[:, :, c].min(), img[:, :, c].max())
+            for c in range(img.shape[2])
+        ], axis=-1)
+        return cv2.LUT(img, lut.reshape(256, 1, img.shape[2]), dst=dst)
+    
+    lut = _normalization_lut(img.min(), img.max())
+    return cv2.LUT(img, lut, dst=dst)
\ No newline at end of file
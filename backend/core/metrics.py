@@ -2,7 +2,7 @@
 Quality assessment metrics for mosaic images.
 """
 import numpy as np
-import cv2
+from utils.resampling import resize
 from PIL import Image
 from skimage.metrics import structural_similarity as ssim
 
@@ -21,10 +21,7 @@ def calculate_mse(img1, img2):
     if img1.shape != img2.shape:
         # Resize second image to match first
         if isinstance(img2, np.ndarray):
-            if len(img2.shape) == 3:
-                img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
-            else:
-                img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
+            img2 = resize(img2, (img1.shape[1], img1.shape[0]), 'metric')
     
     # Calculate MSE
     mse = np.mean((img1 - img2) ** 2)
@@ -46,10 +43,7 @@ def calculate_ssim(img1, img2, multichannel=True):
     if img1.shape != img2.shape:
         # Resize second image to match first
         if isinstance(img2, np.ndarray):
-            if len(img2.shape) > 2:
-                img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
-            else:
-                img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
+            img2 = resize(img2, (img1.shape[1], img1.shape[0]), 'metric')
     
     # Get the minimum dimension of the image
     min_dim = min(img1.shape[0], img1.shape[1])
@@ -87,10 +81,7 @@ def calculate_psnr(img1, img2):
     if img1.shape != img2.shape:
         # Resize second image to match first
         if isinstance(img2, np.ndarray):
-            if len(img2.shape) == 3:
-                img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
-            else:
-                img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
+            img2 = resize(img2, (img1.shape[1], img1.shape[0]), 'metric')
     
     # Calculate MSE
     mse = calculate_mse(img1, img2)
@@ -116,10 +107,7 @@ def evaluate_mosaic_quality(original_img, mosaic_img):
     # Ensure images have same dimensions
     if original_img.shape != mosaic_img.shape:
         # Resize mosaic to match original
-        if len(original_img.shape) == 3:
-            mosaic_img = cv2.resize(mosaic_img, (original_img.shape[1], original_img.shape[0]))
-        else:
-            mosaic_img = cv2.resize(mosaic_img, (original_img.shape[1], original_img.shape[0]))
+        mosaic_img = resize(mosaic_img, (original_img.shape[1], original_img.shape[0]), 'metric')
     
     # Convert to 8-bit if needed
     if original_img.dtype != np.uint8:
@@ -3,8 +3,9 @@ Core mosaic generation logic.
 """
 import numpy as np
 from PIL import Image
-from utils.image_utils import get_average_color, normalize_image
-from core.color_analysis import build_element_library, find_best_matching_block, adjust_block_colors
+from utils.image_utils import get_block_average_colors, get_block_histograms, rgb_to_lab, normalize_image
+from utils.tiled_image import TiledImage
+from core.color_analysis import build_sliding_window_library, match_average_colors, match_lab_colors, match_histograms, match_cascade, assemble_mosaic
 
 def create_image_matrix(element_img, matrix_size, block_size):
     """
@@ -16,36 +17,114 @@ def create_image_matrix(element_img, matrix_size, block_size):
         block_size: size of each block in pixels
         
     Returns:
-        mosaic: numpy array representing the mosaic image
+        TiledImage: read-only view repeating one element block; np.asarray() materialises it
     """
     # Create a single element block of the desired size
     if len(element_img.shape) == 3:  # RGB
         h, w, c = element_img.shape
         element_block = element_img[:block_size, :block_size, :] if (h >= block_size and w >= block_size) else np.resize(element_img, (block_size, block_size, c))
-        # Initialize mosaic array
-        H, W = matrix_size
-        mosaic = np.zeros((H * block_size, W * block_size, c), dtype=element_img.dtype)
     else:  # Grayscale
         h, w = element_img.shape
         element_block = element_img[:block_size, :block_size] if (h >= block_size and w >= block_size) else np.resize(element_img, (block_size, block_size))
-        # Initialize mosaic array
-        H, W = matrix_size
-        mosaic = np.zeros((H * block_size, W * block_size), dtype=element_img.dtype)
-    
-    # Create the mosaic by tiling the element block
-    for i in range(H):
-        for j in range(W):
-            h_start = i * block_size
-            h_end = (i + 1) * block_size
-            w_start = j * block_size
-            w_end = (j + 1) * block_size
-            
-            mosaic[h_start:h_end, w_start:w_end] = element_block
     
-    return mosaic
+    # Tile the block without copying it
+    return TiledImage(element_block, matrix_size)
+
+def get_element_library(element_img, block_size, color_method='average_rgb'):
+    """
+    Build the element library with the configured extraction settings.
+    
+    Args:
+        element_img: RGB or grayscale image (numpy array) - the building block
+        block_size: size of each block in pixels
+        color_method: method for color matching
+        
+    Returns:
+        ElementLibrary: overlapping, rescaled and mirrored element tiles
+    """
+    from config import LIBRARY_STRIDE, LIBRARY_SCALES, LIBRARY_FLIPS
+    return build_sliding_window_library(
+        element_img,
+        block_size,
+        method=color_method,
+        stride=LIBRARY_STRIDE,
+        scales=LIBRARY_SCALES,
+        flips=LIBRARY_FLIPS
+    )
 
-def create_mosaic(element_img, target_img, block_size, color_method='average_rgb', adjust_colors=True, alpha=0.7, job_id=None, job_states=None):
-    """Return to the original, reliable implementation"""
+def get_target_features(target_img, block_size, color_method='average_rgb'):
+    """
+    Extract the per-block target features a colour method matches on.
+    
+    Args:
+        target_img: RGB or grayscale image (numpy array) - the target image
+        block_size: size of each block in pixels
+        color_method: method for color matching
+        
+    Returns:
+        dict: 'means' (n_h, n_w, 3) block average colours and, for the
+              histogram-based methods, 'histograms' (n_h * n_w, d)
+    """
+    # Average colour of every target block in one pass
+    features = {'means': get_block_average_colors(target_img, block_size)}
+    if color_method in ('histogram', 'cascade'):
+        n_blocks_h, n_blocks_w = features['means'].shape[:2]
+        features['histograms'] = get_block_histograms(target_img, block_size).reshape(n_blocks_h * n_blocks_w, -1)
+    return features
+
+def match_target_features(features, element_library, color_method='average_rgb'):
+    """
+    Match every target block to a library index.
+    
+    Args:
+        features: target features from get_target_features
+        element_library: ElementLibrary to match against
+        color_method: method for color matching
+        
+    Returns:
+        numpy array: (n_h, n_w) library indices
+    """
+    target_means = features['means']
+    n_blocks_h, n_blocks_w = target_means.shape[:2]
+    
+    if color_method == 'histogram':
+        # All target histograms are matched in one batched search
+        match_indices = match_histograms(features['histograms'], element_library)
+    elif color_method == 'cascade':
+        # Average-colour prefilter, then histogram rerank of the candidates
+        match_indices = match_cascade(
+            target_means.reshape(n_blocks_h * n_blocks_w, 3),
+            features['histograms'],
+            element_library
+        )
+    elif color_method == 'lab':
+        # Convert the whole (n_h, n_w, 3) grid of block means to Lab in one call
+        target_lab = rgb_to_lab(target_means)
+        match_indices = match_lab_colors(target_lab.reshape(n_blocks_h * n_blocks_w, 3), element_library)
+    else:
+        # Nearest average colour, through the library's lookup table when it pays off
+        match_indices = match_average_colors(target_means.reshape(n_blocks_h * n_blocks_w, 3), element_library)
+    
+    return match_indices.reshape(n_blocks_h, n_blocks_w)
+
+def create_mosaic(element_img, target_img, block_size, color_method='average_rgb', adjust_colors=True, alpha=0.7, job_id=None, job_states=None, library=None):
+    """
+    Generate a mosaic by matching each target block against a library of tiles.
+    
+    Args:
+        element_img: RGB or grayscale image (numpy array) - the building block
+        target_img: RGB or grayscale image (numpy array) - the target image
+        block_size: size of each block in pixels
+        color_method: method for color matching ('average_rgb', 'histogram', 'cascade' or 'lab')
+        adjust_colors: whether to adjust block colors to better match target
+        alpha: blending factor for color adjustment
+        job_id: unique identifier for the job, for tracking progress
+        job_states: dictionary to store job states, for tracking progress
+        library: prebuilt ElementLibrary (e.g. a tile set); built from element_img if None
+        
+    Returns:
+        tuple: (mosaic, simple_mosaic)
+    """
     # Get dimensions
     if len(target_img.shape) == 3:  # RGB
         target_h, target_w, _ = target_img.shape
@@ -56,55 +135,28 @@ def create_mosaic(element_img, target_img, block_size, color_method='average_rgb
     n_blocks_h = target_h // block_size
     n_blocks_w = target_w // block_size
     
-    # Build element library
-    element_library = build_element_library(element_img, block_size, method=color_method)
+    # Build a rich element library unless one was given
+    element_library = library if library is not None else get_element_library(element_img, block_size, color_method)
     
     # Create a simple mosaic for comparison
     simple_mosaic = create_image_matrix(element_img, (n_blocks_h, n_blocks_w), block_size)
     
-    # Initialize the final mosaic
-    if len(target_img.shape) == 3:  # RGB
-        mosaic = np.zeros((n_blocks_h * block_size, n_blocks_w * block_size, 3), dtype=np.uint8)
-    else:  # Grayscale
-        mosaic = np.zeros((n_blocks_h * block_size, n_blocks_w * block_size), dtype=np.uint8)
-    
-    # Build mosaic by finding best matching blocks
-    for i in range(n_blocks_h):
-        for j in range(n_blocks_w):
-            # Update progress if tracking
-            if job_id is not None and job_states is not None and (i * n_blocks_w + j) % max(1, (n_blocks_h * n_blocks_w // 20)) == 0:
-                progress = 30 + ((i * n_blocks_w + j) / (n_blocks_h * n_blocks_w)) * 60
-                job_states[job_id]['progress'] = progress
-            
-            # Extract target block
-            h_start = i * block_size
-            h_end = min((i + 1) * block_size, target_h)
-            w_start = j * block_size
-            w_end = min((j + 1) * block_size, target_w)
-            
-            target_block = target_img[h_start:h_end, w_start:w_end]
-            
-            # Calculate color feature
-            if color_method == 'average_rgb':
-                from utils.image_utils import get_average_color
-                color_feature = get_average_color(target_block)
-            else:
-                from utils.image_utils import get_color_histogram
-                color_feature = get_color_histogram(target_block)
-            
-            # Find best matching block
-            best_match = find_best_matching_block(color_feature, element_library, method=color_method)
-            
-            # Get matched block
-            matched_block = best_match['block'].copy()
-            
-            # Adjust colors if requested
-            if adjust_colors:
-                from core.color_analysis import adjust_block_colors
-                matched_block = adjust_block_colors(matched_block, color_feature, alpha)
-            
-            # Place in mosaic
-            mosaic[h_start:h_end, w_start:w_end] = matched_block[:h_end-h_start, :w_end-w_start]
+    # Match every target block to a library index
+    features = get_target_features(target_img, block_size, color_method)
+    match_indices = match_target_features(features, element_library, color_method)
+    target_means = features['means']
+    
+    if job_id is not None and job_states is not None:
+        job_states[job_id]['progress'] = 90
+    
+    # Assemble the mosaic in one batched gather, colour offset and clip
+    mosaic = assemble_mosaic(
+        element_library.blocks,
+        element_library.means,
+        match_indices,
+        target_means,
+        alpha=alpha if adjust_colors else 0
+    )
     
     # Return both mosaics
     return mosaic, simple_mosaic
@@ -117,7 +169,7 @@ def create_multiresolution_mosaic(element_img, target_img, block_sizes, color_me
         element_img: RGB or grayscale image (numpy array) - the building block
         target_img: RGB or grayscale image (numpy array) - the target image
         block_sizes: list of block sizes to use
-        color_method: method for color matching ('average_rgb' or 'histogram')
+        color_method: method for color matching ('average_rgb', 'histogram', 'cascade' or 'lab')
         adjust_colors: whether to adjust block colors to better match target
         job_id: unique identifier for the job, for tracking progress
         job_states: dictionary to store job states, for tracking progress
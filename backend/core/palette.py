@@ -0,0 +1,193 @@
+"""
+Dominant colour palette extraction with a weighted mini-batch k-means.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from config import (
+    PALETTE_HISTOGRAM_BITS, PALETTE_BATCH_SIZE, PALETTE_ITERATIONS,
+    PALETTE_SEED, PALETTE_CACHE_SIZE, PALETTE_SAMPLE_SIZE
+)
+from utils.server_metrics import record_cache_hit, record_cache_miss
+
+# Palettes keyed by (image hash, n_colors), least recently used first
+_palette_cache = OrderedDict()
+_palette_lock = threading.Lock()
+
+def get_weighted_colors(image, bits=PALETTE_HISTOGRAM_BITS):
+    """
+    Reduce an image to a weighted colour histogram.
+
+    Pixels are binned by their top `bits` bits per channel; each occupied bin
+    is represented by the mean colour of its pixels and weighted by its count.
+
+    Args:
+        image: (H, W, 3) RGB or (H, W) grayscale uint8 image
+        bits: bits per channel of the histogram
+
+    Returns:
+        tuple: ((M, 3) float32 bin colours, (M,) float64 pixel counts)
+    """
+    pixels = image.reshape(-1, 3) if image.ndim == 3 else np.repeat(image.reshape(-1, 1), 3, axis=1)
+    pixels = pixels[:, :3]
+
+    shift = 8 - bits
+    quantized = (pixels >> shift).astype(np.int64)
+    bin_index = (quantized[:, 0] << (2 * bits)) | (quantized[:, 1] << bits) | quantized[:, 2]
+
+    n_bins = 1 << (3 * bits)
+    counts = np.bincount(bin_index, minlength=n_bins)
+    occupied = np.nonzero(counts)[0]
+
+    colors = np.empty((len(occupied), 3), dtype=np.float32)
+    for c in range(3):
+        sums = np.bincount(bin_index, weights=pixels[:, c], minlength=n_bins)
+        colors[:, c] = sums[occupied] / counts[occupied]
+
+    return colors, counts[occupied].astype(np.float64)
+
+def minibatch_kmeans(points, weights, n_clusters, batch_size=PALETTE_BATCH_SIZE, iterations=PALETTE_ITERATIONS, seed=PALETTE_SEED):
+    """
+    Weighted mini-batch k-means with k-means++ seeding and a fixed random seed.
+
+    Args:
+        points: (M, d) points
+        weights: (M,) point weights
+        n_clusters: number of clusters
+        batch_size: points sampled (proportionally to weight) per iteration
+        iterations: number of mini-batch updates
+        seed: random seed, so the same input always yields the same clusters
+
+    Returns:
+        tuple: ((k, d) float32 centres, (k,) total weight per centre), k <= n_clusters
+    """
+    rng = np.random.default_rng(seed)
+    points = np.asarray(points, dtype=np.float32)
+    probabilities = weights / weights.sum()
+    n_clusters = min(n_clusters, len(points))
+
+    # k-means++ seeding on the weighted points
+    centres = [points[rng.choice(len(points), p=probabilities)]]
+    closest = ((points - centres[0]) ** 2).sum(axis=1)
+    for _ in range(1, n_clusters):
+        scores = closest * weights
+        if scores.sum() <= 0:
+            break
+        centre = points[rng.choice(len(points), p=scores / scores.sum())]
+        centres.append(centre)
+        np.minimum(closest, ((points - centre) ** 2).sum(axis=1), out=closest)
+    centres = np.array(centres, dtype=np.float32)
+
+    # Mini-batch updates with per-centre learning rates
+    seen = np.zeros(len(centres))
+    for _ in range(iterations):
+        batch = points[rng.choice(len(points), size=batch_size, p=probabilities)]
+        labels = np.argmin(((batch[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2), axis=1)
+        for cluster in np.unique(labels):
+            members = batch[labels == cluster]
+            seen[cluster] += len(members)
+            rate = len(members) / seen[cluster]
+            centres[cluster] += rate * (members.mean(axis=0) - centres[cluster])
+
+    # Final weighted assignment of every point
+    labels = np.argmin(((points[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2), axis=1)
+    cluster_weights = np.bincount(labels, weights=weights, minlength=len(centres))
+    return centres, cluster_weights
+
+def extract_palette(image, n_colors=8):
+    """
+    Extract the dominant colours of an image.
+
+    Args:
+        image: (H, W, 3) RGB or (H, W) grayscale uint8 image
+        n_colors: number of colours to extract
+
+    Returns:
+        list: dictionaries with 'color' (R, G, B) and 'weight' (fraction of
+              pixels), most frequent first
+    """
+    colors, counts = get_weighted_colors(np.asarray(image, dtype=np.uint8))
+    centres, cluster_weights = minibatch_kmeans(colors, counts, n_colors)
+
+    order = np.argsort(-cluster_weights, kind='stable')
+    total = cluster_weights.sum()
+    palette = []
+    for index in order:
+        if cluster_weights[index] <= 0:
+            continue
+        palette.append({
+            'color': tuple(int(v) for v in np.clip(np.round(centres[index]), 0, 255)),
+            'weight': float(cluster_weights[index] / total)
+        })
+    return palette
+
+def get_cached_palette(image_hash, n_colors, compute):
+    """
+    Get a palette from the cache, computing and storing it on a miss.
+
+    Args:
+        image_hash: hash identifying the image content
+        n_colors: number of colours
+        compute: function returning the palette on a cache miss
+
+    Returns:
+        list: palette as returned by extract_palette
+    """
+    key = (image_hash, n_colors)
+    with _palette_lock:
+        palette = _palette_cache.get(key)
+        if palette is not None:
+            _palette_cache.move_to_end(key)
+    if palette is not None:
+        record_cache_hit('palette')
+        return palette
+
+    record_cache_miss('palette')
+    palette = compute()
+    with _palette_lock:
+        _palette_cache[key] = palette
+        while len(_palette_cache) > PALETTE_CACHE_SIZE:
+            _palette_cache.popitem(last=False)
+    return palette
+
+def get_image_palette(data, n_colors=8):
+    """
+    Get the palette of an encoded image, cached by the hash of its bytes.
+
+    A cache hit skips decoding entirely. On a miss the image is decoded
+    straight to a reduced size (JPEG draft mode, then a box downscale), since
+    the dominant colours do not need every pixel.
+
+    Args:
+        data: encoded image bytes
+        n_colors: number of colours to extract
+
+    Returns:
+        list: palette as returned by extract_palette
+    """
+    def compute():
+        img = Image.open(io.BytesIO(data))
+        img.draft('RGB', (PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE))
+        img = img.convert('RGB')
+        img.thumbnail((PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE), Image.BOX)
+        return extract_palette(np.asarray(img), n_colors)
+
+    return get_cached_palette(hashlib.sha1(data).hexdigest(), n_colors, compute)
+
+def hash_image(image):
+    """
+    Hash an image array's pixels and shape.
+
+    Args:
+        image: numpy array
+
+    Returns:
+        str: SHA-1 hex digest
+    """
+    image = np.ascontiguousarray(image)
+    digest = hashlib.sha1(str((image.shape, image.dtype.str)).encode())
+    digest.update(image.data)
+    return digest.hexdigest()
@@ -0,0 +1,177 @@
+"""
+Per-job cache of generation stage outputs for incremental regeneration.
+"""
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+from config import STAGE_CACHE_JOBS, STAGE_CACHE_BYTES
+from utils.server_metrics import record_cache_hit, record_cache_miss
+
+# Stage graphs keyed by job ID, least recently used first
+_stage_graphs = OrderedDict()
+_graphs_lock = threading.Lock()
+
+def file_fingerprint(path):
+    """
+    Identify a file's content by path, size and modification time.
+
+    Intermediate files keep their names when a job is re-uploaded or
+    re-preprocessed, so the path alone is not enough.
+
+    Args:
+        path: file path
+
+    Returns:
+        tuple: (path, size, mtime_ns)
+    """
+    stat = os.stat(path)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+def get_output_bytes(output, depth=0):
+    """
+    Approximate the memory held by a stage output.
+
+    Arrays, element libraries (with their caches) and tiled images report
+    their own nbytes; images are counted by their pixel data and containers
+    by what they hold.
+
+    Args:
+        output: stage output
+        depth: nesting level, bounding the recursion into containers
+
+    Returns:
+        int: approximate size in bytes
+    """
+    if isinstance(output, Image.Image):
+        return output.width * output.height * len(output.getbands())
+    nbytes = getattr(output, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes)
+    if depth >= 3:
+        return 0
+    if isinstance(output, (list, tuple)):
+        return sum(get_output_bytes(item, depth + 1) for item in output)
+    if isinstance(output, dict):
+        return sum(get_output_bytes(item, depth + 1) for item in output.values())
+    return 0
+
+class StageGraph:
+    """
+    Outputs of a job's generation stages, each keyed by its own parameters
+    and the keys of the stages it depends on.
+
+    A stage whose key is unchanged returns its stored output; otherwise it is
+    recomputed, which changes its key and so invalidates everything
+    downstream of it. Only the latest output of each stage is kept.
+
+    Hold pass_lock around a whole generation pass: the ran/reused log and
+    the stage outputs belong to one pass at a time.
+
+    Attributes:
+        ran: stages computed since the last reset_log()
+        reused: stages served from the graph since the last reset_log()
+        pass_lock: lock serialising generation passes over this graph
+    """
+
+    def __init__(self):
+        self._stages = {}  # name -> (key, output, bytes)
+        self._lock = threading.Lock()
+        self.pass_lock = threading.Lock()
+        self.ran = []
+        self.reused = []
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the stage outputs"""
+        with self._lock:
+            return sum(entry[2] for entry in self._stages.values())
+
+    def key(self, name):
+        """Current key of a stage, or None if it has never run"""
+        entry = self._stages.get(name)
+        return entry[0] if entry is not None else None
+
+    def run(self, name, params, compute, depends=()):
+        """
+        Get a stage's output, computing it only if its inputs changed.
+
+        Args:
+            name: stage name
+            params: hashable parameters the stage output depends on
+            compute: function returning the stage output
+            depends: names of upstream stages (already run in this pass)
+
+        Returns:
+            stage output
+        """
+        key = (params, tuple(self.key(dependency) for dependency in depends))
+        with self._lock:
+            entry = self._stages.get(name)
+        if entry is not None and entry[0] == key:
+            record_cache_hit('stage')
+            self.reused.append(name)
+            return entry[1]
+
+        record_cache_miss('stage')
+        output = compute()
+        with self._lock:
+            self._stages[name] = (key, output, get_output_bytes(output))
+        self.ran.append(name)
+        return output
+
+    def invalidate(self, name):
+        """
+        Drop a stage's output so it runs again, e.g. when its file was deleted.
+
+        Args:
+            name: stage name
+        """
+        with self._lock:
+            self._stages.pop(name, None)
+
+    def reset_log(self):
+        """Clear the ran/reused lists before a new pass"""
+        self.ran = []
+        self.reused = []
+
+def _trim_stage_graphs(keep=None):
+    """Drop least recently used graphs beyond STAGE_CACHE_JOBS or STAGE_CACHE_BYTES, sparing keep (call with _graphs_lock held)"""
+    total = sum(graph.nbytes for graph in _stage_graphs.values())
+    for job_id in list(_stage_graphs):
+        if len(_stage_graphs) <= STAGE_CACHE_JOBS and total <= STAGE_CACHE_BYTES:
+            break
+        graph = _stage_graphs[job_id]
+        # A graph about to run or in the middle of a pass is still in use
+        if job_id == keep or graph.pass_lock.locked():
+            continue
+        total -= graph.nbytes
+        del _stage_graphs[job_id]
+
+def get_stage_graph(job_id):
+    """
+    Get the stage graph of a job, creating it if needed.
+
+    At most STAGE_CACHE_JOBS graphs holding at most STAGE_CACHE_BYTES of
+    stage outputs are kept; the least recently used ones are dropped first.
+
+    Args:
+        job_id: job ID
+
+    Returns:
+        StageGraph: the job's graph
+    """
+    with _graphs_lock:
+        graph = _stage_graphs.get(job_id)
+        if graph is None:
+            graph = _stage_graphs[job_id] = StageGraph()
+        _stage_graphs.move_to_end(job_id)
+        _trim_stage_graphs(keep=job_id)
+    return graph
+
+def trim_stage_graphs():
+    """
+    Enforce STAGE_CACHE_BYTES after a pass has added stage outputs.
+    """
+    with _graphs_lock:
+        _trim_stage_graphs()
@@ -0,0 +1,247 @@
+"""
+Memoised generation results, keyed by input pixels and generation parameters.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from config import RESULT_CACHE_SIZE, OUTPUT_RETENTION_SECONDS
+from utils.file_utils import get_file_path
+from utils.encoders import get_output_filename, remove_variants
+from utils.output_writer import is_pending, wait_for_write
+from utils.server_metrics import record_cache_hit, record_cache_miss
+
+# Output filenames of memoised results: SHA-1 result key and output name
+_RESULT_FILENAME = re.compile(r'^[0-9a-f]{40}_(mosaic|simple_mosaic)\.\w+$')
+
+# Results keyed by result key, least recently used first
+_results = OrderedDict()
+_results_lock = threading.Lock()
+
+# Output filenames each job serves or is about to serve, keyed by job ID
+_job_outputs = {}
+
+def get_result_key(element_hash, target_hash, block_size, color_mode, color_method, engine, alpha, tileset_id=None):
+    """
+    Hash everything a generated mosaic depends on.
+
+    Args:
+        element_hash: pixel hash of the element image
+        target_hash: pixel hash of the (budgeted) target image
+        block_size: block size
+        color_mode: 'rgb' or 'grayscale'
+        color_method: colour matching method
+        engine: mosaic engine
+        alpha: colour adjustment alpha
+        tileset_id: tile set used instead of the element, if any
+
+    Returns:
+        str: SHA-1 hex digest, also used to name the output files
+    """
+    params = [element_hash, target_hash, block_size, color_mode, color_method, engine, alpha, tileset_id]
+    return hashlib.sha1(json.dumps(params).encode()).hexdigest()
+
+def get_simple_result_key(element_hash, target_shape, block_size, color_mode, engine):
+    """
+    Hash everything the simple (unadjusted) mosaic depends on.
+
+    The simple mosaic repeats the element over the target's block grid, so
+    unlike get_result_key this leaves out the target pixels, the colour
+    method, alpha and the tile set: changing those reuses the same file.
+
+    Args:
+        element_hash: pixel hash of the element image
+        target_shape: shape of the (budgeted) target image
+        block_size: block size
+        color_mode: 'rgb' or 'grayscale'
+        engine: mosaic engine
+
+    Returns:
+        str: SHA-1 hex digest, also used to name the output file
+    """
+    params = [element_hash, list(target_shape), block_size, color_mode, engine, 'simple']
+    return hashlib.sha1(json.dumps(params).encode()).hexdigest()
+
+def get_result_filename(result_key, output):
+    """
+    Output filename of a memoised result.
+
+    Names derive from the result key, so a file's content never changes
+    while it exists.
+
+    Args:
+        result_key: key from get_result_key (or get_simple_result_key for 'simple_mosaic')
+        output: output name ('mosaic' or 'simple_mosaic')
+
+    Returns:
+        str: filename in the output folder
+    """
+    return get_output_filename(f"{result_key}_{output}", 'final')
+
+def is_result_filename(filename):
+    """
+    Check whether a filename belongs to a memoised result.
+
+    Such files are named after their result key, so their content never
+    changes and they can be cached indefinitely, even once regenerated
+    after eviction.
+
+    Args:
+        filename: name of a file in the output folder
+
+    Returns:
+        bool: True for memoised result outputs
+    """
+    return _RESULT_FILENAME.match(filename) is not None
+
+def _output_exists(filename):
+    """Whether an output file exists or is still being written"""
+    path = get_file_path(filename, 'output')
+    return is_pending(path) or os.path.exists(path)
+
+def _unreferenced(filenames):
+    """Filenames no memoised result and no job uses (call with _results_lock held)"""
+    used = set()
+    for outputs in _job_outputs.values():
+        used.update(outputs)
+    for entry in _results.values():
+        used.update(entry['outputs'].values())
+    return [filename for filename in filenames if filename not in used]
+
+def _remove_outputs(filenames):
+    """Delete output files that are still unreferenced once their pending writes finish"""
+    for filename in filenames:
+        # A write still in flight would recreate the file after its removal
+        wait_for_write(get_file_path(filename, 'output'))
+    with _results_lock:
+        # Re-checked under the lock, so a job retaining a file meanwhile keeps it
+        for filename in _unreferenced(filenames):
+            try:
+                os.remove(get_file_path(filename, 'output'))
+            except FileNotFoundError:
+                pass
+            remove_variants(filename, 'output')
+
+def retain_outputs(job_id, filenames):
+    """
+    Protect output files a job is about to serve from deletion.
+
+    Args:
+        job_id: job ID
+        filenames: filenames in the output folder
+    """
+    with _results_lock:
+        _job_outputs.setdefault(job_id, set()).update(filenames)
+
+def release_outputs(job_id, keep=()):
+    """
+    Release the output files a job no longer serves, deleting those nothing else uses.
+
+    Args:
+        job_id: job ID
+        keep: filenames the job still serves
+    """
+    keep = set(keep)
+    with _results_lock:
+        released = _job_outputs.get(job_id, set()) - keep
+        _job_outputs[job_id] = keep
+        orphans = _unreferenced(released)
+    _remove_outputs(orphans)
+
+def enforce_retention(now=None):
+    """
+    Evict results unused for OUTPUT_RETENTION_SECONDS, then the least recently
+    used ones beyond RESULT_CACHE_SIZE, deleting their output files.
+
+    Files still served by a job (see retain_outputs) or shared with another
+    memoised result are kept; they are deleted once the last of those lets
+    go of them.
+
+    Args:
+        now: current time (defaults to time.time())
+
+    Returns:
+        int: number of evicted results
+    """
+    now = time.time() if now is None else now
+    evicted = []
+    with _results_lock:
+        for key in list(_results):
+            if now - _results[key]['last_used'] > OUTPUT_RETENTION_SECONDS:
+                evicted.append(_results.pop(key))
+        while len(_results) > RESULT_CACHE_SIZE:
+            evicted.append(_results.popitem(last=False)[1])
+        orphans = _unreferenced({filename for entry in evicted for filename in entry['outputs'].values()})
+
+    _remove_outputs(orphans)
+    return len(evicted)
+
+def lookup_result(result_key, job_id=None):
+    """
+    Get a memoised result whose output files still exist.
+
+    Args:
+        result_key: key from get_result_key
+        job_id: job that will serve the outputs; they are retained for it on a hit
+
+    Returns:
+        dict: 'outputs' (name -> filename), 'metrics' and 'details', or None on a miss
+    """
+    enforce_retention()
+    with _results_lock:
+        entry = _results.get(result_key)
+        if entry is not None and not all(_output_exists(filename) for filename in entry['outputs'].values()):
+            # Output files were removed behind the cache's back
+            del _results[result_key]
+            entry = None
+        if entry is not None:
+            entry['last_used'] = time.time()
+            _results.move_to_end(result_key)
+            if job_id is not None:
+                _job_outputs.setdefault(job_id, set()).update(entry['outputs'].values())
+
+    if entry is None:
+        record_cache_miss('result')
+        return None
+    record_cache_hit('result')
+    return entry
+
+def store_result(result_key, outputs, metrics, details=None):
+    """
+    Memoise a generated result whose output files have been written or queued for writing.
+
+    Args:
+        result_key: key from get_result_key
+        outputs: output name -> filename in the output folder
+        metrics: quality metrics of the mosaic
+        details: extra job state to restore on a hit (e.g. quadtree statistics)
+
+    Returns:
+        dict: the stored entry
+    """
+    now = time.time()
+    entry = {
+        'outputs': dict(outputs),
+        'metrics': metrics,
+        'details': details or {},
+        'created': now,
+        'last_used': now
+    }
+    with _results_lock:
+        _results[result_key] = entry
+        _results.move_to_end(result_key)
+    enforce_retention(now)
+    return entry
+
+def discard_result(result_key):
+    """
+    Drop a memoised result, e.g. because one of its output files failed to write.
+
+    Args:
+        result_key: key from get_result_key
+    """
+    with _results_lock:
+        _results.pop(result_key, None)
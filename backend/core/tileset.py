@@ -0,0 +1,318 @@
+"""
+Multi-tile libraries built from uploaded tile sets and persisted as memory-mapped arrays.
+"""
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from PIL import Image, ImageOps
+from config import (
+    TILESET_FOLDER, ALLOWED_EXTENSIONS, MAX_TILESET_TILES,
+    MAX_TILE_FILE_SIZE, MAX_TILESET_UNCOMPRESSED_BYTES, MAX_TILE_PIXELS,
+    UPLOAD_CHUNK_SIZE, TILESET_DECODE_WORKERS, TILESET_CACHE_SIZE, TILESET_CACHE_BYTES,
+    AVERAGE_RGB_MATCHER,
+    COLOR_LUT_BITS, COLOR_LUT_CANDIDATES
+)
+from core.element_library import ElementLibrary
+from core.color_lut import ColorLookupTable
+from core.color_analysis import get_color_lut
+from utils.image_utils import get_color_histograms
+
+TILESET_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Loaded libraries keyed by (tileset_id, block_size, color_mode), least recently used first
+_loaded_tilesets = OrderedDict()
+_loaded_lock = threading.Lock()
+
+def _read_zip_entry(archive, info, limit):
+    """
+    Read one ZIP entry in chunks, giving up as soon as it grows past a limit.
+
+    The declared size in the archive is not trusted, so the limit is enforced
+    on the bytes actually decompressed.
+
+    Args:
+        archive: open ZipFile
+        info: ZipInfo of the entry
+        limit: maximum number of bytes to read
+
+    Returns:
+        tuple: (bytes, or None if the entry is larger than limit, number of bytes read)
+    """
+    chunks, read = [], 0
+    with archive.open(info) as entry:
+        while True:
+            chunk = entry.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            read += len(chunk)
+            if read > limit:
+                return None, read
+            chunks.append(chunk)
+    return b''.join(chunks), read
+
+def iter_zip_images(zip_file, max_bytes=MAX_TILESET_UNCOMPRESSED_BYTES):
+    """
+    Read image files out of a ZIP archive one at a time, in name order.
+
+    Entries larger than MAX_TILE_FILE_SIZE are skipped. Every byte
+    decompressed, including that of skipped entries, counts towards max_bytes,
+    so a small archive cannot expand into an unbounded amount of work.
+
+    Args:
+        zip_file: path or file object of the archive
+        max_bytes: maximum number of uncompressed bytes read from the archive
+
+    Yields:
+        tuple: (name, bytes) for every image entry
+
+    Raises:
+        ValueError: if the archive expands to more than max_bytes
+    """
+    too_large = f"Archive too large. Maximum uncompressed size: {max_bytes // (1024 * 1024)} MB"
+    with zipfile.ZipFile(zip_file) as archive:
+        entries = []
+        declared = 0
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                continue
+            if '.' not in name or name.rsplit('.', 1)[1].lower() not in ALLOWED_EXTENSIONS:
+                continue
+            if info.file_size > MAX_TILE_FILE_SIZE:
+                continue
+            declared += info.file_size
+            if declared > max_bytes:
+                raise ValueError(too_large)
+            entries.append(info)
+
+        total = 0
+        for info in sorted(entries, key=lambda info: info.filename):
+            limit = min(MAX_TILE_FILE_SIZE, max_bytes - total)
+            data, read = _read_zip_entry(archive, info, limit)
+            total += read
+            if data is None:
+                if limit < MAX_TILE_FILE_SIZE:
+                    raise ValueError(too_large)
+                continue
+            yield info.filename, data
+
+def extract_tiles_from_zip(zip_file):
+    """
+    Read tile image files out of a ZIP archive.
+
+    Args:
+        zip_file: path or file object of the archive
+
+    Returns:
+        list: (name, bytes) tuples for every image entry
+    """
+    tiles = []
+    for name, data in iter_zip_images(zip_file):
+        if len(tiles) >= MAX_TILESET_TILES:
+            raise ValueError(f"Too many tiles. Maximum allowed: {MAX_TILESET_TILES}")
+        tiles.append((name, data))
+    return tiles
+
+def decode_tile(data, tile_size):
+    """
+    Decode one tile and center-crop it to a square of tile_size pixels.
+
+    Args:
+        data: encoded image bytes
+        tile_size: output width and height
+
+    Returns:
+        numpy array: (tile_size, tile_size, 3) uint8 tile, or None if undecodable
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        # The header gives the size; refuse oversized tiles before decoding any pixels
+        if img.width * img.height > MAX_TILE_PIXELS:
+            return None
+        # Let JPEG decode straight to a reduced size when the tile is much larger
+        img.draft('RGB', (tile_size * 2, tile_size * 2))
+        img = img.convert('RGB')
+        img = ImageOps.fit(img, (tile_size, tile_size), Image.LANCZOS)
+        return np.asarray(img, dtype=np.uint8)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+def get_tileset_folder(tileset_id):
+    """
+    Get the folder of a tile set.
+
+    Args:
+        tileset_id: tile set ID
+
+    Returns:
+        str: folder path, or None if the ID is invalid
+    """
+    if not TILESET_ID_PATTERN.match(tileset_id or ''):
+        return None
+    return os.path.join(TILESET_FOLDER, tileset_id)
+
+def build_tileset(tiles, tile_size):
+    """
+    Decode tiles in parallel, compute their features in batch and persist them.
+
+    The tile set is stored as blocks.npy, means.npy and histograms.npy plus an
+    index.json with the tile names, so it can be memory-mapped by load_tileset.
+
+    Args:
+        tiles: list of (name, bytes) tuples
+        tile_size: size of each square tile in pixels
+
+    Returns:
+        dict: tile set index
+    """
+    with ThreadPoolExecutor(max_workers=TILESET_DECODE_WORKERS) as executor:
+        decoded = list(executor.map(lambda tile: decode_tile(tile[1], tile_size), tiles))
+
+    names = [name for (name, _), block in zip(tiles, decoded) if block is not None]
+    skipped = [name for (name, _), block in zip(tiles, decoded) if block is None]
+    if not names:
+        raise ValueError('No decodable tile images found')
+
+    blocks = np.stack([block for block in decoded if block is not None])
+    means = blocks.mean(axis=(1, 2), dtype=np.float64).astype(np.float32)
+    histograms = get_color_histograms(blocks)
+
+    tileset_id = uuid.uuid4().hex
+    folder = get_tileset_folder(tileset_id)
+    os.makedirs(folder, exist_ok=True)
+    np.save(os.path.join(folder, 'blocks.npy'), blocks)
+    np.save(os.path.join(folder, 'means.npy'), means)
+    np.save(os.path.join(folder, 'histograms.npy'), histograms)
+
+    index = {
+        'tileset_id': tileset_id,
+        'tile_size': tile_size,
+        'count': len(names),
+        'names': names,
+        'skipped': skipped,
+        'created': time.time()
+    }
+    with open(os.path.join(folder, 'index.json'), 'w') as f:
+        json.dump(index, f)
+
+    return index
+
+def get_tileset_index(tileset_id):
+    """
+    Read the index of a tile set.
+
+    Args:
+        tileset_id: tile set ID
+
+    Returns:
+        dict: tile set index, or None if not found
+    """
+    folder = get_tileset_folder(tileset_id)
+    if folder is None or not os.path.exists(os.path.join(folder, 'index.json')):
+        return None
+    with open(os.path.join(folder, 'index.json')) as f:
+        return json.load(f)
+
+def list_tilesets():
+    """
+    List stored tile sets without their tile names.
+
+    Returns:
+        list: summary dictionaries, newest first
+    """
+    summaries = []
+    for tileset_id in os.listdir(TILESET_FOLDER):
+        index = get_tileset_index(tileset_id)
+        if index is not None:
+            summaries.append({key: value for key, value in index.items() if key not in ('names', 'skipped')})
+    summaries.sort(key=lambda s: s.get('created', 0), reverse=True)
+    return summaries
+
+def _trim_loaded_tilesets():
+    """Drop least recently used libraries beyond TILESET_CACHE_SIZE or TILESET_CACHE_BYTES (call with _loaded_lock held)"""
+    # Memory-mapped libraries count only their caches; resized and grayscale copies count in full
+    total = sum(library.nbytes for library in _loaded_tilesets.values())
+    while len(_loaded_tilesets) > 1 and (len(_loaded_tilesets) > TILESET_CACHE_SIZE or total > TILESET_CACHE_BYTES):
+        _, library = _loaded_tilesets.popitem(last=False)
+        total -= library.nbytes
+
+def load_tileset(tileset_id, block_size=None, color_mode='rgb', method='average_rgb'):
+    """
+    Load a tile set as an ElementLibrary.
+
+    Arrays are memory-mapped, so loading costs milliseconds regardless of the
+    number of tiles. Tiles are only copied when they have to be resized to a
+    different block size or converted to grayscale; those variants are cached,
+    least recently used first out, within TILESET_CACHE_SIZE and TILESET_CACHE_BYTES.
+    The colour lookup table of each variant is saved in the tile set folder.
+
+    Args:
+        tileset_id: tile set ID
+        block_size: block size to match against (defaults to the stored tile size)
+        color_mode: 'rgb' or 'grayscale'
+        method: colour feature used for matching
+
+    Returns:
+        ElementLibrary: tile library, or None if the tile set does not exist
+    """
+    index = get_tileset_index(tileset_id)
+    if index is None:
+        return None
+    block_size = block_size or index['tile_size']
+
+    key = (tileset_id, block_size, color_mode)
+    with _loaded_lock:
+        library = _loaded_tilesets.get(key)
+        if library is not None:
+            _loaded_tilesets.move_to_end(key)
+            # Caches (e.g. ANN indexes) grow after loading, so re-check the budget
+            _trim_loaded_tilesets()
+
+    if library is None:
+        folder = get_tileset_folder(tileset_id)
+        blocks = np.load(os.path.join(folder, 'blocks.npy'), mmap_mode='r')
+        means = np.load(os.path.join(folder, 'means.npy'), mmap_mode='r')
+        histograms = np.load(os.path.join(folder, 'histograms.npy'), mmap_mode='r')
+
+        if block_size != index['tile_size']:
+            interpolation = cv2.INTER_AREA if block_size < index['tile_size'] else cv2.INTER_LINEAR
+            blocks = np.stack([cv2.resize(np.asarray(block), (block_size, block_size), interpolation=interpolation) for block in blocks])
+
+        if color_mode == 'grayscale':
+            # Same ITU-R 601-2 luma transform as PIL's convert('L')
+            gray = np.stack([cv2.cvtColor(np.asarray(block), cv2.COLOR_RGB2GRAY) for block in blocks])
+            blocks = gray
+            gray_means = gray.mean(axis=(1, 2), dtype=np.float64)
+            means = np.repeat(gray_means[:, None], 3, axis=1)
+            histograms = get_color_histograms(gray)
+
+        positions = np.zeros((len(blocks), 2), dtype=np.int16)
+        positions[:, 1] = np.arange(len(blocks))
+        library = ElementLibrary(blocks, means, histograms, positions)
+        
+        if AVERAGE_RGB_MATCHER == 'lut':
+            # Precompute the colour lookup table once and keep it next to the arrays
+            lut_path = os.path.join(folder, f'lut_{block_size}_{color_mode}_{COLOR_LUT_BITS}_{COLOR_LUT_CANDIDATES}.npz')
+            if os.path.exists(lut_path):
+                library.cache['color_lut'] = ColorLookupTable.load(lut_path)
+            else:
+                library.cache['color_lut'] = get_color_lut(library)
+                library.cache['color_lut'].save(lut_path)
+
+        with _loaded_lock:
+            _loaded_tilesets[key] = library
+            _trim_loaded_tilesets()
+
+    # Share the arrays, but give each caller its own matching method
+    view = ElementLibrary(library.blocks, library.means, library.histograms, library.positions, method=method)
+    view.cache = library.cache
+    return view
@@ -7,24 +7,39 @@ from utils.file_utils import (
     generate_unique_filename, 
     get_file_path, 
     get_file_url, 
-    save_uploaded_file
+    save_uploaded_file,
+    save_uploaded_image
 )
 from utils.image_utils import (
     resize_image_if_needed,
     normalize_image,
     check_mosaic_size,
     get_average_color,
+    get_block_average_colors,
+    get_block_histograms,
     get_color_histogram,
+    get_color_histograms,
     color_distance,
+    rgb_to_lab,
+    lab_distance,
     histogram_comparison,
     load_and_preprocess_image,
     save_image
 )
+from utils.encoders import (
+    get_encoder,
+    get_output_filename,
+    encode_image,
+    negotiate_format
+)
 from utils.validation import (
     validate_file_upload,
     allowed_file,
     validate_block_size,
     validate_filter,
+    validate_color_method,
+    validate_engine,
+    validate_alpha,
     validate_job_id
 )
 
@@ -0,0 +1,263 @@
+"""
+Output image encoders selected per output class, and format negotiation.
+"""
+import glob
+import os
+from PIL import Image
+from config import OUTPUT_ENCODERS, NEGOTIATED_FORMATS, WEBP_METHOD, VARIANT_FOLDER, VARIANT_SIZE_BUCKETS, VARIANT_FITS
+from utils.output_writer import atomic_write
+from utils.resampling import resize
+
+# Format name -> (Pillow format, file extension, MIME type)
+IMAGE_FORMATS = {
+    'png': ('PNG', 'png', 'image/png'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'webp': ('WEBP', 'webp', 'image/webp')
+}
+
+# File extension -> format name
+EXTENSION_FORMATS = {'png': 'png', 'jpg': 'jpeg', 'jpeg': 'jpeg', 'webp': 'webp'}
+
+def get_path_format(path):
+    """
+    Get the image format implied by a file extension.
+
+    Args:
+        path: file path or name
+
+    Returns:
+        str: format name, or None for other extensions
+    """
+    return EXTENSION_FORMATS.get(os.path.splitext(path)[1][1:].lower())
+
+def get_encoder(output_class='final', image_format=None):
+    """
+    Get the format and Pillow save options for an output class.
+
+    Args:
+        output_class: 'final', 'preview' or 'intermediate' (see OUTPUT_ENCODERS)
+        image_format: 'png', 'jpeg' or 'webp'; defaults to the class's format
+
+    Returns:
+        tuple: (format name, dict of Pillow save options)
+    """
+    settings = OUTPUT_ENCODERS[output_class]
+    image_format = image_format or settings['format']
+
+    if image_format == 'png':
+        options = {'compress_level': settings['png_compress_level'], 'optimize': settings.get('png_optimize', False)}
+    elif image_format == 'jpeg':
+        options = {'quality': settings['jpeg_quality'], 'progressive': settings.get('jpeg_progressive', False)}
+    elif image_format == 'webp':
+        options = {'quality': settings['webp_quality'], 'method': WEBP_METHOD}
+    else:
+        raise ValueError(f"Unknown image format: {image_format}")
+    return image_format, options
+
+def get_output_filename(stem, output_class='final', image_format=None):
+    """
+    Build an output filename with the extension of the class's format.
+
+    Args:
+        stem: filename without extension
+        output_class: output class
+        image_format: explicit format, if any
+
+    Returns:
+        str: filename
+    """
+    image_format, _ = get_encoder(output_class, image_format)
+    return f"{stem}.{IMAGE_FORMATS[image_format][1]}"
+
+def encode_image(pil_img, path, output_class='final', image_format=None):
+    """
+    Encode a PIL image with the settings of an output class.
+
+    Args:
+        pil_img: PIL Image
+        path: output path
+        output_class: output class
+        image_format: format name; defaults to the path's extension, then the class's format
+
+    Returns:
+        str: path where the image was saved
+    """
+    image_format, options = get_encoder(output_class, image_format or get_path_format(path))
+    if image_format == 'jpeg' and pil_img.mode not in ('RGB', 'L'):
+        pil_img = pil_img.convert('RGB')
+    pil_img.save(path, IMAGE_FORMATS[image_format][0], **options)
+    return path
+
+def negotiate_format(requested=None, accept_mimetypes=None, default=None):
+    """
+    Pick an output format from a format= parameter or an Accept header.
+
+    An explicit format= wins. Otherwise the stored (default) format is kept
+    whenever the Accept header allows it, including through image/* or */*,
+    so stored images are never re-encoded just because a browser also lists
+    image/webp. Only when the stored format is not accepted is the first
+    accepted format of NEGOTIATED_FORMATS used.
+
+    Args:
+        requested: value of the format= parameter, or None
+        accept_mimetypes: request.accept_mimetypes, or None
+        default: stored format, returned when nothing else is negotiated
+
+    Returns:
+        tuple: (is_valid, error_message or format name)
+    """
+    if requested:
+        requested = EXTENSION_FORMATS.get(requested.lower())
+        if requested is None:
+            return False, f'Invalid format. Available formats: {", ".join(IMAGE_FORMATS)}'
+        return True, requested
+
+    # No Accept header means anything is accepted
+    if default is None or not accept_mimetypes or accept_mimetypes.quality(IMAGE_FORMATS[default][2]) > 0:
+        return True, default
+
+    for image_format in NEGOTIATED_FORMATS:
+        if accept_mimetypes.quality(IMAGE_FORMATS[image_format][2]) > 0:
+            return True, image_format
+
+    return True, default
+
+def get_variant_size(width=None, height=None, fit=None):
+    """
+    Validate a requested variant size and round it up to a size bucket.
+
+    Rounding to VARIANT_SIZE_BUCKETS bounds the number of variants a single
+    image can have, whatever sizes clients ask for.
+
+    Args:
+        width: requested width (w= parameter), or None
+        height: requested height (h= parameter), or None
+        fit: 'contain', 'cover' or 'fill' (defaults to 'contain')
+
+    Returns:
+        tuple: (is_valid, error_message or (width, height, fit)); the size is
+               None when neither width nor height was requested
+    """
+    if width is None and height is None:
+        return True, None
+
+    fit = fit or 'contain'
+    if fit not in VARIANT_FITS:
+        return False, f'Invalid fit. Available fits: {", ".join(VARIANT_FITS)}'
+
+    bucketed = []
+    for value in (width, height):
+        if value is not None:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                value = 0
+            if value <= 0:
+                return False, 'Invalid size. w and h must be positive integers'
+            value = next((bucket for bucket in VARIANT_SIZE_BUCKETS if bucket >= value), VARIANT_SIZE_BUCKETS[-1])
+        bucketed.append(value)
+    return True, (bucketed[0], bucketed[1], fit)
+
+def resize_variant(img, size):
+    """
+    Resize an image to a variant size.
+
+    'contain' fits the image inside the box and 'cover' fills the box and
+    crops the overflow around the centre; neither enlarges the image.
+    'fill' stretches to the exact size. A missing width or height keeps
+    the aspect ratio.
+
+    Args:
+        img: PIL Image
+        size: (width, height, fit) from get_variant_size
+
+    Returns:
+        PIL Image: resized image
+    """
+    width, height, fit = size
+    if fit == 'fill' and width and height:
+        new_size = (width, height)
+    else:
+        scales = [target / source for target, source in ((width, img.width), (height, img.height)) if target]
+        scale = max(scales) if fit == 'cover' else min(scales)
+        if fit != 'fill':
+            scale = min(scale, 1.0)
+        new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+
+    if new_size != img.size:
+        img = resize(img, new_size, 'preview')
+
+    if fit == 'cover' and width and height:
+        crop_width, crop_height = min(width, img.width), min(height, img.height)
+        left = (img.width - crop_width) // 2
+        top = (img.height - crop_height) // 2
+        img = img.crop((left, top, left + crop_width, top + crop_height))
+    return img
+
+def get_variant_path(source_path, folder_type, image_format, size=None):
+    """
+    Get a cached re-encoding or resized copy of a stored image, creating it on first use.
+
+    Variants live in VARIANT_FOLDER, named after their folder type, source
+    file, size and format, and are rebuilt when the source is newer.
+
+    Args:
+        source_path: path of the stored image
+        folder_type: folder of the source ('upload', 'temp' or 'output'), which
+                     also selects the encoder class of full-size variants
+        image_format: format of the variant
+        size: (width, height, fit) from get_variant_size, or None for full size
+
+    Returns:
+        str: path of the variant
+    """
+    filename = os.path.basename(source_path)
+    size_suffix = f".{size[0] or 0}x{size[1] or 0}-{size[2]}" if size else ""
+    variant_path = os.path.join(VARIANT_FOLDER, f"{folder_type}__{filename}{size_suffix}.{IMAGE_FORMATS[image_format][1]}")
+
+    source_mtime = os.stat(source_path).st_mtime_ns
+    if os.path.exists(variant_path) and os.stat(variant_path).st_mtime_ns >= source_mtime:
+        return variant_path
+
+    # Resized copies are thumbnails; full-size outputs keep the final encoder settings
+    output_class = 'final' if folder_type == 'output' and not size else 'preview'
+    with Image.open(source_path) as img:
+        if size:
+            img = resize_variant(img, size)
+        # Write atomically so concurrent readers never see a partial variant
+        atomic_write(variant_path, lambda temp_path: encode_image(img, temp_path, output_class, image_format))
+    return variant_path
+
+def open_variant(source_path, folder_type, size):
+    """
+    Load a resized variant of a stored image in the source's own format.
+
+    Endpoints that need thumbnails use this instead of resizing themselves,
+    so they share the files the image routes serve for ?w=&h=&fit=.
+
+    Args:
+        source_path: path of the stored image
+        folder_type: folder of the source
+        size: (width, height, fit) from get_variant_size
+
+    Returns:
+        PIL Image: the loaded variant
+    """
+    image_format = get_path_format(source_path) or 'png'
+    with Image.open(get_variant_path(source_path, folder_type, image_format, size)) as img:
+        return img.copy()
+
+def remove_variants(filename, folder_type):
+    """
+    Delete every cached variant of a stored image.
+
+    Args:
+        filename: name of the source file
+        folder_type: folder of the source
+    """
+    pattern = os.path.join(VARIANT_FOLDER, glob.escape(f"{folder_type}__{filename}") + '*')
+    for path in glob.glob(pattern):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,10 +1,17 @@
 """
 Utility functions for file handling.
 """
+import hashlib
 import os
 import uuid
+from PIL import Image
 from werkzeug.utils import secure_filename
-from config import ALLOWED_EXTENSIONS, UPLOAD_FOLDER, TEMP_FOLDER, OUTPUT_FOLDER
+from config import (
+    ALLOWED_EXTENSIONS, UPLOAD_FOLDER, TEMP_FOLDER, OUTPUT_FOLDER, MAX_UPLOAD_PIXELS,
+    UPLOAD_CHUNK_SIZE, MAX_ANIMATION_FRAMES, MAX_ANIMATION_PIXELS
+)
+from utils.output_writer import atomic_write
+from utils.image_utils import remember_decoded, take_decoded
 
 def allowed_file(filename):
     """
@@ -92,4 +99,181 @@ def get_file_url(filename, folder_type='upload'):
     elif folder_type == 'output':
         return f"/api/images/outputs/{filename}"
     else:
-        raise ValueError(f"Invalid folder type: {folder_type}")
\ No newline at end of file
+        raise ValueError(f"Invalid folder type: {folder_type}")
+
+# Leading bytes of the accepted image formats
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif')
+)
+
+def sniff_image_format(header):
+    """
+    Identify an image format from the first bytes of a file.
+    
+    Args:
+        header: leading bytes of the file
+        
+    Returns:
+        str: 'png', 'jpeg' or 'gif', or None if unrecognised
+    """
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+def sniff_frames_format(header):
+    """
+    Identify a frames upload (ZIP archive or animated GIF) from the first bytes of a file.
+    
+    Args:
+        header: leading bytes of the file
+        
+    Returns:
+        str: 'zip' or 'gif', or None if unrecognised
+    """
+    if header.startswith(b'PK\x03\x04'):
+        return 'zip'
+    return 'gif' if sniff_image_format(header) == 'gif' else None
+
+def stream_upload(file_obj, file_path, sniff, error):
+    """
+    Copy an upload to disk in chunks, sniffing its format from the first chunk and hashing it.
+    
+    The file is written atomically, so a rejected upload leaves nothing behind.
+    
+    Args:
+        file_obj: File object from the request
+        file_path: destination path
+        sniff: function returning the format of the leading bytes, or None
+        error: message of the ValueError raised when sniff does not recognise the file
+        
+    Returns:
+        tuple: (format returned by sniff, SHA-1 hex digest of the file)
+        
+    Raises:
+        ValueError: if sniff does not recognise the file
+    """
+    digest = hashlib.sha1()
+    sniffed = []
+    
+    def write(temp_path):
+        with open(temp_path, 'wb') as f:
+            chunk = file_obj.stream.read(UPLOAD_CHUNK_SIZE)
+            sniffed.append(sniff(chunk))
+            if sniffed[0] is None:
+                raise ValueError(error)
+            while chunk:
+                digest.update(chunk)
+                f.write(chunk)
+                chunk = file_obj.stream.read(UPLOAD_CHUNK_SIZE)
+    
+    atomic_write(file_path, write)
+    return sniffed[0], digest.hexdigest()
+
+def save_uploaded_image(file_obj, filename=None, decode=True):
+    """
+    Stream an uploaded image to disk, then decode it only if it is within the pixel budget.
+    
+    The upload is hashed and its format sniffed from the first chunk while it
+    is copied, so non-images are rejected before the rest is read. The
+    dimensions are then read from the header alone, and images above
+    MAX_UPLOAD_PIXELS are rejected before any pixel data is decoded. The
+    decoded image is handed to load_and_preprocess_image for the next step.
+    
+    Callers that load the image at a reduced size pass decode=False: only the
+    header is checked, so load_and_preprocess_image can still decode a JPEG
+    at a reduced scale with Image.draft.
+    
+    Args:
+        file_obj: File object from the request
+        filename: Optional filename to use (if None, will generate one)
+        decode: whether to decode the full image now and keep it for the next step
+        
+    Returns:
+        tuple: (unique_id, filename, full_path, SHA-1 hex digest of the file)
+        
+    Raises:
+        ValueError: if the file is not a supported image or has too many pixels
+    """
+    if filename is None:
+        unique_id, filename = generate_unique_filename(file_obj.filename)
+    else:
+        unique_id = filename.split('_')[0] if '_' in filename else None
+    
+    file_path = get_file_path(filename, 'upload')
+    _, sha1 = stream_upload(file_obj, file_path, sniff_image_format, 'File content is not a supported image')
+    
+    try:
+        # Image.open only parses the header; pixels are decoded by load()
+        img = Image.open(file_path)
+        width, height = img.size
+        if width * height > MAX_UPLOAD_PIXELS:
+            img.close()
+            raise ValueError(f'Image too large: {width}x{height} pixels. Maximum allowed: {MAX_UPLOAD_PIXELS} pixels')
+        if not decode:
+            img.close()
+        else:
+            img.load()
+    except (ValueError, OSError, Image.DecompressionBombError) as e:
+        os.remove(file_path)
+        raise ValueError(str(e)) from e
+    
+    if decode:
+        remember_decoded(file_path, img)
+    
+    return unique_id, filename, file_path, sha1
+
+def save_uploaded_frames(file_obj, name):
+    """
+    Stream an uploaded frames archive or animated GIF to disk and check its size from the headers.
+    
+    For a GIF the frame count and dimensions are read without decoding any
+    pixels, and uploads above MAX_ANIMATION_FRAMES frames or MAX_ANIMATION_PIXELS
+    decoded pixels are rejected. The entries of a ZIP archive are checked one
+    at a time by iter_frames.
+    
+    Args:
+        file_obj: File object from the request
+        name: filename to use, without extension (the sniffed format adds it)
+        
+    Returns:
+        tuple: (full_path, SHA-1 hex digest of the file)
+        
+    Raises:
+        ValueError: if the file is neither a ZIP archive nor a GIF, or is too large
+    """
+    stream_path = get_file_path(name, 'upload')
+    frames_format, sha1 = stream_upload(file_obj, stream_path, sniff_frames_format, 'File content is not a ZIP archive or GIF')
+    file_path = f"{stream_path}.{frames_format}"
+    os.replace(stream_path, file_path)
+    
+    if frames_format == 'gif':
+        try:
+            with Image.open(file_path) as img:
+                width, height = img.size
+                if width * height > MAX_UPLOAD_PIXELS:
+                    raise ValueError(f'Frames too large: {width}x{height} pixels. Maximum allowed: {MAX_UPLOAD_PIXELS} pixels')
+                # Counting frames walks the frame headers without decoding them
+                n_frames = getattr(img, 'n_frames', 1)
+            if n_frames > MAX_ANIMATION_FRAMES:
+                raise ValueError(f'Too many frames. Maximum allowed: {MAX_ANIMATION_FRAMES}')
+            if width * height * n_frames > MAX_ANIMATION_PIXELS:
+                raise ValueError(f'Animation too large: {n_frames} frames of {width}x{height} pixels. Maximum allowed: {MAX_ANIMATION_PIXELS} pixels')
+        except (ValueError, OSError, Image.DecompressionBombError) as e:
+            os.remove(file_path)
+            raise ValueError(str(e)) from e
+    
+    return file_path, sha1
+
+def remove_uploaded_image(path):
+    """
+    Delete an uploaded image together with its decoded copy held in memory.
+    
+    Args:
+        path: path returned by save_uploaded_image
+    """
+    take_decoded(path)
+    os.remove(path)
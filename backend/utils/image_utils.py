@@ -1,31 +1,54 @@
 """
 Utility functions for image processing.
 """
+import os
+import threading
+from collections import OrderedDict
 import numpy as np
 from PIL import Image, ImageFilter, ImageEnhance
 import cv2
-from config import MAX_ELEMENT_SIZE, MAX_TARGET_SIZE
+from config import MAX_ELEMENT_SIZE, MAX_TARGET_SIZE, DECODED_CACHE_BYTES, DECODE_REDUCING_GAP
+from utils.tiled_image import TiledImage, save_tiled_png
+from utils.encoders import get_encoder, get_path_format, encode_image
+from utils.output_writer import atomic_write
+from utils.resampling import resize
 
-def resize_image_if_needed(img, max_size, maintain_aspect_ratio=True):
-    """Return to the original, reliable implementation"""
-    width, height = img.size
+# Uploads decoded while streaming, keyed by file content key, oldest first
+_decoded = OrderedDict()
+_decoded_lock = threading.Lock()
+
+def get_bounded_size(size, max_size, maintain_aspect_ratio=True):
+    """
+    Size of an image after bounding its longest side by max_size.
+    
+    Args:
+        size: (width, height) of the image
+        max_size: maximum width and height
+        maintain_aspect_ratio: whether to keep the aspect ratio
+        
+    Returns:
+        tuple: (width, height), unchanged if already within max_size
+    """
+    width, height = size
     
     # Check if resizing is needed
     if width <= max_size and height <= max_size:
-        return img
+        return size
     
     if maintain_aspect_ratio:
         if width > height:
-            new_width = max_size
-            new_height = int(height * (max_size / width))
-        else:
-            new_height = max_size
-            new_width = int(width * (max_size / height))
-    else:
-        new_width = new_height = max_size
-        
-    # Use LANCZOS for high-quality resizing
-    return img.resize((new_width, new_height), Image.LANCZOS)
+            return max_size, int(height * (max_size / width))
+        return int(width * (max_size / height)), max_size
+    return max_size, max_size
+
+def resize_image_if_needed(img, max_size, maintain_aspect_ratio=True):
+    """Return to the original, reliable implementation"""
+    new_size = get_bounded_size(img.size, max_size, maintain_aspect_ratio)
+    if new_size == img.size:
+        return img
+    
+    # High-quality resizing (LANCZOS after a cheap integer reduction by default)
+    return resize(img, new_size, 'final')
 
 def normalize_image(img):
     """
@@ -119,6 +142,53 @@ def get_average_color(img_block):
         np.mean(img_block[:, :, 2])
     )
 
+def get_block_average_colors(img, block_size):
+    """
+    Calculate the average RGB color of every block in an image at once.
+    
+    Args:
+        img: numpy array of RGB or grayscale image
+        block_size: size of each square block
+        
+    Returns:
+        numpy array: (n_blocks_h, n_blocks_w, 3) average colors, matching get_average_color per block
+    """
+    n_blocks_h = img.shape[0] // block_size
+    n_blocks_w = img.shape[1] // block_size
+    cropped = img[:n_blocks_h * block_size, :n_blocks_w * block_size]
+    
+    if len(img.shape) == 2:  # Grayscale
+        blocks = cropped.reshape(n_blocks_h, block_size, n_blocks_w, block_size)
+        means = blocks.mean(axis=(1, 3), dtype=np.float64)
+        return np.repeat(means[:, :, None], 3, axis=2)
+    
+    blocks = cropped.reshape(n_blocks_h, block_size, n_blocks_w, block_size, img.shape[2])
+    return blocks.mean(axis=(1, 3), dtype=np.float64)[:, :, :3]
+
+def get_block_histograms(img, block_size, bins=8):
+    """
+    Calculate the color histogram of every block in an image at once.
+    
+    Args:
+        img: numpy array of RGB or grayscale image
+        block_size: size of each square block
+        bins: number of bins per channel
+        
+    Returns:
+        numpy array: (n_blocks_h, n_blocks_w, n_bins) histograms, matching get_color_histogram per block
+    """
+    n_blocks_h = img.shape[0] // block_size
+    n_blocks_w = img.shape[1] // block_size
+    channel_shape = img.shape[2:]
+    cropped = img[:n_blocks_h * block_size, :n_blocks_w * block_size]
+    
+    # (N, bs, bs[, C]) block stack in row-major block order
+    blocks = cropped.reshape((n_blocks_h, block_size, n_blocks_w, block_size) + channel_shape).swapaxes(1, 2)
+    blocks = blocks.reshape((n_blocks_h * n_blocks_w, block_size, block_size) + channel_shape)
+    
+    hists = get_color_histograms(blocks, bins=bins)
+    return hists.reshape(n_blocks_h, n_blocks_w, -1)
+
 def get_color_histogram(img_block, bins=8):
     """
     Calculate the color histogram of an image block.
@@ -150,6 +220,42 @@ def get_color_histogram(img_block, bins=8):
     cv2.normalize(hist, hist)
     return hist.flatten()
 
+def get_color_histograms(blocks, bins=8):
+    """
+    Calculate the color histograms of many image blocks at once.
+    
+    Produces the same normalized, flattened histograms as get_color_histogram
+    (including OpenCV's BGR bin order) with a single bincount.
+    
+    Args:
+        blocks: (N, h, w, 3) RGB or (N, h, w) grayscale uint8 blocks
+        bins: number of bins per channel
+        
+    Returns:
+        numpy array: (N, bins**3) or (N, bins) float32 histograms
+    """
+    n_blocks = blocks.shape[0]
+    bin_width = 256 // bins
+    quantized = (blocks // bin_width).astype(np.int64)
+    
+    if len(blocks.shape) == 4 and blocks.shape[3] == 3:
+        # OpenCV histograms are built on BGR data: index = B * bins^2 + G * bins + R
+        bin_index = quantized[..., 2] * bins * bins + quantized[..., 1] * bins + quantized[..., 0]
+        n_bins = bins ** 3
+    else:
+        bin_index = quantized.reshape(n_blocks, -1)
+        n_bins = bins
+    
+    # Offset each block's bins so one bincount fills every histogram
+    offsets = (np.arange(n_blocks, dtype=np.int64) * n_bins).reshape((n_blocks,) + (1,) * (bin_index.ndim - 1))
+    counts = np.bincount((bin_index + offsets).ravel(), minlength=n_blocks * n_bins)
+    hists = counts.reshape(n_blocks, n_bins).astype(np.float32)
+    
+    # L2-normalize like cv2.normalize's default
+    norms = np.linalg.norm(hists, axis=1, keepdims=True)
+    np.divide(hists, norms, out=hists, where=norms > 0)
+    return hists
+
 def color_distance(color1, color2):
     """
     Calculate Euclidean distance between two RGB colors.
@@ -163,6 +269,79 @@ def color_distance(color1, color2):
     """
     return np.sqrt(sum((c1 - c2) ** 2 for c1, c2 in zip(color1, color2)))
 
+def rgb_to_lab(colors):
+    """
+    Convert RGB colors to CIELAB with a single cv2.cvtColor call.
+    
+    Args:
+        colors: (..., 3) RGB colors in [0, 255]; an (H, W, 3) array is converted as is
+        
+    Returns:
+        numpy array: float32 (L, a, b) colors of the same shape (L in [0, 100])
+    """
+    colors = np.asarray(colors, dtype=np.float32) / 255
+    if colors.ndim == 3:
+        return cv2.cvtColor(colors, cv2.COLOR_RGB2Lab)
+    
+    lab = cv2.cvtColor(np.ascontiguousarray(colors.reshape(-1, 1, 3)), cv2.COLOR_RGB2Lab)
+    return lab.reshape(colors.shape)
+
+def lab_distance(lab1, lab2, formula='ciede2000'):
+    """
+    Calculate perceptual color differences between broadcastable arrays of Lab colors.
+    
+    Args:
+        lab1: (..., 3) Lab colors
+        lab2: (..., 3) Lab colors
+        formula: 'cie76' (Euclidean in Lab) or 'ciede2000'
+        
+    Returns:
+        numpy array: color differences (Delta E) with the broadcast shape
+    """
+    L1, a1, b1 = (np.asarray(lab1, dtype=np.float32)[..., i] for i in range(3))
+    L2, a2, b2 = (np.asarray(lab2, dtype=np.float32)[..., i] for i in range(3))
+    
+    if formula == 'cie76':
+        return np.sqrt((L1 - L2) ** 2 + (a1 - a2) ** 2 + (b1 - b2) ** 2)
+    if formula != 'ciede2000':
+        raise ValueError(f"Unknown Lab distance formula: {formula}")
+    
+    # CIEDE2000 (Sharma, Wu and Dalal, 2005)
+    C_bar = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2
+    C_bar7 = C_bar ** 7
+    G = 0.5 * (1 - np.sqrt(C_bar7 / (C_bar7 + 25.0 ** 7)))
+    a1p, a2p = (1 + G) * a1, (1 + G) * a2
+    C1p, C2p = np.hypot(a1p, b1), np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+    
+    chroma_product = C1p * C2p
+    dh = h2p - h1p
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh))
+    dh = np.where(chroma_product == 0, 0, dh)
+    dL = L2 - L1
+    dC = C2p - C1p
+    dH = 2 * np.sqrt(chroma_product) * np.sin(np.radians(dh / 2))
+    
+    L_bar = (L1 + L2) / 2
+    Cp_bar = (C1p + C2p) / 2
+    h_sum = h1p + h2p
+    h_bar = np.where(np.abs(h1p - h2p) > 180, np.where(h_sum < 360, h_sum + 360, h_sum - 360), h_sum) / 2
+    h_bar = np.where(chroma_product == 0, h_sum, h_bar)
+    
+    T = (1 - 0.17 * np.cos(np.radians(h_bar - 30)) + 0.24 * np.cos(np.radians(2 * h_bar))
+         + 0.32 * np.cos(np.radians(3 * h_bar + 6)) - 0.20 * np.cos(np.radians(4 * h_bar - 63)))
+    d_theta = 30 * np.exp(-((h_bar - 275) / 25) ** 2)
+    Cp_bar7 = Cp_bar ** 7
+    R_C = 2 * np.sqrt(Cp_bar7 / (Cp_bar7 + 25.0 ** 7))
+    S_L = 1 + 0.015 * (L_bar - 50) ** 2 / np.sqrt(20 + (L_bar - 50) ** 2)
+    S_C = 1 + 0.045 * Cp_bar
+    S_H = 1 + 0.015 * Cp_bar * T
+    R_T = -np.sin(np.radians(2 * d_theta)) * R_C
+    
+    dL, dC, dH = dL / S_L, dC / S_C, dH / S_H
+    return np.sqrt(np.maximum(dL ** 2 + dC ** 2 + dH ** 2 + R_T * dC * dH, 0))
+
 def histogram_comparison(hist1, hist2, method=cv2.HISTCMP_CORREL):
     """
     Compare two histograms using specified method.
@@ -177,19 +356,79 @@ def histogram_comparison(hist1, hist2, method=cv2.HISTCMP_CORREL):
     """
     return cv2.compareHist(hist1, hist2, method)
 
-def load_and_preprocess_image(image_path, target_size=None, color_mode='rgb'):
+def _file_key(path):
+    """Key of a file's current content: absolute path, size and modification time"""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+def _image_bytes(img):
+    """Approximate size of a decoded PIL Image's pixel data"""
+    return img.width * img.height * len(img.getbands())
+
+def remember_decoded(path, img):
+    """
+    Keep a freshly decoded upload in memory for the next pipeline step.
+    
+    At most DECODED_CACHE_BYTES of pixel data are kept; the oldest images are
+    dropped first.
+    
+    Args:
+        path: path of the file the image was decoded from
+        img: decoded PIL Image
+    """
+    key = _file_key(path)
+    with _decoded_lock:
+        _decoded[key] = img
+        while sum(_image_bytes(cached) for cached in _decoded.values()) > DECODED_CACHE_BYTES:
+            _decoded.popitem(last=False)
+
+def take_decoded(path):
+    """
+    Take a decoded image remembered for a file, if the file is unchanged.
+    
+    Args:
+        path: image file path
+        
+    Returns:
+        PIL Image: the decoded image, or None (it is handed out only once)
+    """
+    try:
+        key = _file_key(path)
+    except FileNotFoundError:
+        return None
+    with _decoded_lock:
+        return _decoded.pop(key, None)
+
+def load_and_preprocess_image(image_path, target_size=None, color_mode='rgb', max_size=None):
     """
     Load and preprocess an image from path.
     
+    Images decoded during upload are taken from memory instead of the file.
+    When the final size is known, the image is first brought close to it
+    cheaply - JPEG files decode at a reduced DCT scale (Image.draft), other
+    images are box-reduced (Image.reduce) - and only the last step uses
+    LANCZOS (the 'final' resampling tier).
+    
     Args:
         image_path: path to the image file
         target_size: tuple (width, height) or None
         color_mode: 'rgb' or 'grayscale'
+        max_size: bound on the longest side (as resize_image_if_needed), or None
         
     Returns:
         PIL Image: preprocessed image
     """
-    img = Image.open(image_path)
+    img = take_decoded(image_path)
+    if img is None:
+        img = Image.open(image_path)
+    
+    final_size = target_size
+    if final_size is None and max_size:
+        final_size = get_bounded_size(img.size, max_size)
+    
+    if final_size and final_size != img.size and img.format == 'JPEG':
+        # Only takes effect before the pixels are decoded
+        img.draft('RGB' if color_mode == 'rgb' else 'L', (final_size[0] * DECODE_REDUCING_GAP, final_size[1] * DECODE_REDUCING_GAP))
     
     # Convert to desired color mode
     if color_mode == 'rgb' and img.mode != 'RGB':
@@ -198,22 +437,33 @@ def load_and_preprocess_image(image_path, target_size=None, color_mode='rgb'):
         img = img.convert('L')
     
     # Resize if needed
-    if target_size:
-        img = img.resize(target_size, Image.LANCZOS)
+    if final_size and final_size != img.size:
+        img = resize(img, final_size, 'final')
     
     return img
 
-def save_image(img, path):
+def save_image(img, path, output_class='final'):
     """
     Save image to file.
     
+    The image is written to a temporary file and renamed into place, so
+    readers never see a partially written file.
+    
     Args:
-        img: PIL Image or numpy array
-        path: path to save the image
+        img: PIL Image, numpy array or TiledImage
+        path: path to save the image; its extension selects the format
+        output_class: 'final', 'preview' or 'intermediate', selecting the encoder settings
         
     Returns:
         str: path where the image was saved
     """
+    if isinstance(img, TiledImage):
+        # Stream repeated tiles straight to PNG instead of building the full array
+        if img.dtype == np.uint8 and get_path_format(path) == 'png':
+            _, options = get_encoder(output_class, 'png')
+            return atomic_write(path, lambda temp_path: save_tiled_png(img, temp_path, compress_level=options['compress_level']))
+        img = np.asarray(img)
+    
     if isinstance(img, np.ndarray):
         # Convert numpy array to PIL Image
         if img.dtype != np.uint8:
@@ -232,5 +482,4 @@ def save_image(img, path):
         # Already a PIL Image
         pil_img = img
     
-    pil_img.save(path)
-    return path
\ No newline at end of file
+    return atomic_write(path, lambda temp_path: encode_image(pil_img, temp_path, output_class, get_path_format(path)))
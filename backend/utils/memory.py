@@ -0,0 +1,160 @@
+"""
+Utility functions for measuring and budgeting job memory.
+"""
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from config import (
+    MEMORY_TRACKING, MEMORY_SAMPLE_INTERVAL, MAX_JOB_MEMORY_BYTES,
+    MEMORY_COST_PER_VALUE, MEMORY_COST_OVERHEAD
+)
+from utils.server_metrics import get_process_rss
+
+# Measured stages in flight across all jobs, and how many have started so far
+_stages_lock = threading.Lock()
+_active_stages = 0
+_started_stages = 0
+_started_tracing = False
+
+class _RSSSampler(threading.Thread):
+    """Background thread that records the highest RSS seen while a stage runs"""
+
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = get_process_rss() or 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            rss = get_process_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        rss = get_process_rss()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+        return self.peak
+
+@contextmanager
+def track_memory(job_state, stage):
+    """
+    Measure the peak memory of a job stage and store it on the job record.
+
+    With MEMORY_TRACKING = 'rss' a sampling thread records the RSS high-water
+    mark above the RSS at stage start. With 'tracemalloc' Python and NumPy
+    allocations are traced exactly, at a large CPU cost for Python-heavy loops.
+
+    Both measure the whole process, not the job: the record has scope
+    'process', and 'concurrent' is set when another measured stage (of this
+    or any other job) ran at the same time, in which case the numbers include
+    its memory too. The tracemalloc peak is only reset when no other stage is
+    being measured, so overlapping stages never clobber each other's peak.
+
+    Args:
+        job_state: job state dictionary (or None to skip recording)
+        stage: name of the stage
+    """
+    global _active_stages, _started_stages, _started_tracing
+
+    if MEMORY_TRACKING == 'off' or job_state is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    rss_before = get_process_rss() or 0
+    sampler = None
+
+    with _stages_lock:
+        _active_stages += 1
+        _started_stages += 1
+        started_stages = _started_stages
+        concurrent = _active_stages > 1
+        if MEMORY_TRACKING == 'tracemalloc':
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _started_tracing = True
+            if not concurrent:
+                tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+
+    if MEMORY_TRACKING != 'tracemalloc':
+        sampler = _RSSSampler(MEMORY_SAMPLE_INTERVAL)
+        sampler.start()
+
+    try:
+        yield
+    finally:
+        record = {'elapsed': time.perf_counter() - start, 'scope': 'process'}
+
+        if MEMORY_TRACKING == 'tracemalloc':
+            with _stages_lock:
+                record['peak_bytes'] = max(0, tracemalloc.get_traced_memory()[1] - traced_before)
+        else:
+            record['peak_bytes'] = max(0, sampler.stop() - rss_before)
+        record['rss_delta_bytes'] = (get_process_rss() or 0) - rss_before
+
+        with _stages_lock:
+            _active_stages -= 1
+            # Another stage overlapped if one was running at the start or started since
+            record['concurrent'] = concurrent or _started_stages != started_stages
+            if _active_stages == 0 and _started_tracing:
+                tracemalloc.stop()
+                _started_tracing = False
+
+        job_state.setdefault('memory', {})[stage] = record
+
+def estimate_job_memory(element_shape, target_shape, engine='legacy', block_size=None):
+    """
+    Estimate the peak memory of generating a mosaic.
+
+    Args:
+        element_shape: shape of the element image array
+        target_shape: shape of the target image array
+        engine: 'legacy' (one element per target pixel), 'block' or 'quadtree'
+        block_size: (largest) block size for the block engines
+
+    Returns:
+        int: estimated peak bytes
+    """
+    element_h, element_w = element_shape[:2]
+    target_h, target_w = target_shape[:2]
+    channels = target_shape[2] if len(target_shape) == 3 else 1
+
+    if engine == 'legacy':
+        output_values = element_h * target_h * element_w * target_w * channels
+    else:
+        output_values = (target_h // block_size) * block_size * (target_w // block_size) * block_size * channels
+
+    return int(output_values * MEMORY_COST_PER_VALUE[engine]) + MEMORY_COST_OVERHEAD
+
+def check_memory_budget(element_shape, target_shape, engine='legacy', block_size=None):
+    """
+    Check a job against MAX_JOB_MEMORY_BYTES and find a target size that fits.
+
+    Args:
+        element_shape: shape of the element image array
+        target_shape: shape of the target image array
+        engine: 'legacy', 'block' or 'quadtree'
+        block_size: (largest) block size for the block engines
+
+    Returns:
+        tuple: (within_budget, estimated_bytes, adjusted_target_hw)
+    """
+    estimate = estimate_job_memory(element_shape, target_shape, engine, block_size)
+    target_h, target_w = target_shape[:2]
+
+    if estimate <= MAX_JOB_MEMORY_BYTES:
+        return True, estimate, (target_h, target_w)
+
+    # Memory grows with target area, so scale both sides by the square root of the ratio
+    scale = ((MAX_JOB_MEMORY_BYTES - MEMORY_COST_OVERHEAD) / (estimate - MEMORY_COST_OVERHEAD)) ** 0.5
+    step = block_size if engine != 'legacy' and block_size else 1
+    adjusted_h = max(step, int(target_h * scale) // step * step)
+    adjusted_w = max(step, int(target_w * scale) // step * step)
+
+    return False, estimate, (adjusted_h, adjusted_w)
@@ -0,0 +1,108 @@
+"""
+Atomic file writes and a write-behind pool for encoding outputs in the background.
+"""
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import OUTPUT_WRITER_WORKERS
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=OUTPUT_WRITER_WORKERS, thread_name_prefix='output-writer')
+
+# Pending writes keyed by absolute destination path
+_pending = {}
+_pending_lock = threading.Lock()
+
+def atomic_write(path, write):
+    """
+    Write a file through a temporary file in the same folder, then rename it into place.
+
+    Readers see either no file or the complete file, never a partial one.
+
+    Args:
+        path: destination path
+        write: function writing the file to the temporary path it is given
+
+    Returns:
+        str: destination path
+    """
+    # Keep the extension so writers that pick the format from it still work
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.', suffix=os.path.splitext(path)[1])
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return path
+
+def write_behind(path, write, *args):
+    """
+    Queue a write on the background writer pool.
+
+    Until the write finishes the path is pending: is_pending() reports it and
+    wait_for_write() blocks on it. The write itself should be atomic (as
+    save_image is), so the file appears complete or not at all. A failed
+    write is logged; callers that need to react to it add their own done
+    callback to the returned future.
+
+    Args:
+        path: destination path
+        write: function writing the file
+        *args: arguments passed to write
+
+    Returns:
+        Future: resolves to the return value of write
+    """
+    key = os.path.abspath(path)
+    with _pending_lock:
+        future = _executor.submit(write, *args)
+        _pending[key] = future
+
+    def done(_):
+        with _pending_lock:
+            if _pending.get(key) is future:
+                del _pending[key]
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('Background write to %s failed', key, exc_info=future.exception())
+
+    future.add_done_callback(done)
+    return future
+
+def is_pending(path):
+    """
+    Check whether a background write to a path has not finished yet.
+
+    Args:
+        path: destination path
+
+    Returns:
+        bool: True while the write is queued or running
+    """
+    with _pending_lock:
+        future = _pending.get(os.path.abspath(path))
+    return future is not None and not future.done()
+
+def wait_for_write(path, timeout=None):
+    """
+    Wait for a pending background write to a path.
+
+    Failed writes count as finished; the file is then simply missing.
+
+    Args:
+        path: destination path
+        timeout: seconds to wait, or None to wait indefinitely
+
+    Returns:
+        bool: True if no write is pending any more, False on timeout
+    """
+    with _pending_lock:
+        future = _pending.get(os.path.abspath(path))
+    if future is None:
+        return True
+    done, _ = wait([future], timeout=timeout)
+    return bool(done)
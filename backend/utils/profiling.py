@@ -0,0 +1,142 @@
+"""
+Utility functions for on-demand request profiling.
+"""
+import hmac
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+from config import PROFILES_FOLDER, PROFILING_ADMIN_TOKEN
+
+PROFILE_ID_PATTERN = re.compile(r'^[0-9]{8}T[0-9]{6}_[0-9a-f]{8}$')
+PROFILE_SORT_KEYS = {'cumulative', 'tottime', 'ncalls'}
+
+def is_profiling_requested(request):
+    """
+    Check if a request asks to be profiled.
+
+    Args:
+        request: Flask request object
+
+    Returns:
+        bool: True if the profile flag or header is set
+    """
+    return request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'
+
+def is_admin_request(request):
+    """
+    Check if a request carries the admin token.
+
+    Args:
+        request: Flask request object
+
+    Returns:
+        bool: True if profiling is enabled and the token matches
+    """
+    if not PROFILING_ADMIN_TOKEN:
+        return False
+    token = request.headers.get('X-Admin-Token', '')
+    return hmac.compare_digest(token.encode(), PROFILING_ADMIN_TOKEN.encode())
+
+def save_profile(profiler, method, path, route, elapsed):
+    """
+    Dump a finished profiler to the profiles folder.
+
+    Args:
+        profiler: disabled cProfile.Profile instance
+        method: HTTP method of the profiled request
+        path: request path
+        route: URL rule of the request
+        elapsed: wall-clock duration in seconds
+
+    Returns:
+        str: profile ID
+    """
+    profile_id = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}_{uuid.uuid4().hex[:8]}"
+    profiler.dump_stats(os.path.join(PROFILES_FOLDER, f"{profile_id}.prof"))
+
+    metadata = {
+        'profile_id': profile_id,
+        'method': method,
+        'path': path,
+        'route': route,
+        'elapsed': elapsed,
+        'created': time.time()
+    }
+    with open(os.path.join(PROFILES_FOLDER, f"{profile_id}.json"), 'w') as f:
+        json.dump(metadata, f)
+
+    return profile_id
+
+def get_profile_path(profile_id):
+    """
+    Get the pstats dump path for a profile ID.
+
+    Args:
+        profile_id: profile ID
+
+    Returns:
+        str: path to the dump, or None if the ID is invalid or unknown
+    """
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = os.path.join(PROFILES_FOLDER, f"{profile_id}.prof")
+    return path if os.path.exists(path) else None
+
+def list_profiles():
+    """
+    List saved profiles, newest first.
+
+    Returns:
+        list: profile metadata dictionaries
+    """
+    profiles = []
+    for filename in os.listdir(PROFILES_FOLDER):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(PROFILES_FOLDER, filename)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    profiles.sort(key=lambda p: p.get('created', 0), reverse=True)
+    return profiles
+
+def summarize_profile(path, top_n=25, sort_by='cumulative'):
+    """
+    Summarize the most expensive functions in a pstats dump.
+
+    Args:
+        path: path to the pstats dump
+        top_n: number of functions to return
+        sort_by: 'cumulative', 'tottime' or 'ncalls'
+
+    Returns:
+        dict: totals and a list of the top functions
+    """
+    stats = pstats.Stats(path)
+
+    functions = []
+    for (filename, line, name), (primitive_calls, total_calls, tottime, cumtime, _) in stats.stats.items():
+        functions.append({
+            'function': name,
+            'file': filename,
+            'line': line,
+            'ncalls': total_calls,
+            'primitive_calls': primitive_calls,
+            'tottime': tottime,
+            'cumtime': cumtime,
+            'percall_cumtime': cumtime / total_calls if total_calls else 0.0
+        })
+
+    sort_field = {'cumulative': 'cumtime', 'tottime': 'tottime', 'ncalls': 'ncalls'}[sort_by]
+    functions.sort(key=lambda f: f[sort_field], reverse=True)
+
+    return {
+        'total_calls': stats.total_calls,
+        'total_time': stats.total_tt,
+        'sort_by': sort_by,
+        'functions': functions[:top_n]
+    }
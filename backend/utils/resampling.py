@@ -0,0 +1,165 @@
+"""
+Central image resizing with a resampling kernel chosen per use-case tier.
+
+Three tiers are configured in RESIZE_TIERS: 'final' for images that are
+kept or matched against, 'preview' for thumbnails and 'metric' for aligning
+images before quality metrics. Within a tier the kernel depends on the scale:
+
+- integer upscales (every source pixel becomes a k x k block) use nearest
+  neighbour, which is exact and the cheapest;
+- downscales at or below the tier's area_below factor use cv2 INTER_AREA,
+  which averages whole source pixels and does not alias;
+- everything else uses the tier's kernel.
+"""
+import time
+import numpy as np
+import cv2
+from PIL import Image
+from config import RESIZE_TIERS, DECODE_REDUCING_GAP
+
+# Kernel name -> cv2 interpolation flag
+CV2_KERNELS = {
+    'area': cv2.INTER_AREA,
+    'linear': cv2.INTER_LINEAR,
+    'nearest': cv2.INTER_NEAREST,
+    'lanczos': cv2.INTER_LANCZOS4
+}
+
+# Kernel name -> Pillow filter, for images cv2 cannot take
+PIL_KERNELS = {
+    'area': Image.BOX,
+    'linear': Image.BILINEAR,
+    'nearest': Image.NEAREST,
+    'lanczos': Image.LANCZOS
+}
+
+def select_kernel(source_size, size, tier='final'):
+    """
+    Choose the resampling kernel for a resize.
+
+    Args:
+        source_size: (width, height) of the image
+        size: (width, height) to resize to
+        tier: 'final', 'preview' or 'metric' (see RESIZE_TIERS)
+
+    Returns:
+        str: 'nearest', 'area', 'linear' or 'lanczos'
+    """
+    settings = RESIZE_TIERS[tier]
+    (source_w, source_h), (width, height) = source_size, size
+
+    if settings.get('integer_nearest') and width % source_w == 0 and width // source_w >= 2 and width // source_w * source_h == height:
+        return 'nearest'
+
+    area_below = settings.get('area_below')
+    if area_below and max(width / source_w, height / source_h) <= area_below:
+        return 'area'
+
+    return settings['kernel']
+
+def reduce_image(img, size):
+    """
+    Box-reduce a PIL image by the largest integer factor that keeps it at least
+    DECODE_REDUCING_GAP times the final size, so that the following LANCZOS
+    resize works on far fewer pixels without a visible loss of quality.
+
+    Args:
+        img: PIL Image
+        size: (width, height) the image will finally be resized to
+
+    Returns:
+        PIL Image: reduced image (the same image if no reduction applies)
+    """
+    factor = min(img.width // (size[0] * DECODE_REDUCING_GAP), img.height // (size[1] * DECODE_REDUCING_GAP))
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img
+
+def _resize_pil(img, size, kernel):
+    """Resize a PIL Image; cv2 handles area averaging of 8-bit images, Pillow the rest"""
+    if kernel == 'area' and img.mode in ('L', 'RGB', 'RGBA'):
+        return Image.fromarray(cv2.resize(np.asarray(img), size, interpolation=cv2.INTER_AREA), img.mode)
+    if kernel == 'lanczos':
+        img = reduce_image(img, size)
+    return img.resize(size, PIL_KERNELS[kernel])
+
+def _resize_array(img, size, kernel):
+    """Resize a numpy image; 8-bit LANCZOS goes through Pillow to match PIL images"""
+    if kernel == 'lanczos' and img.dtype == np.uint8 and (img.ndim == 2 or img.shape[2] in (3, 4)):
+        return np.asarray(_resize_pil(Image.fromarray(img), size, kernel))
+    return cv2.resize(img, size, interpolation=CV2_KERNELS[kernel])
+
+def resize(img, size, tier='final', kernel=None):
+    """
+    Resize an image with the kernel its tier selects for this scale.
+
+    Args:
+        img: PIL Image or numpy array
+        size: (width, height) to resize to
+        tier: 'final', 'preview' or 'metric' (see RESIZE_TIERS)
+        kernel: explicit kernel overriding the tier's choice
+
+    Returns:
+        PIL Image or numpy array (same type as img)
+    """
+    size = (int(size[0]), int(size[1]))
+    is_pil = isinstance(img, Image.Image)
+    source_size = img.size if is_pil else (img.shape[1], img.shape[0])
+    if source_size == size:
+        return img
+
+    kernel = kernel or select_kernel(source_size, size, tier)
+    if is_pil:
+        return _resize_pil(img, size, kernel)
+    return _resize_array(img, size, kernel)
+
+def benchmark_kernels(img, size, reference='lanczos', kernels=('nearest', 'area', 'linear', 'lanczos'), repeats=5):
+    """
+    Time every kernel on one resize and measure its distance from a reference kernel.
+
+    Args:
+        img: uint8 numpy image
+        size: (width, height) to resize to
+        reference: kernel whose output counts as correct for this case
+        kernels: kernels to compare
+        repeats: timed runs per kernel (the fastest counts)
+
+    Returns:
+        dict: per kernel, the best time in milliseconds and the mean absolute
+              difference from the reference result
+    """
+    reference = resize(img, size, kernel=reference).astype(np.float32)
+    results = {}
+    for kernel in kernels:
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            output = resize(img, size, kernel=kernel)
+            times.append(time.perf_counter() - start)
+        results[kernel] = {
+            'time_ms': min(times) * 1000,
+            'mean_abs_diff': float(np.abs(output.astype(np.float32) - reference).mean())
+        }
+    return results
+
+if __name__ == '__main__':
+    import json
+
+    # Synthetic benchmark (run from backend/ with python -m utils.resampling):
+    # a smooth photo-like image and a blocky mosaic-like one. Photos are
+    # compared with LANCZOS; block averages and block replication are exact
+    # for mosaics, so those cases are compared with area and nearest.
+    rng = np.random.default_rng(0)
+    photo = cv2.resize(rng.integers(0, 256, (300, 400, 3), dtype=np.uint8), (4000, 3000), interpolation=cv2.INTER_CUBIC)
+    blocks = np.kron(rng.integers(0, 256, (128, 128, 3), dtype=np.uint8), np.ones((8, 8, 1), dtype=np.uint8))
+
+    cases = {
+        'photo 4000x3000 -> 128 (large downscale)': (photo, (128, 96), 'lanczos'),
+        'photo 4000x3000 -> 2000 (2x downscale)': (photo, (2000, 1500), 'lanczos'),
+        'photo 4000x3000 -> 3000 (mild downscale)': (photo, (3000, 2250), 'lanczos'),
+        'mosaic 1024 -> 256 (thumbnail)': (blocks, (256, 256), 'area'),
+        'mosaic 1024 -> 128 (metric alignment)': (blocks, (128, 128), 'area'),
+        'target 128 -> 1024 (integer upscale)': (blocks[::8, ::8], (1024, 1024), 'nearest')
+    }
+    report = {name: benchmark_kernels(img, size, reference) for name, (img, size, reference) in cases.items()}
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,236 @@
+"""
+In-process server performance metrics rendered in Prometheus text format.
+"""
+import os
+import threading
+import time
+from config import (
+    UPLOAD_FOLDER, TEMP_FOLDER, OUTPUT_FOLDER, VARIANT_FOLDER,
+    REQUEST_LATENCY_BUCKETS, STORAGE_METRICS_TTL
+)
+
+# All counters live in this process; the lock keeps them consistent under threaded servers
+_lock = threading.Lock()
+_latency = {}          # (route, method) -> {'buckets': [...], 'sum': float, 'count': int}
+_requests_total = {}   # (route, method, status) -> int
+_in_flight = {}        # route -> int
+_cache_stats = {}      # cache name -> {'hits': int, 'misses': int}
+_storage_snapshot = {'timestamp': 0.0, 'sizes': {}}
+
+STORAGE_FOLDERS = {
+    'uploads': UPLOAD_FOLDER,
+    'temp': TEMP_FOLDER,
+    'outputs': OUTPUT_FOLDER,
+    'variants': VARIANT_FOLDER
+}
+
+def start_request(route):
+    """
+    Mark a request as in flight.
+
+    Args:
+        route: route label (URL rule) of the request
+    """
+    with _lock:
+        _in_flight[route] = _in_flight.get(route, 0) + 1
+
+def finish_request(route, method, status, elapsed):
+    """
+    Record a finished request in the latency histogram.
+
+    Args:
+        route: route label (URL rule) of the request
+        method: HTTP method
+        status: HTTP status code of the response
+        elapsed: request duration in seconds
+    """
+    with _lock:
+        _in_flight[route] = max(0, _in_flight.get(route, 0) - 1)
+
+        histogram = _latency.setdefault((route, method), {
+            'buckets': [0] * len(REQUEST_LATENCY_BUCKETS),
+            'sum': 0.0,
+            'count': 0
+        })
+        for i, bound in enumerate(REQUEST_LATENCY_BUCKETS):
+            if elapsed <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += elapsed
+        histogram['count'] += 1
+
+        key = (route, method, str(status))
+        _requests_total[key] = _requests_total.get(key, 0) + 1
+
+def record_cache_hit(cache_name):
+    """
+    Count a hit for a named in-process cache.
+
+    Args:
+        cache_name: name of the cache
+    """
+    with _lock:
+        stats = _cache_stats.setdefault(cache_name, {'hits': 0, 'misses': 0})
+        stats['hits'] += 1
+
+def record_cache_miss(cache_name):
+    """
+    Count a miss for a named in-process cache.
+
+    Args:
+        cache_name: name of the cache
+    """
+    with _lock:
+        stats = _cache_stats.setdefault(cache_name, {'hits': 0, 'misses': 0})
+        stats['misses'] += 1
+
+def get_folder_size(folder):
+    """
+    Calculate the total size of the files directly inside a folder.
+
+    Args:
+        folder: path to the folder
+
+    Returns:
+        int: total size in bytes
+    """
+    total = 0
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    except FileNotFoundError:
+        return 0
+    return total
+
+def get_storage_sizes():
+    """
+    Get the size of each static folder, rescanning at most every STORAGE_METRICS_TTL seconds.
+
+    Returns:
+        dict: folder label -> size in bytes
+    """
+    now = time.monotonic()
+    if now - _storage_snapshot['timestamp'] >= STORAGE_METRICS_TTL or not _storage_snapshot['sizes']:
+        _storage_snapshot['sizes'] = {label: get_folder_size(folder) for label, folder in STORAGE_FOLDERS.items()}
+        _storage_snapshot['timestamp'] = now
+    return _storage_snapshot['sizes']
+
+def get_process_rss():
+    """
+    Get the resident set size of the current process.
+
+    Returns:
+        int: RSS in bytes, or None if it cannot be determined
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    # Fall back to peak RSS where /proc is unavailable (kilobytes on Linux, bytes on macOS)
+    try:
+        import resource
+        import sys
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    except (ImportError, OSError):
+        return None
+
+def _escape_label(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(**labels):
+    """Format a label set for the Prometheus text format"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels.items()) + '}'
+
+def render_prometheus(job_states):
+    """
+    Render all server metrics in the Prometheus text exposition format.
+
+    Args:
+        job_states: Dictionary of job states
+
+    Returns:
+        str: metrics document
+    """
+    lines = []
+
+    with _lock:
+        latency = {key: {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+                   for key, value in _latency.items()}
+        requests_total = dict(_requests_total)
+        in_flight = dict(_in_flight)
+        cache_stats = {name: dict(stats) for name, stats in _cache_stats.items()}
+
+    # Request latency histograms per route
+    lines.append('# HELP mosaic_http_request_duration_seconds Request latency by route.')
+    lines.append('# TYPE mosaic_http_request_duration_seconds histogram')
+    for (route, method), histogram in sorted(latency.items()):
+        for bound, count in zip(REQUEST_LATENCY_BUCKETS, histogram['buckets']):
+            labels = _format_labels(route=route, method=method, le=bound)
+            lines.append(f'mosaic_http_request_duration_seconds_bucket{labels} {count}')
+        labels = _format_labels(route=route, method=method, le='+Inf')
+        lines.append(f'mosaic_http_request_duration_seconds_bucket{labels} {histogram["count"]}')
+        labels = _format_labels(route=route, method=method)
+        lines.append(f'mosaic_http_request_duration_seconds_sum{labels} {histogram["sum"]:.6f}')
+        lines.append(f'mosaic_http_request_duration_seconds_count{labels} {histogram["count"]}')
+
+    lines.append('# HELP mosaic_http_requests_total Finished requests by route and status.')
+    lines.append('# TYPE mosaic_http_requests_total counter')
+    for (route, method, status), count in sorted(requests_total.items()):
+        labels = _format_labels(route=route, method=method, status=status)
+        lines.append(f'mosaic_http_requests_total{labels} {count}')
+
+    lines.append('# HELP mosaic_http_requests_in_flight Requests currently being served by route.')
+    lines.append('# TYPE mosaic_http_requests_in_flight gauge')
+    for route, count in sorted(in_flight.items()):
+        lines.append(f'mosaic_http_requests_in_flight{_format_labels(route=route)} {count}')
+
+    # Job counts by status
+    status_counts = {}
+    for state in list(job_states.values()):
+        status = state.get('status', 'unknown')
+        status_counts[status] = status_counts.get(status, 0) + 1
+
+    lines.append('# HELP mosaic_jobs Jobs currently held in memory by status.')
+    lines.append('# TYPE mosaic_jobs gauge')
+    for status, count in sorted(status_counts.items()):
+        lines.append(f'mosaic_jobs{_format_labels(status=status)} {count}')
+
+    # Storage used by the static folders
+    lines.append('# HELP mosaic_storage_bytes Bytes stored in each static folder.')
+    lines.append('# TYPE mosaic_storage_bytes gauge')
+    for folder, size in sorted(get_storage_sizes().items()):
+        lines.append(f'mosaic_storage_bytes{_format_labels(folder=folder)} {size}')
+
+    # Cache effectiveness
+    lines.append('# HELP mosaic_cache_requests_total Cache lookups by cache and result.')
+    lines.append('# TYPE mosaic_cache_requests_total counter')
+    for name, stats in sorted(cache_stats.items()):
+        lines.append(f'mosaic_cache_requests_total{_format_labels(cache=name, result="hit")} {stats["hits"]}')
+        lines.append(f'mosaic_cache_requests_total{_format_labels(cache=name, result="miss")} {stats["misses"]}')
+
+    lines.append('# HELP mosaic_cache_hit_ratio Fraction of cache lookups that were hits.')
+    lines.append('# TYPE mosaic_cache_hit_ratio gauge')
+    for name, stats in sorted(cache_stats.items()):
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0.0
+        lines.append(f'mosaic_cache_hit_ratio{_format_labels(cache=name)} {ratio:.6f}')
+
+    # Process memory
+    rss = get_process_rss()
+    if rss is not None:
+        lines.append('# HELP mosaic_process_resident_memory_bytes Resident set size of the server process.')
+        lines.append('# TYPE mosaic_process_resident_memory_bytes gauge')
+        lines.append(f'mosaic_process_resident_memory_bytes {rss}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,156 @@
+"""
+Zero-copy representation of an image made of one repeated tile.
+"""
+import struct
+import zlib
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+class TiledImage:
+    """
+    Read-only image that repeats a single tile over a grid.
+
+    The pixels are a strided view of the tile with zero strides along the
+    grid axes, so the image costs no more memory than the tile itself.
+    Full arrays are only built by np.asarray(); encoders should iterate
+    over row bands instead.
+    """
+    __slots__ = ('tile', 'grid_shape', 'blocks')
+
+    def __init__(self, tile, grid_shape):
+        """
+        Args:
+            tile: 2D grayscale or RGB tile (numpy array)
+            grid_shape: tuple (H, W) number of tiles vertically and horizontally
+        """
+        self.tile = np.ascontiguousarray(tile)
+        self.grid_shape = (int(grid_shape[0]), int(grid_shape[1]))
+
+        H, W = self.grid_shape
+        N, M = self.tile.shape[:2]
+        strides = self.tile.strides
+
+        # (H, N, W, M[, C]) view in which every grid cell aliases the same tile
+        self.blocks = as_strided(
+            self.tile,
+            shape=(H, N, W, M) + self.tile.shape[2:],
+            strides=(0, strides[0], 0, strides[1]) + strides[2:],
+            writeable=False
+        )
+
+    @property
+    def shape(self):
+        H, W = self.grid_shape
+        N, M = self.tile.shape[:2]
+        return (H * N, W * M) + self.tile.shape[2:]
+
+    @property
+    def dtype(self):
+        return self.tile.dtype
+
+    @property
+    def ndim(self):
+        return self.tile.ndim
+
+    @property
+    def nbytes(self):
+        """Memory held, which is only the tile"""
+        return self.tile.nbytes
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def row_band(self):
+        """
+        Materialise one row of tiles.
+
+        Returns:
+            numpy array: (N, W * M[, C]) band, identical for every grid row
+        """
+        W = self.grid_shape[1]
+        N, M = self.tile.shape[:2]
+        return self.blocks[0].reshape((N, W * M) + self.tile.shape[2:])
+
+    def iter_row_bands(self):
+        """
+        Iterate over the image one row of tiles at a time.
+
+        Yields:
+            numpy array: the same read-only band for each grid row
+        """
+        band = self.row_band()
+        band.flags.writeable = False
+        for _ in range(self.grid_shape[0]):
+            yield band
+
+    def map_tile(self, func):
+        """
+        Apply a per-pixel operation to the tile and re-tile the result.
+
+        Args:
+            func: function from tile array to tile array
+
+        Returns:
+            TiledImage: new tiled image over the same grid
+        """
+        return TiledImage(func(self.tile), self.grid_shape)
+
+    def __array__(self, dtype=None, copy=None):
+        H, W = self.grid_shape
+        reps = (H, W) + (1,) * (self.tile.ndim - 2)
+        full = np.tile(self.tile, reps)
+        return full if dtype is None else full.astype(dtype)
+
+def _write_png_chunk(f, chunk_type, data):
+    """Write a single length-prefixed, CRC-terminated PNG chunk"""
+    f.write(struct.pack('>I', len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+def save_tiled_png(tiled_img, path, compress_level=6):
+    """
+    Encode a uint8 TiledImage as PNG without materialising the full image.
+
+    Every row band is identical, so its filtered scanlines are built once
+    and fed to a streaming zlib compressor for each grid row.
+
+    Args:
+        tiled_img: TiledImage with uint8 grayscale, RGB or RGBA tiles
+        path: path to save the image
+        compress_level: zlib compression level (0-9)
+
+    Returns:
+        str: path where the image was saved
+    """
+    if tiled_img.dtype != np.uint8:
+        raise ValueError(f"Streaming PNG encoding requires uint8 tiles, got {tiled_img.dtype}")
+
+    height, width = tiled_img.shape[:2]
+    channels = tiled_img.shape[2] if tiled_img.ndim == 3 else 1
+    color_types = {1: 0, 2: 4, 3: 2, 4: 6}
+    if channels not in color_types:
+        raise ValueError(f"Unsupported number of channels: {channels}")
+
+    # Prefix each scanline of the band with filter type 0 (None)
+    band = tiled_img.row_band().reshape(tiled_img.tile.shape[0], width * channels)
+    scanlines = np.empty((band.shape[0], band.shape[1] + 1), dtype=np.uint8)
+    scanlines[:, 0] = 0
+    scanlines[:, 1:] = band
+    band_bytes = scanlines.tobytes()
+
+    compressor = zlib.compressobj(compress_level)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        _write_png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_types[channels], 0, 0, 0))
+
+        for _ in range(tiled_img.grid_shape[0]):
+            data = compressor.compress(band_bytes)
+            if data:
+                _write_png_chunk(f, b'IDAT', data)
+
+        _write_png_chunk(f, b'IDAT', compressor.flush())
+        _write_png_chunk(f, b'IEND', b'')
+
+    return path
@@ -85,6 +85,60 @@ def validate_filter(filter_name):
     
     return True, filter_name
 
+def validate_color_method(color_method):
+    """
+    Validate colour matching method.
+    
+    Args:
+        color_method: Name of the colour matching method
+        
+    Returns:
+        tuple: (is_valid, error_message or color_method)
+    """
+    from config import AVAILABLE_COLOR_METHODS
+    
+    if color_method not in AVAILABLE_COLOR_METHODS:
+        return False, f'Invalid color method. Available methods: {", ".join(AVAILABLE_COLOR_METHODS.keys())}'
+    
+    return True, color_method
+
+def validate_engine(engine):
+    """
+    Validate mosaic engine name.
+    
+    Args:
+        engine: Name of the mosaic engine
+        
+    Returns:
+        tuple: (is_valid, error_message or engine)
+    """
+    from config import AVAILABLE_ENGINES
+    
+    if engine not in AVAILABLE_ENGINES:
+        return False, f'Invalid engine. Available engines: {", ".join(AVAILABLE_ENGINES.keys())}'
+    
+    return True, engine
+
+def validate_alpha(alpha):
+    """
+    Validate colour adjustment alpha.
+    
+    Args:
+        alpha: Blending factor (0 = no adjustment, 1 = full target colour)
+        
+    Returns:
+        tuple: (is_valid, error_message or alpha)
+    """
+    try:
+        alpha = float(alpha)
+    except (ValueError, TypeError):
+        return False, 'Invalid alpha. Must be a number.'
+    
+    if not 0 <= alpha <= 1:
+        return False, 'Alpha must be between 0 and 1'
+    
+    return True, alpha
+
 def validate_job_id(job_id, job_states):
     """
     Validate job ID.